@@ -2,7 +2,7 @@ import logging
 import os
 import re
 from copy import deepcopy
-from functools import cache, cmp_to_key, total_ordering
+from functools import cache, total_ordering
 from itertools import combinations
 from typing import (
     Any,
@@ -18,6 +18,8 @@ from typing import (
     Union,
 )
 
+from lazyglob import HeaderSet
+
 PREGENERATED_LOCATION = "<pregenerated>"
 
 BazelTargetStrings = Dict[str, List[str]]
@@ -97,56 +99,49 @@ def _getPrefix(
     return f"//{loc}" if loc != location else ""
 
 
+def _renderedLabel(
+    d: Union["BaseBazelTarget", "BazelCCImport"], location: str, defaultPrefix: str
+) -> str:
+    key = (location, defaultPrefix)
+    cached = d._renderedLabels.get(key)
+    # The name and the location of a target can still change after it's been rendered
+    if cached is not None and cached[0] == d.name and cached[1] == d.location:
+        return cached[2]
+    label = f"{_getPrefix(d, location, defaultPrefix)}{d.targetName()}"
+    d._renderedLabels[key] = (d.name, d.location, label)
+    return label
+
+
+def depSortKey(label: str) -> Tuple[int, str]:
+    """Sort key of a rendered label: local targets, then external ones, then the rest."""
+    first = label[0]
+    if first == ":":
+        return (0, label)
+    if first == "@":
+        return (1, label)
+    return (2, label)
+
+
 def compare_deps(
     obja: Union["BazelCCImport", "BaseBazelTarget"],
     objb: Union["BazelCCImport", "BaseBazelTarget"],
     __getPrefix=Callable[[Union["BazelCCImport", "BaseBazelTarget"]], str],
 ) -> int:
-    a = f"{__getPrefix(obja)}{obja.targetName()}"
-    b = f"{__getPrefix(objb)}{objb.targetName()}"
-    ret = 0
-    if a[0] == b[0]:
-        if a == b:
-            ret = 0
-        elif a > b:
-            ret = 1
-        else:
-            ret = -1
-    elif a[0] == ":":
-        ret = -1
-    elif b[0] == ":":
-        # a > b
-        ret = 1
-    elif b[0] == "@":
-        # a > b
-        ret = 1
-    elif a[0] == "@":
-        ret = -1
-    return ret
+    a = depSortKey(f"{__getPrefix(obja)}{obja.targetName()}")
+    b = depSortKey(f"{__getPrefix(objb)}{objb.targetName()}")
+    return (a > b) - (a < b)
+
+
+def importSortKey(load: str) -> Tuple[bool, str]:
+    # get rid of load(", external repositories first
+    key = load[6:].replace(":", "\x00").replace("/", "\x01")
+    return (key[0] != "@", key)
 
 
 def compare_imports(a, b):
-    # get rid of load("
-    a = a[6:].replace(":", "\x00").replace("/", "\x01")
-    b = b[6:].replace(":", "\x00").replace("/", "\x01")
-    ret = 0
-    if a[0] == b[0]:
-        if a == b:
-            ret = 0
-        elif a > b:
-            ret = 1
-        else:
-            ret = -1
-    elif b[0] == "@":
-        # a > b
-        ret = 1
-    elif a[0] == "@":
-        # a < b
-        ret = -1
-    else:
-        assert False
-        ret = 1
-    return ret
+    a = importSortKey(a)
+    b = importSortKey(b)
+    return (a > b) - (a < b)
 
 
 IncludeDir = tuple[str, bool]
@@ -187,7 +182,7 @@ class BazelCCImport:
     def __init__(self, name: str):
         self.name = name
         self.system_provided = 0
-        self.hdrs: list[str] = []
+        self.hdrs: Union[List[str], HeaderSet] = []
         self._deps: set[Union["BazelCCImport", "BaseBazelTarget"]] = set()
         self.staticLibrary: Optional[str] = None
         self.sharedLibrary: Optional[str] = None
@@ -195,6 +190,7 @@ class BazelCCImport:
         self.skipWrapping = False
         self.includes: Optional[List[str]] = None
         self.alias: Optional[str] = None
+        self._renderedLabels: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
 
     def setAlias(self, alias: str):
         self.alias = alias
@@ -212,14 +208,14 @@ class BazelCCImport:
         self._deps = set()
         for d in deps:
             if type(d) is str:
-                logging.info(f"Adding dep {d}")
+                logging.debug("Adding dep %s", d)
                 matches = re.match(r"(.*):(.+)", d)
                 if not matches:
                     raise AttributeError(f"Error parsing dep {d} as a bazel dependency")
                 location = matches.group(1)
                 name = matches.group(2)
                 (location, name) = d.split(":")
-                bazDep = getObject(BazelExternalDep, name, location)
+                bazDep = BazelExternalDep(name, location)
                 self._deps.add(bazDep)
             else:
                 assert not isinstance(d, str)
@@ -229,7 +225,7 @@ class BazelCCImport:
     def setSkipWrapping(self, skipWrapping: bool):
         self.skipWrapping = skipWrapping
 
-    def setHdrs(self, hdrs: List[str]):
+    def setHdrs(self, hdrs: Union[List[str], HeaderSet]):
         self.hdrs = hdrs
 
     def setSystemProvided(self):
@@ -395,6 +391,10 @@ class BazelCCImport:
         else:
             return f":{self.name}"
 
+    def renderedLabel(self, location: str, defaultPrefix: str) -> str:
+        """The label of this target as written in a BUILD file of location."""
+        return _renderedLabel(self, location, defaultPrefix)
+
 
 PostProcess = Callable[[List[str]], List[str]]
 
@@ -404,8 +404,8 @@ def find_common_subsets(arrays: List[Set[T]]) -> List[Set[T]]:
     common_sets = {}
 
     lowerBound = int(n * 0.95)
-    logging.info(f"Lower bound is {lowerBound}")
-    logging.info(range(lowerBound, n))
+    logging.debug("Lower bound is %s", lowerBound)
+    logging.debug(range(lowerBound, n))
     # Check for common elements in all possible combinations of arrays
     for r in range(lowerBound, n + 1):  # At least 2 arrays should have common items
         for subset in combinations(range(n), r):
@@ -416,7 +416,7 @@ def find_common_subsets(arrays: List[Set[T]]) -> List[Set[T]]:
             if intersect_set:
                 common_sets[frozenset(subset)] = intersect_set
 
-    logging.info(f"Common sets {common_sets}")
+    logging.debug("Common sets %s", common_sets)
 
     # Deduplicate: Remove subsets that are already covered in larger sets
     unique_results = {}
@@ -437,9 +437,115 @@ def find_common_subset(sets: List[Set[T]]) -> Set[T]:
     return common
 
 
+class BazelTargetSet(set):
+    """The targets of a BazelBuild, indexed by name and by (location, name)."""
+
+    def __init__(
+        self, targets: Iterable[Union["BaseBazelTarget", "BazelCCImport"]] = ()
+    ):
+        super().__init__()
+        self._byName: Dict[str, Set[Union["BaseBazelTarget", "BazelCCImport"]]] = {}
+        self._byLabel: Dict[
+            Tuple[str, str], Union["BaseBazelTarget", "BazelCCImport"]
+        ] = {}
+        self.update(targets)
+
+    def add(self, target: Union["BaseBazelTarget", "BazelCCImport"]) -> None:
+        if target in self:
+            return
+        super().add(target)
+        self._byName.setdefault(target.name, set()).add(target)
+        self._byLabel.setdefault((target.location, target.name), target)
+
+    def update(
+        self, *others: Iterable[Union["BaseBazelTarget", "BazelCCImport"]]
+    ) -> None:
+        for targets in others:
+            for target in targets:
+                self.add(target)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def discard(self, target: Union["BaseBazelTarget", "BazelCCImport"]) -> None:
+        if target not in self:
+            return
+        # Remove the instance that was indexed, not the one that is equal to it
+        for stored in self._byName.get(target.name, ()):
+            if hash(stored) == hash(target) and stored == target:
+                target = stored
+                break
+        super().discard(target)
+        named = self._byName.get(target.name)
+        if named is not None:
+            named.discard(target)
+            if not named:
+                del self._byName[target.name]
+        if self._byLabel.get((target.location, target.name)) is target:
+            del self._byLabel[(target.location, target.name)]
+
+    def remove(self, target: Union["BaseBazelTarget", "BazelCCImport"]) -> None:
+        if target not in self:
+            raise KeyError(target)
+        self.discard(target)
+
+    def pop(self) -> Union["BaseBazelTarget", "BazelCCImport"]:
+        target = next(iter(self))
+        self.discard(target)
+        return target
+
+    def clear(self) -> None:
+        super().clear()
+        self._byName.clear()
+        self._byLabel.clear()
+
+    def withName(self, name: str) -> Set[Union["BaseBazelTarget", "BazelCCImport"]]:
+        return self._byName.get(name, set())
+
+    def get(
+        self, location: str, name: str
+    ) -> Optional[Union["BaseBazelTarget", "BazelCCImport"]]:
+        return self._byLabel.get((location, name))
+
+
+class TargetRegistry:
+    """The Bazel targets created during one conversion.
+
+    Targets are keyed by their class and constructor arguments (ie. (cls, name, location),
+    (cls, type, name, location) for BazelTarget) so that asking twice for the same target
+    returns the same object. It also holds the exported files and the proto names that
+    must be unique within a conversion.
+    """
+
+    def __init__(self):
+        self._objects: Dict[Tuple[Any, ...], Any] = {}
+        self.staticFiles: Dict[str, "ExportedFile"] = {}
+        self.protoNames: Dict[str, str] = {}
+        # The values of protoNames, to check quickly if a name is already taken
+        self.protoNameValues: Set[str] = set()
+
+    def getObject(self, cls: Type[T], *kargs: str) -> T:
+        key = (cls, *kargs)
+        obj = self._objects.get(key)
+        if obj is not None:
+            logging.debug("Cache hit for %s %s", key, type(obj))
+            assert isinstance(obj, cls)
+            return obj
+        obj = cls(*kargs)  # type: ignore
+        self._objects[key] = obj
+        return obj
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+
 class BazelBuild:
-    def __init__(self: "BazelBuild", prefix: str):
-        self.bazelTargets: Set[Union["BaseBazelTarget", "BazelCCImport"]] = set()
+    def __init__(
+        self: "BazelBuild", prefix: str, registry: Optional[TargetRegistry] = None
+    ):
+        self.bazelTargets: BazelTargetSet = BazelTargetSet()
+        self.registry = registry if registry is not None else TargetRegistry()
         self.prefix = prefix
         self.postProcess: Dict[str, PostProcess] = {}
         self.commonFlags: Dict[str, CompilationFlags] = {}
@@ -459,7 +565,7 @@ class BazelBuild:
                     allCopt.append(t.copts)
             if len(allCopt) > 0:
                 inCommon = find_common_subset(allCopt)
-                logging.debug(f"In common {inCommon}")
+                logging.debug("In common %s", inCommon)
 
     def addPostProcess(
         self, targetName: str, targetLocation: str, postProcessCallback: PostProcess
@@ -537,7 +643,7 @@ class BazelBuild:
                 if len(items):
                     body.append(f"# Location {location}")
                 if location == "src":
-                    logging.info(t)
+                    logging.debug(t)
                 for k, v2 in items:
                     # Do post processing here
                     if self.postProcess.get(f"{k}{location}"):
@@ -575,11 +681,10 @@ class BazelBuild:
             if len(topStanza) > 0:
                 # Force empty line
 
-                sort_function = cmp_to_key(compare_imports)
-                topStanza = sorted(topStanza, key=sort_function)
+                topStanza = sorted(topStanza, key=importSortKey)
                 topStanza.append("")
                 topStanza.append("")
-            logging.info(f"Top content is {topStanza}")
+            logging.debug("Top content is %s", topStanza)
             ret[k] = "\n".join(topStanza)
 
         for k, v2 in content.items():
@@ -609,6 +714,7 @@ class BaseBazelTarget(object):
         self.neededGeneratedFiles: set[str] = set()
         self.hdrs: set["BaseBazelTarget"] = set()
         self.deps: set[Union["BaseBazelTarget", BazelCCImport]] = set()
+        self._renderedLabels: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
 
     def depName(self):
         return self.name
@@ -619,6 +725,10 @@ class BaseBazelTarget(object):
         else:
             return f":{self.name}"
 
+    def renderedLabel(self, location: str, defaultPrefix: str) -> str:
+        """The label of this target as written in a BUILD file of location."""
+        return _renderedLabel(self, location, defaultPrefix)
+
     def getGlobalImport(self) -> str:
         return ""
 
@@ -670,7 +780,7 @@ class BaseBazelTarget(object):
             except AttributeError:
                 logging.warn(f"Can't get deps for {d.name}")
                 raise
-        logging.info(f"Returning for {self.name} {len(ret)} deps")
+        logging.debug("Returning for %s %s deps", self.name, len(ret))
         return ret
 
 
@@ -878,17 +988,9 @@ class BazelTarget(BaseBazelTarget):
                     ret.append("    ],")
             else:
                 ret.append(f"    {k} = [")
-
-                def __getPrefix(d: Union[BaseBazelTarget, BazelCCImport]):
-                    return _getPrefix(d, self.location, defaultPrefix)
-
-                def cmp_deps(a, b):
-                    return compare_deps(a, b, __getPrefix)
-
-                sort_function = cmp_to_key(cmp_deps)
-                for d in sorted(v, key=sort_function):
-                    pathPrefix = __getPrefix(d)
-                    ret.append(f'        "{pathPrefix}{d.targetName()}",')
+                labels = [d.renderedLabel(self.location, defaultPrefix) for d in v]
+                for label in sorted(labels, key=depSortKey):
+                    ret.append(f'        "{label}",')
                 ret.append("    ],")
         ret.append('    visibility = ["//visibility:public"],')
         ret.append(")")
@@ -908,6 +1010,8 @@ class BazelGenRuleTarget(BaseBazelTarget):
         # filesystem
         self.local: bool = True
         self.aliases: Dict[str, str] = {}
+        # For the batched configure_file() rules: output -> label of its template
+        self.renders: Dict[str, str] = {}
 
     def addSrc(self, target: BaseBazelTarget):
         self.srcs.add(target)
@@ -967,7 +1071,7 @@ class BazelGenRuleTarget(BaseBazelTarget):
         if stripedPrefix and name.startswith(stripedPrefix):
             name = name.replace(stripedPrefix, "")
         if self.aliases.get(name) is not None:
-            logging.info(f"Found alias {name} to {self.aliases[name]}")
+            logging.debug("Found alias %s to %s", name, self.aliases[name])
             name = self.aliases[name]
         if name not in self.outs:
             raise ValueError(
@@ -1050,15 +1154,10 @@ class BazelGRPCCCProtoLibrary(BaseBazelTarget):
             elif len(v) > 0:
                 ret.append(f"    {k} = [")
 
-                def __getPrefix(d: Union[BaseBazelTarget, BazelCCImport]):
-                    return _getPrefix(d, self.location, defaultPrefix)
+                def sortKey(d: Union[BaseBazelTarget, BazelCCImport]):
+                    return depSortKey(d.renderedLabel(self.location, defaultPrefix))
 
-                def cmp_deps(a, b):
-                    return compare_deps(a, b, __getPrefix)
-
-                sort_function = cmp_to_key(cmp_deps)
-
-                for d in sorted(v, key=sort_function):
+                for d in sorted(v, key=sortKey):
                     if d.location.startswith("@"):
                         pathPrefix = d.location
                     else:
@@ -1111,13 +1210,10 @@ class BazelProtoLibrary(BaseBazelTarget):
             elif len(v) > 0:
                 ret.append(f"    {k} = [")
 
-                def __getPrefix(d: Union[BaseBazelTarget, BazelCCImport]):
-                    return _getPrefix(d, self.location, defaultPrefix)
+                def sortKey(d: Union[BaseBazelTarget, BazelCCImport]):
+                    return depSortKey(d.renderedLabel(self.location, defaultPrefix))
 
-                def cmp_deps(a, b):
-                    return compare_deps(a, b, __getPrefix)
-
-                for d in sorted(v, key=cmp_to_key(cmp_deps)):
+                for d in sorted(v, key=sortKey):
                     if d.location.startswith("@"):
                         pathPrefix = d.location
                     else:
@@ -1238,18 +1334,3 @@ class ShBinaryBazelTarget(BaseBazelTarget):
 
     def getGlobalImport(self) -> str:
         return RULES_SHELL_LOAD
-
-
-bazelcache: Dict[str, Any] = {}
-
-
-def getObject(cls: Type[T], *kargs) -> T:
-    key = f"{cls}" + " ".join(kargs)
-    obj = bazelcache.get(key)
-    if obj:
-        logging.debug(f"Cache hit for {key} {type(obj)}")
-        assert isinstance(obj, cls)
-        return obj
-    obj = cls(*kargs)  # type: ignore
-    bazelcache[key] = obj
-    return obj
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmark ninja2bazel on synthetic CMake-like projects.
+
+Every scale runs in its own process so that the peak RSS reported for a phase is the one of
+that scale only. The peak is cumulative: it's the highest RSS of the process once the phase is
+done, a phase using less memory than the previous ones reports their peak. Results can be compared
+against (or stored as) a baseline to catch regressions.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.synthetic import SCALES, SyntheticProject, generateProject
+from build import TopLevelGroupingStrategy
+from configure_file import parse_configure_files_list
+from ninjabuild import NinjaParser, genBazelBuildFiles, getToplevels
+from parser import BUILD_CUSTOMIZATION_DIRECTORY, collect_needed_configure_outputs
+
+PHASES = ("parse", "finalizeHeaders", "configureFiles", "genBazelBuildFiles")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_OUTPUT = "bench_output.txt"
+# A phase is considered as regressed if it's this much slower (or bigger) than the baseline
+DEFAULT_TOLERANCE = 1.5
+
+
+def _peakRSS() -> int:
+    # ru_maxrss is in kilobytes on Linux, it's the peak of the process since it started
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def runPhases(srcDir: str, ninjaFile: str, configureFilesList: str) -> Dict[str, Dict[str, float]]:
+    """
+    Run the conversion of an already generated project and return for each phase
+    the time it took and the peak RSS of the process (cumulative) once it was done.
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    rootdir = f"{srcDir}{os.path.sep}"
+    cur_dir = os.path.dirname(os.path.abspath(ninjaFile))
+
+    def record(name: str, start: float):
+        results[name] = {"seconds": time.time() - start, "peak_rss": _peakRSS()}
+
+    with open(ninjaFile, "r") as f:
+        raw_ninja = f.readlines()
+
+    start = time.time()
+    TopLevelGroupingStrategy("")
+    parser = NinjaParser(rootdir)
+    parser.setManuallyGeneratedTargets({})
+    parser.setContext(ninjaFile)
+    parser.setRemapPath({})
+    parser.setDirectoryPrefix("")
+    parser.setCompilerIncludes([])
+    parser.setCCImports([])
+    parser.parse(raw_ninja, cur_dir)
+    parser.endContext(ninjaFile)
+    parser.resolveAliases()
+    record("parse", start)
+    if len(parser.missing) != 0:
+        raise RuntimeError(f"{len(parser.missing)} missing dependencies in {ninjaFile}")
+
+    start = time.time()
+    top_levels = getToplevels(parser, ["all"])
+    parser.finalizeHeaders(cur_dir, top_levels)
+    parser.classifyVirtualTargets()
+    record("finalizeHeaders", start)
+
+    start = time.time()
+    configure_files = parse_configure_files_list(
+        configureFilesList,
+        rootdir,
+        cur_dir,
+        None,
+        collect_needed_configure_outputs(top_levels, cur_dir),
+    )
+    record("configureFiles", start)
+
+    start = time.time()
+    output = genBazelBuildFiles(
+        top_levels,
+        rootdir,
+        "",
+        BUILD_CUSTOMIZATION_DIRECTORY,
+        configure_files,
+        cur_dir,
+        registry=parser.registry,
+    )
+    record("genBazelBuildFiles", start)
+    results["output"] = {"build_files": len(output), "top_levels": len(top_levels)}
+    return results
+
+
+def runScale(scale: str, workdir: str) -> Dict[str, Dict[str, float]]:
+    root = os.path.join(workdir, scale)
+    start = time.time()
+    project = generateProject(SyntheticProject.forScale(scale), root)
+    logging.warning(
+        f"Generated {scale} project ({project.edges} edges) in {time.time() - start:.1f}s"
+    )
+    results = runPhases(project.srcDir, project.ninjaFile, project.configureFilesList)
+    results["output"]["edges"] = project.edges
+    return results
+
+
+def _runScaleInSubprocess(scale: str, workdir: str, logLevel: str) -> Dict[str, Dict[str, float]]:
+    cmd = [sys.executable, os.path.abspath(__file__), "--single", scale]
+    cmd.extend(["--workdir", workdir, "--log-level", logLevel])
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    sys.stderr.write(result.stderr)
+    # Phases print their own timings, the JSON payload is on the last line
+    return json.loads(result.stdout.strip().split("\n")[-1])
+
+
+def compareToBaseline(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    tolerance: float,
+) -> List[str]:
+    regressions = []
+    for scale, phases in results.items():
+        if scale not in baseline:
+            continue
+        for p in PHASES:
+            for metric in ("seconds", "peak_rss"):
+                base = baseline[scale].get(p, {}).get(metric)
+                cur = phases[p][metric]
+                if base and cur > base * tolerance:
+                    regressions.append(
+                        f"{scale} {p} {metric}: {cur:.2f} vs baseline {base:.2f} "
+                        f"(+{(cur / base - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def formatResults(results: Dict[str, Dict[str, Dict[str, float]]]) -> str:
+    lines = [
+        f"{'scale':<6} {'edges':>7} {'phase':<20} {'seconds':>9} {'cumulative peak RSS (MB)':>25}"
+    ]
+    for scale, phases in results.items():
+        for p in PHASES:
+            lines.append(
+                f"{scale:<6} {int(phases['output']['edges']):>7} {p:<20} "
+                f"{phases[p]['seconds']:>9.2f} {phases[p]['peak_rss'] / 1024 / 1024:>25.1f}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ninja2bazel on synthetic projects")
+    parser.add_argument(
+        "--scale",
+        action="append",
+        choices=list(SCALES.keys()),
+        help="Scale(s) to run, default 1k and 10k",
+    )
+    parser.add_argument("--workdir", help="Where to generate the projects, default a temp dir")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing",
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+
+    if args.single:
+        results = runScale(args.single, args.workdir)
+        print(json.dumps(results))
+        return 0
+
+    scales = args.scale or ["1k", "10k"]
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        results = {s: _runScaleInSubprocess(s, workdir, args.log_level) for s in scales}
+
+    report = formatResults(results)
+    print(report, end="")
+    with open(args.output, "w") as f:
+        f.write(report)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        logging.warning(f"Baseline updated in {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        logging.warning(f"No baseline in {args.baseline}, nothing to compare to")
+        return 0
+    with open(args.baseline, "r") as f:
+        regressions = compareToBaseline(results, json.load(f), args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
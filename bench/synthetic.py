@@ -0,0 +1,276 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import List
+
+# Number of libraries and sources per library used to reach roughly 1k, 10k and 100k edges
+SCALES = {
+    "1k": (20, 48),
+    "10k": (100, 98),
+    "100k": (500, 198),
+}
+
+GEN_HEADER_SCRIPT = """#!/usr/bin/env python3
+import os
+import sys
+
+out = sys.argv[1]
+os.makedirs(os.path.dirname(out), exist_ok=True)
+name = os.path.basename(out).replace(".", "_").upper()
+with open(out, "w") as f:
+    f.write(f"#pragma once\\n#include <cstdint>\\nstatic const int {name} = 1;\\n")
+"""
+
+RULES = """rule CXX_COMPILER
+  depfile = $DEP_FILE
+  deps = gcc
+  command = /usr/bin/c++ $DEFINES $INCLUDES $FLAGS -MD -MT $out -MF $DEP_FILE -o $out -c $in
+  description = Building CXX object $out
+
+rule CXX_STATIC_LIBRARY_LINKER
+  command = $PRE_LINK && /usr/bin/cmake -E rm -f $TARGET_FILE && /usr/bin/ar qc $TARGET_FILE $LINK_FLAGS $in && /usr/bin/ranlib $TARGET_FILE && $POST_BUILD
+  description = Linking CXX static library $TARGET_FILE
+  restat = $RESTAT
+
+rule CXX_EXECUTABLE_LINKER
+  command = $PRE_LINK && /usr/bin/c++ $FLAGS $LINK_FLAGS $in -o $TARGET_FILE $LINK_PATH $LINK_LIBRARIES && $POST_BUILD
+  description = Linking CXX executable $TARGET_FILE
+  restat = $RESTAT
+
+rule CUSTOM_COMMAND
+  command = $COMMAND
+  description = $DESC
+
+"""
+
+
+@dataclass
+class SyntheticProject:
+    """
+    Shape of a synthetic CMake-like project, every library gets `sources` translation units
+    and `headers` headers, it depends on the `fanOut` previous libraries.
+    Every `generatorEvery` library has a CUSTOM_COMMAND generating a header, every `protoEvery`
+    library has a protobuf and every `configureEvery` library has a configure_file() output.
+    """
+
+    libraries: int
+    sources: int
+    headers: int = 0
+    fanOut: int = 3
+    includesPerSource: int = 3
+    generatorEvery: int = 10
+    protoEvery: int = 5
+    configureEvery: int = 4
+    appEvery: int = 10
+    seed: int = 42
+
+    def __post_init__(self):
+        if self.headers == 0:
+            self.headers = max(4, self.sources // 4)
+
+    @classmethod
+    def forScale(cls, scale: str) -> "SyntheticProject":
+        libraries, sources = SCALES[scale]
+        return cls(libraries, sources)
+
+
+@dataclass
+class GeneratedProject:
+    root: str
+    srcDir: str
+    buildDir: str
+    ninjaFile: str
+    configureFilesList: str
+    edges: int
+
+
+def _write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _hasEvery(index: int, every: int) -> bool:
+    return every > 0 and index % every == 0
+
+
+def _deps(project: SyntheticProject, lib: int) -> List[int]:
+    return list(range(max(0, lib - project.fanOut), lib))
+
+
+def generateProject(project: SyntheticProject, root: str) -> GeneratedProject:
+    """
+    Write the source tree in <root>/src and the build directory (build.ninja and the files
+    that CMake would have created at configure time) in <root>/build.
+    """
+    rng = random.Random(project.seed)
+    srcDir = os.path.join(os.path.abspath(root), "src")
+    buildDir = os.path.join(os.path.abspath(root), "build")
+    os.makedirs(srcDir, exist_ok=True)
+    os.makedirs(buildDir, exist_ok=True)
+
+    _write(
+        f"{srcDir}/common/include/common/base.h",
+        "#pragma once\n#include <cstddef>\n#include <string>\n",
+    )
+    _write(f"{srcDir}/tools/gen_header.py", GEN_HEADER_SCRIPT)
+
+    ninja: List[str] = [
+        "ninja_required_version = 1.5",
+        "",
+        f"cmake_ninja_workdir = {buildDir}/",
+        "",
+        RULES,
+    ]
+    configureLines: List[str] = []
+    edges = 0
+    libs: List[str] = []
+    apps: List[str] = []
+
+    for lib in range(project.libraries):
+        name = f"mod{lib}"
+        deps = _deps(project, lib)
+        libSrc = f"{srcDir}/{name}"
+        includes = [f"-I{libSrc}/include", f"-I{srcDir}/common/include"]
+        includes.extend([f"-I{srcDir}/mod{d}/include" for d in deps])
+        objects: List[str] = []
+
+        for h in range(project.headers):
+            content = [
+                "#pragma once",
+                "#include <common/base.h>",
+            ]
+            if h > 0:
+                content.append(f'#include "{name}/h{rng.randrange(h)}.h"')
+            content.append(f"int {name}_h{h}();")
+            _write(f"{libSrc}/include/{name}/h{h}.h", "\n".join(content) + "\n")
+
+        extraIncludes: List[str] = []
+        if _hasEvery(lib, project.generatorEvery):
+            genHeader = f"{name}/gen/{name}_gen.h"
+            ninja.append(
+                f"build {genHeader}: CUSTOM_COMMAND {srcDir}/tools/gen_header.py\n"
+                f"  COMMAND = cd {buildDir}/{name} && /usr/bin/python3 "
+                f"{srcDir}/tools/gen_header.py {buildDir}/{genHeader}\n"
+                f"  DESC = Generating {genHeader}\n"
+            )
+            edges += 1
+            includes.append(f"-I{buildDir}/{name}/gen")
+            extraIncludes.append(f'#include "{name}_gen.h"')
+
+        if _hasEvery(lib, project.protoEvery):
+            protoDirs = [f"-I {libSrc}/proto"]
+            content = ['syntax = "proto3";', ""]
+            previous = [d for d in deps if _hasEvery(d, project.protoEvery)]
+            for d in previous:
+                content.append(f'import "mod{d}.proto";')
+                protoDirs.append(f"-I {srcDir}/mod{d}/proto")
+            content.append(f"message {name.capitalize()} {{ int32 v = 1; }}")
+            _write(f"{libSrc}/proto/{name}.proto", "\n".join(content) + "\n")
+            ninja.append(
+                f"build {name}/{name}.pb.cc {name}/{name}.pb.h: CUSTOM_COMMAND "
+                f"{libSrc}/proto/{name}.proto\n"
+                f"  COMMAND = cd {buildDir}/{name} && /usr/bin/protoc --cpp_out {buildDir}/{name} "
+                f"{' '.join(protoDirs)} {libSrc}/proto/{name}.proto\n"
+                f"  DESC = Running cpp protocol buffer compiler on {name}.proto\n"
+            )
+            edges += 1
+            includes.append(f"-I{buildDir}/{name}")
+            extraIncludes.append(f'#include "{name}.pb.h"')
+            obj = f"{name}/CMakeFiles/{name}.dir/{name}.pb.cc.o"
+            objects.append(obj)
+
+        if _hasEvery(lib, project.configureEvery):
+            _write(
+                f"{libSrc}/config.h.cmake",
+                f"#pragma once\n#cmakedefine {name.upper()}_FEATURE\n"
+                f'#define {name.upper()}_VERSION "@{name.upper()}_VERSION@"\n',
+            )
+            _write(
+                f"{libSrc}/CMakeLists.txt",
+                f'set({name.upper()}_VERSION "1.{lib}")\nset({name.upper()}_FEATURE ON)\n',
+            )
+            # CMake creates those files at configure time, they are "pregenerated"
+            _write(
+                f"{buildDir}/{name}/include/{name}_config.h",
+                f'#pragma once\n#define {name.upper()}_FEATURE\n#define {name.upper()}_VERSION "1.{lib}"\n',
+            )
+            configureLines.append(
+                f"configure_file(${{CMAKE_CURRENT_SOURCE_DIR}}/{name}/config.h.cmake "
+                f"${{CMAKE_CURRENT_BINARY_DIR}}/{name}/include/{name}_config.h)"
+            )
+            includes.append(f"-I{buildDir}/{name}/include")
+            extraIncludes.append(f'#include "{name}_config.h"')
+
+        compileVars = (
+            f"  FLAGS = -std=gnu++17 -O2\n"
+            f"  DEFINES = -D{name.upper()}_BUILD\n"
+            f"  INCLUDES = {' '.join(includes)}\n"
+        )
+        if _hasEvery(lib, project.protoEvery):
+            ninja.append(
+                f"build {objects[0]}: CXX_COMPILER {buildDir}/{name}/{name}.pb.cc\n"
+                f"  DEP_FILE = {objects[0]}.d\n"
+                + compileVars
+            )
+            edges += 1
+
+        for s in range(project.sources):
+            content = [f'#include "{name}/h{h}.h"' for h in rng.sample(
+                range(project.headers), min(project.includesPerSource, project.headers)
+            )]
+            content.extend([f"#include <mod{d}/h{rng.randrange(project.headers)}.h>" for d in deps])
+            content.extend(extraIncludes)
+            content.append(f"int {name}_s{s}() {{ return 0; }}")
+            _write(f"{libSrc}/src/s{s}.cc", "\n".join(content) + "\n")
+            obj = f"{name}/CMakeFiles/{name}.dir/src/s{s}.cc.o"
+            ninja.append(
+                f"build {obj}: CXX_COMPILER {libSrc}/src/s{s}.cc\n"
+                f"  DEP_FILE = {obj}.d\n"
+                + compileVars
+            )
+            objects.append(obj)
+            edges += 1
+
+        archive = f"{name}/lib{name}.a"
+        ninja.append(
+            f"build {archive}: CXX_STATIC_LIBRARY_LINKER {' '.join(objects)}\n"
+            f"  TARGET_FILE = {archive}\n"
+            "  POST_BUILD = :\n"
+            "  PRE_LINK = :\n"
+        )
+        edges += 1
+        libs.append(archive)
+
+        if _hasEvery(lib, project.appEvery):
+            app = f"apps/app{lib}"
+            main = f"{srcDir}/apps/app{lib}/main.cc"
+            _write(main, f'#include <{name}/h0.h>\nint main() {{ return {name}_h0(); }}\n')
+            obj = f"apps/CMakeFiles/app{lib}.dir/main.cc.o"
+            ninja.append(
+                f"build {obj}: CXX_COMPILER {main}\n"
+                f"  DEP_FILE = {obj}.d\n"
+                "  FLAGS = -std=gnu++17 -O2\n"
+                f"  INCLUDES = -I{libSrc}/include -I{srcDir}/common/include\n"
+            )
+            linked = [archive] + [f"mod{d}/libmod{d}.a" for d in deps]
+            ninja.append(
+                f"build {app}: CXX_EXECUTABLE_LINKER {obj} | {' '.join(linked)}\n"
+                f"  LINK_LIBRARIES = {' '.join(linked)}\n"
+                f"  TARGET_FILE = {app}\n"
+                "  POST_BUILD = :\n"
+                "  PRE_LINK = :\n"
+            )
+            edges += 2
+            apps.append(app)
+
+    ninja.append(f"build all: phony {' '.join(libs + apps)}\n")
+    ninja.append("default all\n")
+
+    ninjaFile = os.path.join(buildDir, "build.ninja")
+    _write(ninjaFile, "\n".join(ninja))
+    configureFilesList = os.path.join(srcDir, "configure_files.txt")
+    _write(configureFilesList, "\n".join(configureLines) + "\n")
+    return GeneratedProject(
+        os.path.abspath(root), srcDir, buildDir, ninjaFile, configureFilesList, edges
+    )
@@ -5,7 +5,18 @@ import shlex
 from dataclasses import dataclass
 from enum import Enum
 from functools import total_ordering
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from bazel import (
     BaseBazelTarget,
@@ -21,16 +32,23 @@ from bazel import (
     ExportedFile,
     PyBinaryBazelTarget,
     ShBinaryBazelTarget,
-    getObject,
+    TargetRegistry,
 )
 from configure_file import ConfigureFile, find_configure_file
 from helpers import resolvePath
+from logutils import Lazy
 from visitor import VisitorContext
 
 VisitorType = Callable[["BuildTarget", "VisitorContext", bool], bool]
 TargetType = Enum(
     "TargetType", ["other", "unknown", "known", "external", "manually_generated"]
 )
+# Why a target is considered virtual (see BuildTarget.depsAreVirtual)
+VirtualReason = Enum(
+    "VirtualReason", ["empty_phony", "ctest", "ccmake", "cmake", "no_producer"]
+)
+# (is virtual, reason, the depend that made it virtual)
+VirtualClassification = Tuple[bool, Optional[VirtualReason], Optional["BuildTarget"]]
 CONFIGURE_FILE_TOOL_PATH = "bazel/tools/render_configure_file.py"
 CONFIGURE_FILE_TOOL_TARGET = "render_configure_file"
 CPP_SOURCE_EXTENSIONS = (".c", ".cc", ".cpp", ".s", ".S")
@@ -60,10 +78,14 @@ class BazelBuildVisitorContext(VisitorContext):
     prefix: Optional["str"] = None
     configure_files: Optional[Dict[str, ConfigureFile]] = None
     configure_binary_dir: Optional[str] = None
+    configure_files_batch: bool = False
+    registry: Optional[TargetRegistry] = None
 
     def __post_init__(self):
         if self.prefix.endswith(os.path.sep):
             self.prefix = self.prefix[:-1]
+        if self.registry is None:
+            self.registry = self.bazelbuild.registry
         self.parentIsPhony = False
 
     def setup_subcontext(self) -> "VisitorContext":
@@ -85,6 +107,14 @@ def _configure_file_rule_name(output: str) -> str:
     return "configure_" + re.sub(r"[^A-Za-z0-9_]", "_", output).strip("_")
 
 
+def _configure_files_batch_rule_name(value_files: List[str]) -> str:
+    # One batch per set of value files, the variables are the same for all configure files
+    return "_".join(
+        ["configure_files"]
+        + [re.sub(r"[^A-Za-z0-9_]", "_", v).strip("_") for v in value_files]
+    )
+
+
 class BuildFileGroupingStrategy:
     _instance = None
 
@@ -145,7 +175,9 @@ class TopLevelGroupingStrategy(BuildFileGroupingStrategy):
             return "."
         pathElements = filename.split(os.path.sep)
         if len(pathElements) <= 1:
-            logging.info(f"No {os.path.sep} in {filename} using '' as the root path ")
+            logging.debug(
+                "No %s in %s using '' as the root path ", os.path.sep, filename
+            )
             return ""
         else:
             return pathElements[0]
@@ -156,7 +188,10 @@ class TopLevelGroupingStrategy(BuildFileGroupingStrategy):
         if parentTargetPath == "":
             parentTargetPath = self.prefixDirectory
         logging.debug(
-            f"Getting build target for {filename} with parentTargetPath {parentTargetPath} keepPrefix = {keepPrefix}"
+            "Getting build target for %s with parentTargetPath %s keepPrefix = %s",
+            filename,
+            parentTargetPath,
+            keepPrefix,
         )
         pathElements = filename.split(os.path.sep)
         prefix = ":"
@@ -176,7 +211,10 @@ class TopLevelGroupingStrategy(BuildFileGroupingStrategy):
             # to keep the prefix
             val = f":{os.path.sep.join(pathElements[idx:])}"
         logging.debug(
-            f"Returning {val} for {filename} with parentTargetPath {parentTargetPath}"
+            "Returning %s for %s with parentTargetPath %s",
+            val,
+            filename,
+            parentTargetPath,
         )
         return val
 
@@ -204,6 +242,8 @@ class BuildTarget:
         self.topLevel = False
         self.opaque: Optional[object] = None
         self.bazelAdditionalParameters: Dict[str, Any] = {}
+        # Set by classifyVirtualTargets() once the graph is frozen
+        self.virtual: Optional[VirtualClassification] = None
 
     def setAlias(self, alias: "BuildTarget"):
         self.alias = alias
@@ -242,7 +282,7 @@ class BuildTarget:
 
     def markAsExternal(self, quiet=False):
         if not quiet:
-            logging.info(f"Marking {self.name} as external")
+            logging.info("Marking %s as external", self.name)
         self.type = TargetType.external
         return self
 
@@ -306,106 +346,234 @@ class BuildTarget:
         return count == len(self.usedbybuilds)
 
     def depsAreVirtual(self) -> bool:
-        if self.is_a_file:
-            logging.debug(f"{self} is a file")
-            return False
-
-        if self.producedby is None and self.type == TargetType.external:
-            # logging.debug(f"{self} is an external dependency")
-            return False
+        if self.virtual is not None:
+            return self.virtual[0]
+        # Not classified yet (ie. the graph is still being built), don't keep the result
+        return _classifyVirtual(self, {})[0]
 
-        if self.producedby is None and not self.is_a_file:
-            logging.warning(
-                f"{self.name} is a dependency for something else, is not a file"
-                f" and has nothing producing it, assuming it's a virtual dependency"
-            )
-            return True
+    def _isEmptyPhony(self) -> bool:
+        return (
+            not self.is_a_file
+            and self.producedby is not None
+            and self.producedby.rulename.name == "phony"
+            and len(self.producedby.getInputs()) == 0
+            and len(self.producedby.depends) == 0
+        )
 
-        for d in self.producedby.depends:
-            if d.producedby and d.producedby.rulename.name == "phony":
-                if (
-                    len(d.producedby.getInputs()) == 0
-                    and len(d.producedby.depends) == 0
-                ):
-                    return True
-                # Treat the case where the phony target has a ctest command as virtual
-                if "/ctest " in d.producedby.vars.get("COMMAND", ""):
-                    return True
-                if "/ccmake " in d.producedby.vars.get("COMMAND", ""):
-                    return True
-                if "/cmake " in d.producedby.vars.get("COMMAND", ""):
-                    return True
-            v = d.depsAreVirtual()
-            if not v:
+    def _enterVisit(
+        self,
+        visitor: VisitorType,
+        ctx: VisitorContext,
+        visited: Optional[Set["BuildTarget"]],
+    ) -> bool:
+        """
+        Call the visitor on this target, return False if its children must not be visited
+        """
+        if visited is not None:
+            if self in visited:
+                ctx.cleanup()
                 return False
-        return False
-
-    def visitGraph(self, visitor: VisitorType, ctx: VisitorContext):
+            visited.add(self)
         # If we are visiting a target that is a file or
         # a target that is produced by something that is either not phony
         # of is phony but has real inputs / deps
-        if self.is_a_file or not (
-            self.producedby
-            and self.producedby.rulename.name == "phony"
-            and len(self.producedby.getInputs()) == 0
-            and len(self.producedby.depends) == 0
-        ):
-            try:
-                if not visitor(self, ctx, False):
-                    ctx.cleanup()
-                    return
-            except Exception as e:
-                # it might sounds wrong but producer is set a level above,
-                # when looking at files producer is actually the Build that uses those files
-                if ctx.producer is not None:
-                    usedBy = ctx.producer.rulename.name
-                else:
-                    usedBy = "unknown"
-
-                logging.error(f"Error visiting {self.name} used by {usedBy}: {e} ")
-                raise
-        if self.producedby:
-            for el in sorted(self.producedby.getInputs()):
-                newctx = ctx.setup_subcontext()
-                newctx.producer = self.producedby
-                newctx.parentIsPhony = False
-                if ctx.producer is not None and ctx.producer.rulename.name == "phony":
-                    newctx.parentIsPhony = True
-                elif self.producedby.rulename.name == "phony" and ctx.producer is None:
-                    # We don't have a producer set, this means that self is the output of topLevel
-                    # build and this build is phony (ie. all)
-                    builds = [b.outputs[0] for b in self.usedbybuilds]
-                    logging.info(
-                        f"{self.name} is phony ctx.producer = {ctx.producer}, parent build(s): {builds}"
-                    )
+        if self._isEmptyPhony():
+            return True
+        try:
+            if not visitor(self, ctx, False):
+                ctx.cleanup()
+                return False
+        except Exception as e:
+            # it might sounds wrong but producer is set a level above,
+            # when looking at files producer is actually the Build that uses those files
+            if ctx.producer is not None:
+                usedBy = ctx.producer.rulename.name
+            else:
+                usedBy = "unknown"
+
+            logging.error(f"Error visiting {self.name} used by {usedBy}: {e} ")
+            raise
+        return True
+
+    def _visitChildren(
+        self, ctx: VisitorContext, virtual: Dict["BuildTarget", bool]
+    ) -> Iterator[Tuple["BuildTarget", VisitorContext]]:
+        """
+        Yield the children of this target and their context, the inputs first then the depends
+        that are not virtual. Contexts are created only when the child is about to be visited.
+        """
+        build = self.producedby
+        if build is None:
+            return
+        parentIsPhony = (
+            ctx.producer is not None and ctx.producer.rulename.name == "phony"
+        )
+        for el in build.sortedInputs():
+            if el.name == self.name:
+                logging.warning(
+                    f"Skipping visiting {el.name} from {self.name} because they are the same"
+                )
+                continue
+            if build.rulename.name == "phony" and ctx.producer is None:
+                # We don't have a producer set, this means that self is the output of topLevel
+                # build and this build is phony (ie. all)
                 logging.debug(
-                    f"Visiting {el.name} from {self.name} ctx.producer = {ctx.producer}"
+                    "%s is phony ctx.producer = %s, parent build(s): %s",
+                    self.name,
+                    ctx.producer,
+                    Lazy(lambda: [b.outputs[0] for b in self.usedbybuilds]),
                 )
-                if el.name != self.name:
-                    el.visitGraph(visitor, newctx)
-                else:
-                    logging.warning(
-                        f"Skipping visiting {el.name} from {self.name} because they are the same"
-                    )
-            for el in sorted(self.producedby.depends):
-                if not el.depsAreVirtual():
-                    newctx = ctx.setup_subcontext()
-                    newctx.producer = self.producedby
-                    if (
-                        ctx.producer is not None
-                        and ctx.producer.rulename.name == "phony"
-                    ):
-                        newctx.parentIsPhony = True
-                    else:
-                        newctx.parentIsPhony = False
-                    el.visitGraph(visitor, newctx)
-        # call cleanup() to clean the context once a node has been visited
-        ctx.cleanup()
+            logging.debug(
+                "Visiting %s from %s ctx.producer = %s",
+                el.name,
+                self.name,
+                ctx.producer,
+            )
+            newctx = ctx.setup_subcontext()
+            newctx.producer = build
+            newctx.parentIsPhony = parentIsPhony
+            yield (el, newctx)
+        for el in build.sortedDepends():
+            isVirtual = virtual.get(el)
+            if isVirtual is None:
+                isVirtual = el.depsAreVirtual()
+                virtual[el] = isVirtual
+            if isVirtual:
+                continue
+            newctx = ctx.setup_subcontext()
+            newctx.producer = build
+            newctx.parentIsPhony = parentIsPhony
+            yield (el, newctx)
+
+    def visitGraph(
+        self, visitor: VisitorType, ctx: VisitorContext, visitOnce: bool = False
+    ):
+        """
+        Visit the graph rooted at this target depth first, the visitor is called before the
+        children (inputs then non virtual depends, both sorted) and ctx.cleanup() once all of them
+        have been visited. The traversal uses an explicit stack so deep graphs don't hit the
+        recursion limit.
+        If visitOnce is True a target reachable through multiple paths is visited only the first
+        time, this is only correct for visitors that don't depend on the path.
+        """
+        visited: Optional[Set[BuildTarget]] = set() if visitOnce else None
+        virtual: Dict[BuildTarget, bool] = {}
+        if not self._enterVisit(visitor, ctx, visited):
+            return
+        stack = [(self, ctx, self._visitChildren(ctx, virtual))]
+        while stack:
+            (_, curctx, children) = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                # call cleanup() to clean the context once a node has been visited
+                curctx.cleanup()
+                continue
+            (el, newctx) = child
+            if el._enterVisit(visitor, newctx, visited):
+                stack.append((el, newctx, el._visitChildren(newctx, virtual)))
 
     def addTargetSpecificParameters(self, params: Dict[str, Any]):
         self.bazelAdditionalParameters.update(params)
 
 
+def _phonyVirtualReason(target: BuildTarget) -> Optional[VirtualReason]:
+    build = target.producedby
+    if build is None or build.rulename.name != "phony":
+        return None
+    if len(build.getInputs()) == 0 and len(build.depends) == 0:
+        return VirtualReason.empty_phony
+    # Treat the case where the phony target has a ctest/ccmake/cmake command as virtual
+    command = build.vars.get("COMMAND", "")
+    if "/ctest " in command:
+        return VirtualReason.ctest
+    if "/ccmake " in command:
+        return VirtualReason.ccmake
+    if "/cmake " in command:
+        return VirtualReason.cmake
+    return None
+
+
+def _classifyVirtual(
+    root: BuildTarget, memo: Dict[BuildTarget, VirtualClassification]
+) -> VirtualClassification:
+    """
+    A target is virtual if, going through the depends of its producer in order, a phony
+    depend that is empty or runs ctest/ccmake/cmake is found before a depend that is not virtual.
+    Targets with no producer that are neither files nor externals are virtual as well.
+    The depends are classified first (post-order, with an explicit stack), results go in memo.
+    """
+
+    def known(t: BuildTarget) -> Optional[VirtualClassification]:
+        return t.virtual if t.virtual is not None else memo.get(t)
+
+    inProgress: Set[BuildTarget] = set()
+    stack = [(root, False)]
+    while stack:
+        (t, expanded) = stack.pop()
+        if known(t) is not None:
+            continue
+        if t.is_a_file or (t.producedby is None and t.type == TargetType.external):
+            memo[t] = (False, None, None)
+            continue
+        if t.producedby is None:
+            logging.warning(
+                f"{t.name} is a dependency for something else, is not a file"
+                f" and has nothing producing it, assuming it's a virtual dependency"
+            )
+            memo[t] = (True, VirtualReason.no_producer, None)
+            continue
+        if not expanded:
+            inProgress.add(t)
+            stack.append((t, True))
+            for d in t.producedby.depends:
+                if d not in inProgress and _phonyVirtualReason(d) is None:
+                    stack.append((d, False))
+            continue
+
+        result: VirtualClassification = (False, None, None)
+        for d in t.producedby.depends:
+            reason = _phonyVirtualReason(d)
+            if reason is not None:
+                result = (True, reason, d)
+                break
+            v = known(d)
+            # v is None only for a cycle, consider it as a real dependency
+            if v is None or not v[0]:
+                break
+        inProgress.discard(t)
+        memo[t] = result
+    ret = known(root)
+    assert ret is not None
+    return ret
+
+
+def classifyVirtualTargets(targets: Iterable[BuildTarget]) -> None:
+    """
+    Classify once and for all the targets as virtual or not, must be called once the graph
+    won't change anymore as BuildTarget.depsAreVirtual() will then use the stored result.
+    """
+    memo: Dict[BuildTarget, VirtualClassification] = {}
+    for t in targets:
+        _classifyVirtual(t, memo)
+    for t, v in memo.items():
+        t.virtual = v
+
+
+def virtualTargetsReport(targets: Iterable[BuildTarget]) -> str:
+    lines = []
+    for t in sorted(targets):
+        if t.virtual is None or not t.virtual[0]:
+            continue
+        (_, reason, via) = t.virtual
+        assert reason is not None
+        line = f"  {t.name}: {reason.name.replace('_', ' ')}"
+        if via is not None:
+            line += f" ({via.name})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
 class GeneratedBuildTarget(BuildTarget):
     pass
 
@@ -420,8 +588,6 @@ class Rule:
 
 
 class Build:
-    _protoNames: Dict[str, str] = {}
-    staticFiles: Dict[str, ExportedFile] = {}
     remapPaths: Dict[str, str] = {}
 
     def __init__(
@@ -446,6 +612,7 @@ class Build:
                 d.usedby(self)
         self.associatedBazelTarget: Optional[BaseBazelTarget] = None
         self.pruned = False
+        self._sortedCache: Dict[str, Tuple[Any, int, List[BuildTarget]]] = {}
 
         for o in self.outputs:
             o.producedby = self
@@ -455,6 +622,22 @@ class Build:
     def getInputs(self) -> List[BuildTarget]:
         return self._inputs
 
+    def _sorted(self, attr: str) -> List[BuildTarget]:
+        # _inputs and depends are sometimes replaced (ie. resolveAliases) and sometimes appended to,
+        # the cache is valid as long as it's the same object with the same number of elements
+        elements = getattr(self, attr)
+        cached = self._sortedCache.get(attr)
+        if cached is None or cached[0] is not elements or cached[1] != len(elements):
+            cached = (elements, len(elements), sorted(elements))
+            self._sortedCache[attr] = cached
+        return cached[2]
+
+    def sortedInputs(self) -> List[BuildTarget]:
+        return self._sorted("_inputs")
+
+    def sortedDepends(self) -> List[BuildTarget]:
+        return self._sorted("depends")
+
     def addInput(self, i: BuildTarget):
         if i not in self._inputs:
             self._inputs.append(i)
@@ -478,11 +661,18 @@ class Build:
         ctx: BazelBuildVisitorContext,
         fileLocation: Optional[str] = None,
         ispregenerated: bool = False,
+        registry: Optional[TargetRegistry] = None,
     ) -> ExportedFile:
+        if registry is None:
+            registry = ctx.registry
         # static file
-        ef = cls.staticFiles.get(filename)
+        ef = registry.staticFiles.get(filename)
         logging.debug(
-            f"Generating ExportedFile for {filename} is pregenerated = {ispregenerated} at {locationCaller} exported file:  {ef}"
+            "Generating ExportedFile for %s is pregenerated = %s at %s exported file:  %s",
+            filename,
+            ispregenerated,
+            locationCaller,
+            ef,
         )
         assert fileLocation is None
         if not ef:
@@ -500,14 +690,14 @@ class Build:
             for k, v in cls.remapPaths.items():
                 if fileLocation.startswith(k):
                     fileLocation = fileLocation.replace(k, v)
-                    logging.info(f"Remapping location from {k} to {v}")
+                    logging.debug("Remapping location from %s to %s", k, v)
                     if filename.endswith(".h"):
                         ctx.current.addIncludeDir((v, False))
                 elif fileLocation == "." and k == filename:
                     fileLocation = v
-                    logging.info(f"Remapping location for {filename} to {v}")
+                    logging.debug("Remapping location for %s to %s", filename, v)
                     if filename.endswith(".h"):
-                        logging.info(f"Adding {v} to include dirs")
+                        logging.debug("Adding %s to include dirs", v)
                         ctx.current.addIncludeDir((v, False))
 
             if fileLocation == "":
@@ -518,12 +708,12 @@ class Build:
                 ),
                 fileLocation,
             )
-            cls.staticFiles[filename] = ef
+            registry.staticFiles[filename] = ef
         else:
             for k, v in cls.remapPaths.items():
                 if ef.location.startswith(v):
                     if filename.endswith(".h"):
-                        logging.info(f"Adding {ef.location} to include dirs")
+                        logging.debug("Adding %s to include dirs", ef.location)
                         ctx.current.addIncludeDir((ef.location, False))
         return ef
 
@@ -554,6 +744,43 @@ class Build:
             ctx.current.addDep(imp)
             cls._addAllCCimportDeps(imp, ctx)
 
+    @classmethod
+    def _configureFileTool(cls, ctx: BazelBuildVisitorContext, location: str):
+        tool = ctx.registry.getObject(
+            PyBinaryBazelTarget, CONFIGURE_FILE_TOOL_TARGET, location
+        )
+        tool.main = CONFIGURE_FILE_TOOL_PATH
+        tool.addSrc(ExportedFile(CONFIGURE_FILE_TOOL_PATH, location))
+        ctx.bazelbuild.bazelTargets.add(tool)
+        return tool
+
+    @classmethod
+    def _addConfigureFileSrc(
+        cls, ctx: BazelBuildVisitorContext, genTarget: BazelGenRuleTarget, path: str
+    ) -> str:
+        source = _relpath_for_bazel(path, ctx.rootdir)
+        genTarget.addSrc(
+            cls._genExportedFile(
+                filename=source,
+                locationCaller=genTarget.location,
+                ctx=ctx,
+            )
+        )
+        return source
+
+    @staticmethod
+    def _configureFileArgs(
+        value_files: List[str], configure_file: ConfigureFile
+    ) -> List[str]:
+        args = [f"$(location {value_file})" for value_file in value_files]
+        args.extend(
+            [
+                f"--var {shlex.quote(f'{key}={value}')}"
+                for key, value in sorted(configure_file.variables.items())
+            ]
+        )
+        return args
+
     @classmethod
     def _genConfigureFileRule(
         cls,
@@ -565,55 +792,74 @@ class Build:
         normalized_output = output.replace("<pregenerated>/", "")
         if not normalized_output.startswith("pregenerated/"):
             normalized_output = f"pregenerated/{normalized_output}"
+        if ctx.configure_files_batch:
+            return cls._genConfigureFilesBatchRule(
+                ctx, configure_file, normalized_output, location
+            )
 
-        genTarget = getObject(
+        genTarget = ctx.registry.getObject(
             BazelGenRuleTarget,
             _configure_file_rule_name(normalized_output),
             location,
         )
         if len(genTarget.outs) == 0:
             genTarget.addOut(normalized_output)
-            tool = getObject(PyBinaryBazelTarget, CONFIGURE_FILE_TOOL_TARGET, location)
-            tool.main = CONFIGURE_FILE_TOOL_PATH
-            tool.addSrc(ExportedFile(CONFIGURE_FILE_TOOL_PATH, location))
-            ctx.bazelbuild.bazelTargets.add(tool)
-            genTarget.addTool(tool)
-
-            source = _relpath_for_bazel(configure_file.source, ctx.rootdir)
-            genTarget.addSrc(
-                cls._genExportedFile(
-                    filename=source,
-                    locationCaller=genTarget.location,
-                    ctx=ctx,
-                )
-            )
+            genTarget.addTool(cls._configureFileTool(ctx, location))
+
+            source = cls._addConfigureFileSrc(ctx, genTarget, configure_file.source)
             value_files = [
-                _relpath_for_bazel(value_file, ctx.rootdir)
+                cls._addConfigureFileSrc(ctx, genTarget, value_file)
                 for value_file in configure_file.value_files
             ]
-            for value_file in value_files:
-                genTarget.addSrc(
-                    cls._genExportedFile(
-                        filename=value_file,
-                        locationCaller=genTarget.location,
-                        ctx=ctx,
-                    )
-                )
 
             args = [f"$(location {source})", "$@"]
-            args.extend([f"$(location {value_file})" for value_file in value_files])
-            args.extend(
-                [
-                    f"--var {shlex.quote(f'{key}={value}')}"
-                    for key, value in sorted(configure_file.variables.items())
-                ]
-            )
+            args.extend(cls._configureFileArgs(value_files, configure_file))
             genTarget.cmd = f"$(location :{CONFIGURE_FILE_TOOL_TARGET}) " + " ".join(
                 args
             )
             ctx.bazelbuild.bazelTargets.add(genTarget)
         return next(iter(genTarget.outs))
 
+    @classmethod
+    def _genConfigureFilesBatchRule(
+        cls,
+        ctx: BazelBuildVisitorContext,
+        configure_file: ConfigureFile,
+        normalized_output: str,
+        location: str,
+    ) -> BaseBazelTarget:
+        value_files = [
+            _relpath_for_bazel(value_file, ctx.rootdir)
+            for value_file in configure_file.value_files
+        ]
+        genTarget = ctx.registry.getObject(
+            BazelGenRuleTarget,
+            _configure_files_batch_rule_name(value_files),
+            location,
+        )
+        if len(genTarget.outs) == 0:
+            genTarget.addTool(cls._configureFileTool(ctx, location))
+            for value_file in configure_file.value_files:
+                cls._addConfigureFileSrc(ctx, genTarget, value_file)
+            ctx.bazelbuild.bazelTargets.add(genTarget)
+
+        if normalized_output not in genTarget.renders:
+            genTarget.addOut(normalized_output)
+            genTarget.renders[normalized_output] = cls._addConfigureFileSrc(
+                ctx, genTarget, configure_file.source
+            )
+            # Outputs are discovered while walking the graph, regenerate the command
+            # every time one is added so that it renders all of them
+            args = [
+                f"--render $(location {source}) $(location {out})"
+                for out, source in sorted(genTarget.renders.items())
+            ]
+            args.extend(cls._configureFileArgs(value_files, configure_file))
+            genTarget.cmd = f"$(location :{CONFIGURE_FILE_TOOL_TARGET}) " + " ".join(
+                args
+            )
+        return genTarget.getOutputs(normalized_output)[0]
+
     @classmethod
     def handleFileForBazelGen(
         cls,
@@ -626,8 +872,8 @@ class Build:
             and el.opaque is None
             and not el.name.endswith("/protoc")
         ):
-            logging.info(
-                f"Dealing with external dep {el.name} that doesn't have an opaque"
+            logging.debug(
+                "Dealing with external dep %s that doesn't have an opaque", el.name
             )
             return
 
@@ -645,23 +891,23 @@ class Build:
                 # we end up visiting protobuf files and ctx.current is pointing to the c++ library or binary
                 # we don't want to add it here
 
-                target = f"{Build._getProtoName(dep)}_proto"
-                logging.info(f"Adding dep {target} to {el.name}")
+                target = f"{Build._getProtoName(dep, ctx.registry)}_proto"
+                logging.debug("Adding dep %s to %s", target, el.name)
                 if dep.name.startswith("@google/protobuf"):
                     ctx.current.addDep(
                         BazelExternalDep(target, "@com_google_protobuf//")
                     )
                 else:
-                    protoDep = getObject(
+                    protoDep = ctx.registry.getObject(
                         BazelProtoLibrary, target, ctx.current.location
                     )
                     for paramName, paramValue in dep.bazelAdditionalParameters.items():
-                        logging.info(
-                            f"Setting {paramName} to {paramValue} on {dep.name}"
+                        logging.debug(
+                            "Setting %s to %s on %s", paramName, paramValue, dep.name
                         )
                         protoDep.__setattr__(paramName, paramValue)
-                    logging.info(
-                        f"Got protoDep {protoDep} and ctx.current {ctx.current}"
+                    logging.debug(
+                        "Got protoDep %s and ctx.current %s", protoDep, ctx.current
                     )
                     protoDep.addSrc(
                         cls._genExportedFile(
@@ -681,11 +927,11 @@ class Build:
                     # This means that we found that we depend on the protobuf library cc_import
                     # but because bazel brings its own we don't need the cc_import one apart from any_pb
                     # because it might be needed
-                    logging.info("Adding any_cc_proto")
-                    any_proto = getObject(
+                    logging.debug("Adding any_cc_proto")
+                    any_proto = ctx.registry.getObject(
                         BazelExternalDep, "any_proto", "@com_google_protobuf//"
                     )
-                    any_cc_proto = getObject(
+                    any_cc_proto = ctx.registry.getObject(
                         BazelCCProtoLibrary, "any_cc_proto", ctx.current.location
                     )
                     any_cc_proto.addDep(any_proto)
@@ -693,8 +939,11 @@ class Build:
                     ctx.bazelbuild.bazelTargets.add(any_cc_proto)
                 else:
                     if isinstance(ctx.current, BazelGenRuleTarget):
-                        logging.info(
-                            f"Trying to add dep {imp} as a dependecy of {ctx.current.name} but it is ignored as gen_rule cannot have dependencies, hopefully analyzing the generated file will also yield the same dependency that will be properly added to the final target {el}"
+                        logging.debug(
+                            "Trying to add dep %s as a dependecy of %s but it is ignored as gen_rule cannot have dependencies, hopefully analyzing the generated file will also yield the same dependency that will be properly added to the final target %s",
+                            imp,
+                            ctx.current.name,
+                            el,
                         )
                     else:
                         ctx.current.addDep(imp)
@@ -717,11 +966,11 @@ class Build:
                     # We already have somewhere else the dependecy on protobuf most
                     # probably from the cc_proto_library or cc_grpc_library
                     # so we don't need to add it here but we still create a library for any.pb.h
-                    logging.info("Adding any_cc_proto to an external library")
-                    any_proto = getObject(
+                    logging.debug("Adding any_cc_proto to an external library")
+                    any_proto = ctx.registry.getObject(
                         BazelExternalDep, "any_proto", "@com_google_protobuf//"
                     )
-                    any_cc_proto = getObject(
+                    any_cc_proto = ctx.registry.getObject(
                         BazelCCProtoLibrary, "any_cc_proto", ctx.current.location
                     )
                     any_cc_proto.addDep(any_proto)
@@ -729,7 +978,10 @@ class Build:
                     ctx.bazelbuild.bazelTargets.add(any_cc_proto)
                 else:
                     logging.debug(
-                        f"Adding {maybe_cc_import.name} to {ctx.current.name} for external libray {el.name}"
+                        "Adding %s to %s for external libray %s",
+                        maybe_cc_import.name,
+                        ctx.current.name,
+                        el.name,
                     )
                     ctx.current.addDep(maybe_cc_import)
                     cls._addAllCCimportDeps(maybe_cc_import, ctx)
@@ -752,8 +1004,11 @@ class Build:
                 # we end up visiting protobuf files and ctx.current is pointing to the c++ library or binary
                 # we don't want to add it here
                 return
-            logging.info(
-                f"About to add proto {el.name} with includes {el.includes} to {ctx.current.name} "
+            logging.debug(
+                "About to add proto %s with includes %s to %s ",
+                el.name,
+                el.includes,
+                ctx.current.name,
             )
             ctx.current.addSrc(
                 cls._genExportedFile(
@@ -763,18 +1018,18 @@ class Build:
 
             for dep in el.depends:
                 # strip the @ marker
-                target = f"{Build._getProtoName(dep)}_proto"
-                logging.info(f"Adding dep {target} to {el.name}")
+                target = f"{Build._getProtoName(dep, ctx.registry)}_proto"
+                logging.debug("Adding dep %s to %s", target, el.name)
                 if dep.name.startswith("@google/protobuf"):
                     ctx.current.addDep(
                         BazelExternalDep(target, "@com_google_protobuf//")
                     )
                 else:
-                    protoDep = getObject(
+                    protoDep = ctx.registry.getObject(
                         BazelProtoLibrary, target, ctx.current.location
                     )
-                    logging.info(
-                        f"Got protoDep {protoDep} and ctx.current {ctx.current}"
+                    logging.debug(
+                        "Got protoDep %s and ctx.current %s", protoDep, ctx.current
                     )
                     protoDep.addSrc(
                         cls._genExportedFile(
@@ -788,7 +1043,7 @@ class Build:
 
         else:
             if el.type == TargetType.external:
-                logging.debug(f"Dealing with external dep {el.name}")
+                logging.debug("Dealing with external dep %s", el.name)
                 return
             # Not produced aka it's a file
             if el.name.startswith(workDir):
@@ -800,7 +1055,7 @@ class Build:
 
             configure_file = None
             if pregenerated:
-                logging.info(
+                logging.debug(
                     "Handling pregenerated file %s for target %s with workDir=%s",
                     name,
                     ctx.current.name,
@@ -834,8 +1089,11 @@ class Build:
                 return
             if isinstance(ctx.current, BazelGenRuleTarget):
                 return
-            logging.info(
-                f"Handling includes for {el.name} with includes {el.includes} in {ctx.current.name}"
+            logging.debug(
+                "Handling includes for %s with includes %s in %s",
+                el.name,
+                el.includes,
+                ctx.current.name,
             )
             cls._handleIncludeBazelTarget(el, ctx, workDir)
             if not isinstance(ctx.current, BazelTarget):
@@ -847,8 +1105,9 @@ class Build:
     ):
         if isinstance(ctx.current, BazelGenRuleTarget):
             # Gen rule cannot have include dirs
-            logging.info(
-                f"Skipping adding include dirs to {ctx.current.name} because it is a gen_rule"
+            logging.debug(
+                "Skipping adding include dirs to %s because it is a gen_rule",
+                ctx.current.name,
             )
             return
         for i, d in el.includes:
@@ -866,11 +1125,13 @@ class Build:
                     # we need to pad with another directory as it will be removed.
                     i = f"<pregenerated>/pregenerated/{i}"
 
-                logging.info(f"Found pregenerated include dir in workDir for {i} {d}")
+                logging.debug(
+                    "Found pregenerated include dir in workDir for %s %s", i, d
+                )
                 includeDir = d.replace(workDir, "")
                 pregenerated = True
             elif workDir is not None and d.startswith(workDir):
-                logging.info(f"Found include dir in workDir for {i} {d}")
+                logging.debug("Found include dir in workDir for %s %s", i, d)
                 includeDir = d.replace(workDir, "")
                 generated = True
             elif d.startswith("/generated"):
@@ -881,8 +1142,8 @@ class Build:
                 # when we process the buildTarget for the needed generated file we know where we need
                 # to add it as a include
                 ctx.current.addNeededGeneratedFiles(i)  # type: ignore
-                logging.info(
-                    f"Skipping adding generated header {i} -I {includeDir} in {el}"
+                logging.debug(
+                    "Skipping adding generated header %s -I %s in %s", i, includeDir, el
                 )
                 # Do not add the header to the list of headers to the bazel build object, this will be done
                 # when we will visit the build object for the generated files
@@ -893,10 +1154,10 @@ class Build:
                 includeDir = "This is wrong"
 
             if isinstance(ctx.current, BazelTarget):
-                # logging.info(f"Adding header {i} using include {includeDir} from {el.name} {generated} to {ctx.current.name}")
+                # logging.debug(f"Adding header {i} using include {includeDir} from {el.name} {generated} to {ctx.current.name}")
                 if includeDir is not None:
                     if pregenerated:
-                        logging.info(
+                        logging.debug(
                             "Handling pregenerated include %s from include dir %s "
                             "for target %s",
                             i,
@@ -944,7 +1205,7 @@ class Build:
         assert ":" in el.name
         (location, target) = el.name.split(":")
         t = BazelTarget("manually_generated", target, location)
-        logging.info(f"handleManuallyGeneratedForBazelGen for {el.name}")
+        logging.debug("handleManuallyGeneratedForBazelGen for %s", el.name)
         # We don't add the manually generated target to the list of target to generate because we
         # expect it to be well generated manually by the user
         if ctx.current is not None:
@@ -959,7 +1220,7 @@ class Build:
         cls, ctx: BazelBuildVisitorContext, el: "BuildTarget", build: "Build"
     ) -> bool:
         if ctx.current is None:
-            logging.debug(f"{el} is a phony target")
+            logging.debug("%s is a phony target", el)
         return True
 
     @classmethod
@@ -987,14 +1248,14 @@ class Build:
         self, ctx: BazelBuildVisitorContext, el: "BuildTarget", cmd: str
     ) -> bool:
         assert ctx.current is not None
-        proto = self._getProtoName(el)
+        proto = self._getProtoName(el, ctx.registry)
         arr = el.name.split(os.path.sep)
         filename = arr[-1]
         # TODO use negative forward looking
         regex = r"([^.]*)(\.grpc)?\.pb\.(cc|h)"
         match = re.match(regex, filename)
         if not match:
-            logging.info("not a match")
+            logging.debug("not a match")
             return True
         if match.group(2) is None:
             grpc = False
@@ -1005,8 +1266,13 @@ class Build:
             # We can face a situation where some headers require a pb.h or grpc.pb.h file
             # and so this buildTarget that is built by protoc is a dependency on them and so gets visited
             # we can't add the proto file as dependency instead either we take a cc_proto_library or a cc_grpc_library
-            logging.info(
-                f"Looking at header = {header} grpc = {grpc} {len(match.groups())} proto byproduct from {proto} to add to {ctx.current.name}"
+            logging.debug(
+                "Looking at header = %s grpc = %s %s proto byproduct from %s to add to %s",
+                header,
+                grpc,
+                len(match.groups()),
+                proto,
+                ctx.current.name,
             )
             # The following function will mess up the dest/current
             savedCurrent = ctx.current
@@ -1021,7 +1287,7 @@ class Build:
         location = TopLevelGroupingStrategy().getBuildFilenamePath(
             el, ctx.current.location if ctx.current else ctx.prefix
         )
-        t = getObject(BazelProtoLibrary, f"{proto}_proto", location)
+        t = ctx.registry.getObject(BazelProtoLibrary, f"{proto}_proto", location)
         ctx.bazelbuild.bazelTargets.add(t)
         self.setAssociatedBazelTarget(t)
 
@@ -1045,7 +1311,9 @@ class Build:
             location = TopLevelGroupingStrategy().getBuildFilenamePath(
                 el, ctx.current.location if ctx.current else ctx.prefix
             )
-            genTarget = getObject(BazelGenRuleTarget, f"{name}_command", location)
+            genTarget = ctx.registry.getObject(
+                BazelGenRuleTarget, f"{name}_command", location
+            )
 
             # allInputs is all the inputs with the rootdir stripped
             allInputs: List[str] = []
@@ -1054,7 +1322,7 @@ class Build:
                 allInputs.append(re.sub(regex, "", i.name))
             regex = f"{ctx.rootdir}/?"
             cmd = re.sub(regex, "", cmd)
-            logging.info(f"Handling custom command {cmd}")
+            logging.debug("Handling custom command %s", cmd)
             cmdCopy = cmd
 
             arr: List[str] = list(filter(lambda x: x != "", cmdCopy.split(" ")))
@@ -1072,15 +1340,20 @@ class Build:
                     name = name.replace(location + "/", "")
 
                 if altName != name and location + "/" + altName in shortNames:
-                    logging.info(f"Creating alias {name} for {altName}")
+                    logging.debug("Creating alias %s for %s", name, altName)
                     genTarget.addOut(altName, name)
                 else:
                     outDirs.add(os.path.dirname(name))
                     outFiles.add(name)
                     genTarget.addOut(name)
 
-            logging.info(
-                f"Current build path for target: {TopLevelGroupingStrategy().getBuildFilenamePath(el, ctx.current.location if ctx.current else ctx.prefix)}"
+            logging.debug(
+                "Current build path for target: %s",
+                Lazy(
+                    TopLevelGroupingStrategy().getBuildFilenamePath,
+                    el,
+                    ctx.current.location if ctx.current else ctx.prefix,
+                ),
             )
             countRewrote = 0
             countInput = 0
@@ -1126,7 +1399,7 @@ class Build:
                     if outFile == os.path.basename(arg) or outFile.endswith(
                         os.path.sep + os.path.basename(arg)
                     ):
-                        logging.info(f"Mapping arg: {arg} to ouput: {outFile}")
+                        logging.debug("Mapping arg: %s to ouput: %s", arg, outFile)
                         prefix = ":" if not outFile.startswith(":") else ""
                         alteredArgs.append(f"$(location {prefix}{outFile})")
                         countRewrote += 1
@@ -1164,12 +1437,14 @@ class Build:
                         countInput += 1
                     else:
                         if arg.startswith(workDir):
-                            logging.info(
-                                f"Assuming {arg} can be replaced by {arg.replace(workDir, '')} as it starts with workDir"
+                            logging.debug(
+                                "Assuming %s can be replaced by %s as it starts with workDir",
+                                arg,
+                                arg.replace(workDir, ""),
                             )
                             alteredArgs.append(arg.replace(workDir, ""))
                             continue
-                        logging.info(f"{arg} not found in the output hope it's ok")
+                        logging.debug("%s not found in the output hope it's ok", arg)
                     alteredArgs.append(arg)
 
             # In theory it would be a good idea to not have to genbuild the script that will be used
@@ -1182,7 +1457,7 @@ class Build:
                 .replace(" ", "_")
                 .replace("-", "_")
             )
-            toolBuildTarget = getObject(
+            toolBuildTarget = ctx.registry.getObject(
                 BazelGenRuleTarget, f"gen_{sanitized_command}_wrapper_script", location
             )
             toolBuildTarget.cmd = genShBinaryScript(ctx.rootdir, command)
@@ -1232,7 +1507,9 @@ class Build:
         location = TopLevelGroupingStrategy().getBuildFilenamePath(
             el, ctx.current.location if ctx.current else ctx.prefix
         )
-        logging.info(f"Looking for generated files for {el.shortName} in {location}")
+        logging.debug(
+            "Looking for generated files for %s in %s", el.shortName, location
+        )
         outs = genTarget.getOutputs(el.shortName, location)
 
         # Generated files are not added (anymore) directly to the bazelTarget when we finalize the
@@ -1241,11 +1518,13 @@ class Build:
         for t in outs:
             if ctx.current is not None:
                 logging.debug(
-                    f"Looking generated file {t} in {ctx.current.neededGeneratedFiles}"
+                    "Looking generated file %s in %s",
+                    t,
+                    ctx.current.neededGeneratedFiles,
                 )
                 # ignoretype
                 if t.name.endswith(".h") and t in ctx.current.neededGeneratedFiles:
-                    logging.debug(f"Found {t} in {ctx.current.neededGeneratedFiles}")
+                    logging.debug("Found %s in %s", t, ctx.current.neededGeneratedFiles)
                     # TODO Figure out if we need some strip_include_prefix by matching the file
                     # with the different -I flags from the command line
                     assert isinstance(ctx.current, BazelTarget)
@@ -1256,10 +1535,10 @@ class Build:
                 elif t.name.endswith(CPP_SOURCE_EXTENSIONS):
                     ctx.current.addSrc(t)
                     self._propagateGeneratedSourceCCImportDeps(el, ctx)
-                    logging.debug(f"Found {t} in {ctx.current.name} CC")
+                    logging.debug("Found %s in %s CC", t, ctx.current.name)
                     self._handleIncludeBazelTarget(el, ctx, workDir)
                 else:
-                    logging.info(f"Adding {t} to {ctx.current.name}")
+                    logging.debug("Adding %s to %s", t, ctx.current.name)
                     assert isinstance(ctx.current, BazelTarget)
                     ctx.current.addData(t)
             elif ctx.current is not None:
@@ -1267,8 +1546,11 @@ class Build:
                 [ctx.current.addDep(o) for o in outs]
 
         current_context_name = ctx.current.name if ctx.current else ""
-        logging.info(
-            f"Settings current to {genTarget.name} for {el.name} , previous: {current_context_name}"
+        logging.debug(
+            "Settings current to %s for %s , previous: %s",
+            genTarget.name,
+            el.name,
+            current_context_name,
         )
         # I'm questioning the logic behind that as of July 2025 as there are a lot of things that
         # can't be added to a BazelGenRuleTarget
@@ -1278,7 +1560,7 @@ class Build:
         return True
 
     @classmethod
-    def _getProtoName(kls, element: BuildTarget) -> str:
+    def _getProtoName(kls, element: BuildTarget, registry: TargetRegistry) -> str:
         regex = r"(.*?)(\.grpc)?\.pb\.(cc|h|cc\.o)$"
         # clean extentions
         matches = re.match(regex, element.shortName)
@@ -1299,21 +1581,24 @@ class Build:
             # Protobuf files seems not have location (why ?) so it helps normalize the name
             name = f"{element.location}{name}"
 
-        if name in kls._protoNames:
-            return kls._protoNames[name]
+        if name in registry.protoNames:
+            return registry.protoNames[name]
 
-        logging.debug(f"Getting proto name for {element.shortName} => {name}")
+        logging.debug("Getting proto name for %s => %s", element.shortName, name)
         arr = name.split(os.path.sep)
         filename = arr[-1]
-        existingNames = list(kls._protoNames.values())
-
         for i in sorted(range(-len(arr), 0), reverse=True):
             logging.debug(
-                f"Checking {name} {arr[i:]} i = {i} location = {element.location}"
+                "Checking %s %s i = %s location = %s",
+                name,
+                arr[i:],
+                i,
+                element.location,
             )
             filename = "_".join(arr[i:])
-            if filename not in existingNames:
-                kls._protoNames[name] = filename
+            if filename not in registry.protoNameValues:
+                registry.protoNames[name] = filename
+                registry.protoNameValues.add(filename)
                 return filename
         assert False
 
@@ -1321,46 +1606,44 @@ class Build:
         assert ctx.current is not None
         # We can rely on self.associatedBazelTarget usually protobuf related target produces multiple files and multiple bazel targets
         # Now that we cache the associated bazel targets there is limited risk to "recreate" the same target
-        proto = self._getProtoName(el)
+        proto = self._getProtoName(el, ctx.registry)
 
         location = TopLevelGroupingStrategy().getBuildFilenamePath(
             el, ctx.current.location if ctx.current else ctx.prefix
         )
-        t: BaseBazelTarget = getObject(
+        t: BaseBazelTarget = ctx.registry.getObject(
             BazelGRPCCCProtoLibrary, f"{proto}_cc_grpc", location
         )
         ctx.bazelbuild.bazelTargets.add(t)
-        for tgt in ctx.bazelbuild.bazelTargets:
-            if tgt.name == f"{proto}_cc_proto":
-                t.addDep(tgt)
+        for tgt in ctx.bazelbuild.bazelTargets.withName(f"{proto}_cc_proto"):
+            t.addDep(tgt)
         ctx.current.addDep(t)
         ctx.next_current = t
         ctx.current = t
 
     def _handleCCProtobuf(self, ctx: BazelBuildVisitorContext, el: BuildTarget):
         assert ctx.current is not None
-        proto = self._getProtoName(el)
+        proto = self._getProtoName(el, ctx.registry)
 
         location = TopLevelGroupingStrategy().getBuildFilenamePath(
             el, ctx.current.location if ctx.current else ctx.prefix
         )
 
-        t: BaseBazelTarget = getObject(
+        t: BaseBazelTarget = ctx.registry.getObject(
             BazelCCProtoLibrary, f"{proto}_cc_proto", location
         )
         ctx.current.addDep(t)
         ctx.bazelbuild.bazelTargets.add(t)
-        for tgt in ctx.bazelbuild.bazelTargets:
-            if tgt.name == f"{proto}_cc_grpc":
-                assert isinstance(tgt, BaseBazelTarget)
-                tgt.addDep(t)
+        for tgt in ctx.bazelbuild.bazelTargets.withName(f"{proto}_cc_grpc"):
+            assert isinstance(tgt, BaseBazelTarget)
+            tgt.addDep(t)
         ctx.next_current = t
         ctx.current = t
 
     def _handleCPPLinkExecutableCommand(
         self, el: BuildTarget, cmd: str, ctx: BazelBuildVisitorContext
     ) -> bool:
-        logging.info(el.name)
+        logging.debug(el.name)
         location = TopLevelGroupingStrategy().getBuildFilenamePath(
             el, ctx.current.location if ctx.current else ctx.prefix
         )
@@ -1371,9 +1654,9 @@ class Build:
             else:
                 name = el.shortName.replace("/", "_").replace(".", "_")
 
-            logging.info(f"Creating cc_library/cc_binary/cc_test for {el.name}")
+            logging.debug("Creating cc_library/cc_binary/cc_test for %s", el.name)
             if el.name.endswith(".a"):
-                t = getObject(
+                t = ctx.registry.getObject(
                     BazelTarget,
                     "cc_library",
                     name[:-2],
@@ -1382,11 +1665,11 @@ class Build:
                 t.addPrefixIfRequired = False
                 nextCurrent = t
             else:
-                logging.info(f"Creating cc_binary/cc_test for {name}")
+                logging.debug("Creating cc_binary/cc_test for %s", name)
                 if el.name.endswith("_test"):
-                    t = getObject(BazelTarget, "cc_test", name, location)
+                    t = ctx.registry.getObject(BazelTarget, "cc_test", name, location)
                 else:
-                    t = getObject(BazelTarget, "cc_binary", name, location)
+                    t = ctx.registry.getObject(BazelTarget, "cc_binary", name, location)
 
             ctx.bazelbuild.bazelTargets.add(t)
             self.setAssociatedBazelTarget(t)
@@ -1419,16 +1702,16 @@ class Build:
             else:
                 name = name.replace("/", "_").replace(".", "_")
 
-            logging.info(f"Creating cc_library/cc_binary/cc_test for {name}")
+            logging.debug("Creating cc_library/cc_binary/cc_test for %s", name)
             if self.vars.get("SONAME") is not None:
-                staticLibTarget = getObject(
+                staticLibTarget = ctx.registry.getObject(
                     BazelTarget,
                     "cc_library",
                     name,
                     location,
                 )
                 staticLibTarget.addPrefixIfRequired = False
-                t = getObject(
+                t = ctx.registry.getObject(
                     BazelTarget,
                     "cc_shared_library",
                     "shared_" + name,
@@ -1442,7 +1725,7 @@ class Build:
                 # Bazel wants only libraries not shared as dependencies
                 t = staticLibTarget
             elif el.name.endswith(".a"):
-                t = getObject(
+                t = ctx.registry.getObject(
                     BazelTarget,
                     "cc_library",
                     name[:-2],
@@ -1451,11 +1734,11 @@ class Build:
                 t.addPrefixIfRequired = False
                 nextCurrent = t
             else:
-                logging.info(f"Creating cc_binary/cc_test for {name}")
+                logging.debug("Creating cc_binary/cc_test for %s", name)
                 if el.name.endswith("_test"):
-                    t = getObject(BazelTarget, "cc_test", name, location)
+                    t = ctx.registry.getObject(BazelTarget, "cc_test", name, location)
                 else:
-                    t = getObject(BazelTarget, "cc_binary", name, location)
+                    t = ctx.registry.getObject(BazelTarget, "cc_binary", name, location)
                 nextCurrent = t
             ctx.bazelbuild.bazelTargets.add(t)
             self.setAssociatedBazelTarget(t)
@@ -1508,7 +1791,7 @@ class Build:
             location = TopLevelGroupingStrategy().getBuildFilenamePath(
                 el, ctx.current.location if ctx.current else ctx.prefix
             )
-            t = getObject(BazelTarget, "cc_library", el.name, location)
+            t = ctx.registry.getObject(BazelTarget, "cc_library", el.name, location)
             if ctx.current is not None:
                 ctx.current.addDep(t)
             ctx.current = t
@@ -1605,7 +1888,8 @@ class Build:
                 continue
             if i.producedby is not None:
                 logging.debug(
-                    f"Skipping produced {i} to find includes, it should be dealt by its build"
+                    "Skipping produced %s to find includes, it should be dealt by its build",
+                    i,
                 )
                 continue
 
@@ -46,7 +46,7 @@ class BuildVisitor:
             (cmd, _) = rawCmd
             return build.handleRuleProducedForBazelGen(ctx, el, cmd)
         elif build.rulename.name == "phony":
-            logging.info(f"Handling phony {build.outputs[0]}")
+            logging.debug("Handling phony %s", build.outputs[0])
             return build.handlePhonyForBazelGen(ctx, el, build)
         else:
             assert False
@@ -59,14 +59,14 @@ class BuildVisitor:
             build = el.producedby
             parentBuild = ctx.producer
             if el.alias is not None:
-                logging.info(f"Visiting alias {el.alias.name} instead of {el.name}")
+                logging.debug("Visiting alias %s instead of %s", el.alias.name, el.name)
                 return visitor(el.alias, ctx, _var)
 
             assert isinstance(ctx, BazelBuildVisitorContext)
             # FIXME this is most probably wrong after all and should be removed
             if parentBuild is not None and ctx.parentIsPhony and ctx.current is None:
                 pass
-                # logging.info( f"Skipping {el.name} {showParentBuildDetail(parentBuild)} because it's a chain of empty targets")
+                # logging.debug( f"Skipping {el.name} {showParentBuildDetail(parentBuild)} because it's a chain of empty targets")
                 # return False
             if el.producedby is not None:
                 build = el.producedby
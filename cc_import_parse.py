@@ -1,12 +1,21 @@
+import ast
 import glob
+import hashlib
+import json
 import logging
+import os
 import re
-from typing import Optional, Set, Union
+from typing import Any, Dict, List, Optional, Set, Union
 
 from bazel import BazelCCImport, BaseBazelTarget
+from helpers import writeCacheFile
+from lazyglob import HeaderSet, LazyGlob
 
 
 def _processValue(inflightVals: str, inflightAttr: str, current: BazelCCImport):
+    # The globs of hdrs are only used to check if a header comes from the cc_import, they
+    # are expanded only if the BUILD file needs the list
+    expandGlob = lazy_glob if inflightAttr == "hdrs" else parse_glob
     inGlob = False
     assert inflightVals is not None
     assert inflightAttr is not None
@@ -17,7 +26,7 @@ def _processValue(inflightVals: str, inflightAttr: str, current: BazelCCImport):
         val = v.strip()
         if val.startswith("glob(["):
             if match_glob(val):
-                vals.extend(parse_glob(val))
+                vals.extend(expandGlob(val))
             else:
                 inGlob = True
                 tmp.append(val)
@@ -40,12 +49,169 @@ def _processValue(inflightVals: str, inflightAttr: str, current: BazelCCImport):
                     vals.append(subVal)
     if inGlob:
         inGlob = False
-        vals.extend(parse_glob("".join(tmp)))
+        vals.extend(expandGlob("".join(tmp)))
         tmp = []
-    setattr(current, inflightAttr, vals)
+    if inflightAttr == "hdrs":
+        current.setHdrs(HeaderSet(vals))
+    else:
+        setattr(current, inflightAttr, vals)
 
 
-def parseCCImports(raw_imports: list[str], location: str) -> list[BazelCCImport]:
+# Bump when the format of the cached stanzas changes
+_CACHE_VERSION = "1"
+
+_SCALAR_ATTRIBUTES = {
+    "name",
+    "alias",
+    "interface_library",
+    "shared_library",
+    "skip_wrapping",
+    "static_library",
+    "static_libs",
+}
+_LIST_ATTRIBUTES = {"deps", "hdrs", "includes"}
+
+
+def _evaluate(node: ast.expr) -> Any:
+    """Evaluate the Starlark subset used by imports files.
+
+    Lists are returned as a list of strings and {"glob": [patterns]} entries so that the
+    stanzas can be stored as JSON.
+    """
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        ret: List[Any] = []
+        for elt in node.elts:
+            val = _evaluate(elt)
+            if isinstance(val, list):
+                ret.extend(val)
+            else:
+                ret.append(val)
+        return ret
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "glob"
+        and len(node.args) == 1
+        and not node.keywords
+    ):
+        patterns = _evaluate(node.args[0])
+        if not isinstance(patterns, list) or not all(
+            isinstance(p, str) for p in patterns
+        ):
+            raise ValueError(f"Unsupported glob() at line {node.lineno}")
+        return [{"glob": patterns}]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _evaluate(node.left)
+        right = _evaluate(node.right)
+        if isinstance(left, list) != isinstance(right, list):
+            raise ValueError(f"Can't add a list and a scalar at line {node.lineno}")
+        return left + right
+    raise ValueError(f"Unsupported expression {ast.dump(node)} at line {node.lineno}")
+
+
+def parseStanzas(content: str) -> List[Dict[str, Any]]:
+    """Return the attributes of the cc_import() of an imports file.
+
+    Raise SyntaxError if the content is not valid Starlark (Python) syntax.
+    """
+    stanzas = []
+    for stmt in ast.parse(content).body:
+        if not isinstance(stmt, ast.Expr) or not isinstance(stmt.value, ast.Call):
+            continue
+        call = stmt.value
+        if not isinstance(call.func, ast.Name) or call.func.id != "cc_import":
+            continue
+        stanza = {}
+        for kw in call.keywords:
+            if kw.arg in _SCALAR_ATTRIBUTES or kw.arg in _LIST_ATTRIBUTES:
+                stanza[kw.arg] = _evaluate(kw.value)
+        if "name" not in stanza:
+            raise ValueError(f"cc_import() without a name at line {call.lineno}")
+        stanzas.append(stanza)
+    return stanzas
+
+
+def _cachedStanzas(content: str, cacheDir: Optional[str]) -> List[Dict[str, Any]]:
+    if cacheDir is None:
+        return parseStanzas(content)
+    digest = hashlib.sha1(f"{_CACHE_VERSION}\0{content}".encode()).hexdigest()
+    cacheFile = os.path.join(cacheDir, f"{digest}.json")
+    try:
+        with open(cacheFile, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    stanzas = parseStanzas(content)
+    writeCacheFile(cacheFile, json.dumps(stanzas))
+    return stanzas
+
+
+def _expandList(attribute: str, vals: List[Any]) -> List[Union[str, LazyGlob]]:
+    ret: List[Union[str, LazyGlob]] = []
+    for val in vals:
+        if isinstance(val, dict):
+            for pattern in val["glob"]:
+                if attribute == "hdrs":
+                    ret.append(LazyGlob(pattern))
+                else:
+                    ret.extend(glob.glob(pattern, recursive=True))
+        else:
+            ret.append(str(val))
+    return ret
+
+
+def _importFromStanza(stanza: Dict[str, Any], location: str) -> BazelCCImport:
+    current = BazelCCImport(str(stanza["name"]))
+    # Force this external repo
+    current.setLocation("@cpp_ext_libs//")
+    current.setPhysicalLocation(location)
+    for attribute, val in stanza.items():
+        if attribute in _LIST_ATTRIBUTES:
+            if not isinstance(val, list):
+                val = [val]
+            vals = _expandList(attribute, val)
+            if attribute == "hdrs":
+                current.setHdrs(HeaderSet(vals))
+            else:
+                setattr(current, attribute, vals)
+        elif attribute == "alias":
+            current.setAlias(str(val))
+        elif attribute in ["interface_library", "shared_library"]:
+            current.setSharedLibrarys(str(val))
+        elif attribute == "skip_wrapping":
+            current.setSkipWrapping(val is True or val == "True")
+        elif attribute in ["static_library", "static_libs"]:
+            current.setStaticLibrarys(str(val))
+    return current
+
+
+def parseCCImports(
+    raw_imports: list[str], location: str, cacheDir: Optional[str] = None
+) -> list[BazelCCImport]:
+    """Parse the cc_import() of imports files.
+
+    The parsed stanzas are cached in cacheDir (if set) keyed by the hash of the content,
+    files that are not valid Starlark (or that use expressions that are not supported) are
+    parsed with the legacy line based parser.
+    """
+    imports: Dict[str, BazelCCImport] = {}
+    try:
+        for stanza in _cachedStanzas("".join(raw_imports), cacheDir):
+            imp = _importFromStanza(stanza, location)
+            imports[imp.name] = imp
+    except (SyntaxError, ValueError) as e:
+        # Not Starlark or an expression that is not evaluated (ie. glob(exclude=...))
+        logging.info("Can't evaluate the imports (%s), using the line parser", e)
+        imports = _parseCCImportsLines(raw_imports, location)
+    _resolveDeps(imports)
+    return list(imports.values())
+
+
+def _parseCCImportsLines(
+    raw_imports: list[str], location: str
+) -> Dict[str, BazelCCImport]:
     imports = {}
     newObj = False
     current: Optional[BazelCCImport] = None
@@ -114,7 +280,10 @@ def parseCCImports(raw_imports: list[str], location: str) -> list[BazelCCImport]
         else:
             if inflightVals is not None:
                 inflightVals += f"\n{line}"
+    return imports
 
+
+def _resolveDeps(imports: Dict[str, BazelCCImport]) -> None:
     for imp in imports.values():
         newDeps: Set[Union[BazelCCImport, BaseBazelTarget]] = set()
         for d in imp.deps:
@@ -122,16 +291,14 @@ def parseCCImports(raw_imports: list[str], location: str) -> list[BazelCCImport]
                 if d.name not in imports:
                     raise ValueError(f"Dependency {d} not found")
                 logging.debug(
-                    f"Adding dependency {d.name} location {imports[d.name].location}"
+                    "Adding dependency %s location %s", d.name, imports[d.name].location
                 )
                 newDeps.add(imports[d.name])
             else:
-                logging.debug(f"Adding dependency {d.name} location {d.location}")
+                logging.debug("Adding dependency %s location %s", d.name, d.location)
                 newDeps.add(d)
         imp.deps = newDeps
 
-    return list(imports.values())
-
 
 def cleanupVar(var: str) -> str:
     return var.replace('"', "").replace("'", "").replace(",", "").strip()
@@ -143,22 +310,30 @@ def match_glob(raw_glob: str) -> bool:
     return matches is not None
 
 
-def parse_glob(raw_glob: str) -> list[str]:
-    ret: list[str] = []
+def _glob_patterns(raw_glob: str) -> list[str]:
     regex = r"glob\(\s*\[(.*)\]\s*\)"
 
-    logging.debug(f"Processing glob: {raw_glob}")
+    logging.debug("Processing glob: %s", raw_glob)
     matches = re.search(regex, raw_glob)
     if not matches or not matches.group(1):
         logging.error(f"Error parsing glob: {raw_glob}")
         raise ValueError(f"Error parsing not matching this regex {regex}")
 
-    for e in matches.group(1).split(","):
-        e = e.strip()
-        pattern = e.replace('"', "").replace("'", "")
+    return [
+        e.strip().replace('"', "").replace("'", "") for e in matches.group(1).split(",")
+    ]
+
+
+def parse_glob(raw_glob: str) -> list[str]:
+    ret: list[str] = []
+    for pattern in _glob_patterns(raw_glob):
         matching_files = glob.glob(pattern, recursive=True)
 
         # Print the matching files
         for file in matching_files:
             ret.append(file)
     return ret
+
+
+def lazy_glob(raw_glob: str) -> list[LazyGlob]:
+    return [LazyGlob(pattern) for pattern in _glob_patterns(raw_glob)]
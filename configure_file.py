@@ -5,10 +5,15 @@ import shlex
 from dataclasses import dataclass
 from typing import Dict, Iterable, List, Optional, Set
 
+from logutils import Lazy
+
 
 PLACEHOLDER_RE = re.compile(r"@([A-Za-z_][A-Za-z0-9_]*)@|\$\{([A-Za-z_][A-Za-z0-9_]*)\}")
 CMAKE_DEFINE_RE = re.compile(r"^\s*#\s*cmakedefine(?:01)?\s+([A-Za-z_][A-Za-z0-9_]*)", re.MULTILINE)
-SET_RE_TEMPLATE = r"(?:^|[^A-Za-z0-9_])(?:env_set|set)\s*\(\s*{name}(?:\s|\))"
+# Any set(VAR ...)/env_set(VAR ...), VAR is captured
+SET_DEFINITION_RE = re.compile(
+    r"(?<![A-Za-z0-9_])(?:env_set|set)\s*\(\s*([A-Za-z_][A-Za-z0-9_]*)(?=[\s)])"
+)
 
 
 @dataclass(frozen=True)
@@ -121,8 +126,25 @@ def _iter_candidate_files(rootdir: str) -> Iterable[str]:
                 yield os.path.join(current, filename)
 
 
+def _index_value_definitions(rootdir: str) -> Dict[str, Set[str]]:
+    """
+    Walk the candidate CMake files once and map every variable defined with
+    set()/env_set() to the files defining it.
+    """
+    index: Dict[str, Set[str]] = {}
+    for path in _iter_candidate_files(rootdir):
+        try:
+            with open(path, "r", errors="ignore") as f:
+                contents = f.read()
+        except OSError:
+            continue
+        for name in set(SET_DEFINITION_RE.findall(contents)):
+            index.setdefault(name, set()).add(path)
+    return index
+
+
 def _find_value_files(
-    rootdir: str,
+    index: Dict[str, Set[str]],
     placeholders: Set[str],
     template_path: str,
     fail_on_missing: bool = True,
@@ -130,18 +152,13 @@ def _find_value_files(
     if not placeholders:
         return ()
 
-    found: Dict[str, Set[str]] = {placeholder: set() for placeholder in placeholders}
-    for path in _iter_candidate_files(rootdir):
-        if os.path.normpath(path) == os.path.normpath(template_path):
-            continue
-        try:
-            with open(path, "r", errors="ignore") as f:
-                contents = f.read()
-        except OSError:
-            continue
-        for placeholder in placeholders:
-            if re.search(SET_RE_TEMPLATE.format(name=re.escape(placeholder)), contents):
-                found[placeholder].add(path)
+    template = os.path.normpath(template_path)
+    found: Dict[str, Set[str]] = {
+        placeholder: {
+            path for path in index.get(placeholder, ()) if os.path.normpath(path) != template
+        }
+        for placeholder in placeholders
+    }
 
     missing = sorted([placeholder for placeholder, paths in found.items() if not paths])
     if missing and fail_on_missing:
@@ -230,20 +247,112 @@ def _describe_configure_file(key: str, entry: ConfigureFile, binary_dir: str) ->
     )
 
 
+class _SuffixTrieNode:
+    __slots__ = ("children", "minIndex", "keyIndex")
+
+    def __init__(self):
+        self.children: Dict[str, "_SuffixTrieNode"] = {}
+        # Smallest insertion index of the keys below this node (included)
+        self.minIndex: Optional[int] = None
+        # Insertion index of the key ending exactly at this node
+        self.keyIndex: Optional[int] = None
+
+
+class ConfigureFiles(Dict[str, ConfigureFile]):
+    """
+    configure_file entries indexed by output path, keys are also stored in a trie of their
+    reversed path components so that suffix matching costs O(path depth) instead of a scan.
+    Lookups that didn't match anything are recorded for an end of run report.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._root = _SuffixTrieNode()
+        self._keys: List[str] = []
+        self.misses: Dict[str, List[str]] = {}
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key: str, value: ConfigureFile) -> None:
+        if key not in self:
+            self._insert(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._root = _SuffixTrieNode()
+        self._keys = []
+        for k in self:
+            self._insert(k)
+
+    def update(self, *args, **kwargs) -> None:  # type: ignore[override]
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def _insert(self, key: str) -> None:
+        index = len(self._keys)
+        self._keys.append(key)
+        node = self._root
+        for component in reversed(key.split("/")):
+            node = node.children.setdefault(component, _SuffixTrieNode())
+            if node.minIndex is None:
+                node.minIndex = index
+        if node.keyIndex is None:
+            node.keyIndex = index
+
+    def suffixMatch(self, candidates: List[str]) -> Optional[str]:
+        """
+        Return the first key (in insertion order) that ends with one of the candidates or that
+        one of the candidates ends with, paths are compared component by component.
+        """
+        best: Optional[int] = None
+        for candidate in candidates:
+            node = self._root
+            for component in reversed(candidate.split("/")):
+                child = node.children.get(component)
+                if child is None:
+                    node = None
+                    break
+                node = child
+                # The candidate ends with this key
+                if node.keyIndex is not None and (best is None or node.keyIndex < best):
+                    best = node.keyIndex
+            # All the keys below end with the candidate
+            if node is not None and node.minIndex is not None:
+                if best is None or node.minIndex < best:
+                    best = node.minIndex
+        return self._keys[best] if best is not None else None
+
+    def recordMiss(self, output: str, candidates: List[str]) -> None:
+        self.misses.setdefault(_normalize_path(output), candidates)
+
+    def missReport(self, binary_dir: str) -> str:
+        lines = [
+            f"{len(self.misses)} pregenerated file(s) didn't match any of the "
+            f"{len({entry.output for entry in self.values()})} configure_file entries "
+            f"(binary_dir={_normalize_path(binary_dir)}):"
+        ]
+        for output, candidates in sorted(self.misses.items()):
+            lines.append(f"  {output}, tried {candidates}")
+        lines.append("Configured entries:")
+        for key, entry in sorted(self.items()):
+            lines.append(f"  {_describe_configure_file(key, entry, binary_dir)}")
+        return "\n".join(lines)
+
+
 def parse_configure_files_list(
     filename: Optional[str],
     source_dir: str,
     binary_dir: str,
     configure_vars: Optional[Dict[str, str]] = None,
     needed_outputs: Optional[Set[str]] = None,
-) -> Dict[str, ConfigureFile]:
+) -> ConfigureFiles:
     if not filename:
-        return {}
+        return ConfigureFiles()
     if not os.path.exists(filename):
         logging.fatal(f"Configure files list {filename} does not exist")
         raise SystemExit(-1)
 
-    ret: Dict[str, ConfigureFile] = {}
+    ret = ConfigureFiles()
     normalized_needed_outputs = (
         {_normalize_path(output) for output in needed_outputs}
         if needed_outputs is not None
@@ -251,6 +360,8 @@ def parse_configure_files_list(
     )
     with open(filename, "r") as f:
         lines = f.readlines()
+    # Built on the first entry that has placeholders to look for
+    value_index: Optional[Dict[str, Set[str]]] = None
     for line in lines:
         args = _parse_configure_file_args(line)
         if args is None:
@@ -274,7 +385,7 @@ def parse_configure_files_list(
         if normalized_needed_outputs is not None and not (
             output_keys & normalized_needed_outputs
         ):
-            logging.info(
+            logging.debug(
                 "Skipping configure_file entry for output %s because none of its "
                 "keys %s are needed; needed output count=%d",
                 _normalize_path(output),
@@ -288,12 +399,14 @@ def parse_configure_files_list(
         configured_variable_names = set(variables.keys())
         required_placeholders -= configured_variable_names
         optional_placeholders -= configured_variable_names
+        if value_index is None and (required_placeholders or optional_placeholders):
+            value_index = _index_value_definitions(source_dir)
         value_files = tuple(
             sorted(
-                set(_find_value_files(source_dir, required_placeholders, source))
+                set(_find_value_files(value_index or {}, required_placeholders, source))
                 | set(
                     _find_value_files(
-                        source_dir,
+                        value_index or {},
                         optional_placeholders,
                         source,
                         fail_on_missing=False,
@@ -309,7 +422,7 @@ def parse_configure_files_list(
         )
         ret[_normalize_path(output)] = entry
         ret[_normalize_path(os.path.relpath(output, binary_dir))] = entry
-        logging.info(
+        logging.debug(
             "Registered configure_file output %s from source %s with keys %s",
             _normalize_path(output),
             _normalize_path(source),
@@ -324,35 +437,13 @@ def parse_configure_files_list(
     return ret
 
 
-def _log_configure_file_miss(
-    configure_files: Dict[str, ConfigureFile],
-    output: str,
-    binary_dir: str,
-    normalized: List[str],
-) -> None:
-    logging.info(
-        "No configure_file matched requested output %s. Tried candidates: %s. "
-        "binary_dir=%s. configured entries=%d",
-        _normalize_path(output),
-        normalized,
-        _normalize_path(binary_dir),
-        len({entry.output for entry in configure_files.values()}),
-    )
-    for key, entry in sorted(configure_files.items()):
-        logging.info(
-            "Configured configure_file did not match %s: %s",
-            _normalize_path(output),
-            _describe_configure_file(key, entry, binary_dir),
-        )
-
-
 def find_configure_file(
     configure_files: Dict[str, ConfigureFile],
     output: str,
     binary_dir: str,
 ) -> Optional[ConfigureFile]:
     if not configure_files:
-        logging.info(
+        logging.debug(
             "No configure_file entries are configured while looking for %s",
             _normalize_path(output),
         )
@@ -365,28 +456,41 @@ def find_configure_file(
     if not os.path.isabs(output):
         candidates.append(os.path.join(binary_dir, output.replace("pregenerated/", "", 1)))
     normalized = [_normalize_path(candidate) for candidate in candidates]
-    logging.info(
+    logging.debug(
         "Looking for configure_file match for %s using candidates %s",
         _normalize_path(output),
         normalized,
     )
     for candidate in normalized:
         if candidate in configure_files:
-            logging.info(
+            logging.debug(
                 "Matched configure_file for %s by exact candidate %s: %s",
                 _normalize_path(output),
                 candidate,
-                _describe_configure_file(candidate, configure_files[candidate], binary_dir),
+                Lazy(
+                    _describe_configure_file,
+                    candidate,
+                    configure_files[candidate],
+                    binary_dir,
+                ),
             )
             return configure_files[candidate]
-    for key, entry in configure_files.items():
-        if any(key.endswith(candidate) or candidate.endswith(key) for candidate in normalized):
-            logging.info(
-                "Matched configure_file for %s by suffix key %s: %s",
-                _normalize_path(output),
-                key,
-                _describe_configure_file(key, entry, binary_dir),
-            )
-            return entry
-    _log_configure_file_miss(configure_files, output, binary_dir, normalized)
+    if not isinstance(configure_files, ConfigureFiles):
+        configure_files = ConfigureFiles(configure_files)
+    key = configure_files.suffixMatch(normalized)
+    if key is not None:
+        entry = configure_files[key]
+        logging.debug(
+            "Matched configure_file for %s by suffix key %s: %s",
+            _normalize_path(output),
+            key,
+            Lazy(_describe_configure_file, key, entry, binary_dir),
+        )
+        return entry
+    logging.debug(
+        "No configure_file matched requested output %s. Tried candidates: %s",
+        _normalize_path(output),
+        normalized,
+    )
+    configure_files.recordMiss(output, normalized)
     return None
@@ -2,11 +2,25 @@ import logging
 import os
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, Generator, List, Optional, Set, Tuple
+from enum import Enum
+from typing import (
+    AbstractSet,
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from bazel import BazelCCImport
 from build import BuildTarget
 from helpers import resolvePath
+from includescanner import MacroTable, scanIncludes
 
 
 def findAllHeaderFiles(current_dir: str) -> Generator[str, None, None]:
@@ -32,15 +46,119 @@ def parseIncludes(includes: str) -> List[str]:
     return ret
 
 
-seen = set()
+class IncludeDirKind(Enum):
+    # /generated or /generated<path>, looked up in the generated files first
+    generated = 1
+    absolute = 2
+    # relative to the directory of the file that has the #include
+    relative = 3
+
+
+@dataclass(frozen=True)
+class IncludeDir:
+    dir: str
+    kind: IncludeDirKind
+    # What has to be put in front of the header name, for relative directories the
+    # directory of the current file goes in front of it
+    prefix: str
+
+
+def _compileIncludeDir(d: str) -> IncludeDir:
+    if d == "/generated":
+        return IncludeDir(d, IncludeDirKind.generated, "")
+    if d.startswith("/generated"):
+        return IncludeDir(
+            d, IncludeDirKind.generated, f"{d.replace('/generated', '')}/"
+        )
+    if d.startswith("/"):
+        return IncludeDir(d, IncludeDirKind.absolute, f"{d}/")
+    return IncludeDir(d, IncludeDirKind.relative, f"/{d}/")
+
+
+@dataclass(frozen=True, eq=False)
+class IncludeResolver:
+    """The ordered include directories of a compilation, compiled once.
+
+    Resolvers are interned so that two builds with the same flags share the same
+    object, it's hashed by identity and is cheap to use as a cache key.
+    """
+
+    dirs: Tuple[str, ...]
+    entries: Tuple[IncludeDir, ...]
+
+    def __len__(self) -> int:
+        return len(self.dirs)
+
+    def __repr__(self) -> str:
+        return repr(list(self.dirs))
+
+
+_resolversByDirs: Dict[Tuple[str, ...], IncludeResolver] = {}
+_resolversByFlags: Dict[Tuple[str, str, Optional[str]], IncludeResolver] = {}
+
+
+def includeResolverForDirs(dirs: Iterable[str]) -> IncludeResolver:
+    key = tuple(dirs)
+    resolver = _resolversByDirs.get(key)
+    if resolver is None:
+        resolver = IncludeResolver(key, tuple(_compileIncludeDir(d) for d in key))
+        _resolversByDirs[key] = resolver
+    return resolver
+
+
+def _rewriteWorkDir(
+    includes_dirs: List[str], workDir: str, tempTopFolder: Optional[str]
+) -> List[str]:
+    updated_include_dirs = []
+    for dir in includes_dirs:
+        if tempTopFolder is not None:
+            if dir.startswith(workDir):
+                # Replace workDir by the tempTopFolder so that we have a chance of
+                # finding our generated headers
+                updated_include_dirs.append(dir.replace(workDir, tempTopFolder))
+                # We want to clobber the "/" at the end so that the constructed path
+                # looks nothing like a real path and more something like
+                # /generatedinclude
+                updated_include_dirs.append(dir.replace(workDir + "/", "/generated"))
+            else:
+                updated_include_dirs.append(dir)
+        elif dir.startswith(workDir):
+            updated_include_dirs.append(dir.replace(workDir, "/generated"))
+        elif workDir.endswith("/") and dir.startswith(workDir[:-1]):
+            updated_include_dirs.append(dir.replace(workDir[:-1], "/generated"))
+        else:
+            updated_include_dirs.append(dir)
+    return updated_include_dirs
+
+
+def includeResolverForFlags(
+    includes: str, workDir: str, tempTopFolder: Optional[str] = None
+) -> IncludeResolver:
+    """Get the resolver for an INCLUDES string, the directories in workDir are
+    rewritten to /generated (and to tempTopFolder when it's specified)."""
+    key = (includes, workDir, tempTopFolder)
+    resolver = _resolversByFlags.get(key)
+    if resolver is None:
+        resolver = includeResolverForDirs(
+            _rewriteWorkDir(parseIncludes(includes), workDir, tempTopFolder)
+        )
+        _resolversByFlags[key] = resolver
+    return resolver
+
+
+def _asResolver(includes_dirs: Union[IncludeResolver, List[str]]) -> IncludeResolver:
+    if isinstance(includes_dirs, IncludeResolver):
+        return includes_dirs
+    return includeResolverForDirs(includes_dirs)
 
 
 @dataclass
 class CPPIncludes:
-    foundHeaders: Set[Tuple[str, Optional[str]]]
-    notFoundHeaders: Set[str]
-    neededImports: Set[BuildTarget]
-    neededGeneratedFiles: Set[Tuple[str, Optional[str]]]
+    # The results returned by findCPPIncludes are shared, they hold frozensets
+    foundHeaders: AbstractSet[Tuple[str, Optional[str]]]
+    notFoundHeaders: AbstractSet[str]
+    neededImports: AbstractSet[BuildTarget]
+    neededGeneratedFiles: AbstractSet[Tuple[str, Optional[str]]]
 
     def __add__(self, other: "CPPIncludes") -> "CPPIncludes":
         return CPPIncludes(
@@ -50,13 +168,95 @@ class CPPIncludes:
             self.neededGeneratedFiles.union(other.neededGeneratedFiles),
         )
 
+    def update(self, other: "CPPIncludes") -> None:
+        # Only for the CPPIncludes that are being built, they have mutable sets
+        assert isinstance(self.foundHeaders, set)
+        assert isinstance(self.notFoundHeaders, set)
+        assert isinstance(self.neededImports, set)
+        assert isinstance(self.neededGeneratedFiles, set)
+        self.foundHeaders.update(other.foundHeaders)
+        self.notFoundHeaders.update(other.notFoundHeaders)
+        self.neededImports.update(other.neededImports)
+        self.neededGeneratedFiles.update(other.neededGeneratedFiles)
+
+    def size(self) -> int:
+        return (
+            len(self.foundHeaders)
+            + len(self.notFoundHeaders)
+            + len(self.neededImports)
+            + len(self.neededGeneratedFiles)
+        )
+
+    def frozen(self) -> "CPPIncludes":
+        return CPPIncludes(
+            frozenset(self.foundHeaders),
+            frozenset(self.notFoundHeaders),
+            frozenset(self.neededImports),
+            frozenset(self.neededGeneratedFiles),
+        )
+
+
+@dataclass(frozen=True)
+class HeaderEdge:
+    """An #include resolved to a file that has to be scanned as well."""
+
+    name: str
+    generated: bool
+    generatedDir: Optional[str]
+    # Set when the file was found through a /generated include directory, the headers
+    # it includes from the same temporary directory are generated ones
+    tempDir: Optional[str] = None
+
+
+@dataclass
+class HeaderNode:
+    """The includes of a single file, the included files are not followed."""
+
+    direct: CPPIncludes
+    edges: List[HeaderEdge]
+
+
+@dataclass(frozen=True, eq=False)
+class _ScanContext:
+    # What is common to all the files scanned by a findCPPIncludes call
+    resolver: IncludeResolver
+    compilerIncludes: List[str]
+    cc_imports: List[BuildTarget]
+    generatedFiles: Dict[str, Any]
+    workDir: str
+    srcDir: str
+    remapPaths: Optional[List[str]]
+    macros: Optional[MacroTable]
+
+
+def _edgeClosure(edge: HeaderEdge, closure: CPPIncludes) -> CPPIncludes:
+    if edge.tempDir is None:
+        return closure
+    tempDir = edge.tempDir
+    foundHeaders = set()
+    neededGeneratedFiles = set(closure.neededGeneratedFiles)
+    for e in closure.foundHeaders:
+        # The list of header might include headers with the same temporary folder used by the current file
+        # the reason for that is that current file a.h might have #include "b.h" and b.h is generated
+        # so we end-up with returning /tmp/tmpxxbbcc/subfolder1/subfolder2/b.h
+        if e[0].startswith(tempDir):
+            neededGeneratedFiles.add((e[0].replace(tempDir, "/generated"), e[1]))
+        else:
+            foundHeaders.add((e[0], e[1]))
+    return CPPIncludes(
+        foundHeaders,
+        closure.notFoundHeaders,
+        closure.neededImports,
+        neededGeneratedFiles,
+    )
+
 
-cache: Dict[str, CPPIncludes] = {}
+cache: Dict[Tuple[str, Optional[MacroTable]], CPPIncludes] = {}
 
 
 def _findCPPIncludeForFile(
     file: str,
-    includes_dirs: List[str],
+    includes_dirs: Union[IncludeResolver, List[str]],
     current_dir: str,
     cc_imports: List[BuildTarget],
     compilerIncludes: List[str],
@@ -65,30 +265,28 @@ def _findCPPIncludeForFile(
     workDir: str,
     srcDir: str,
     remapPaths: Optional[List[str]] = None,
+    macros: Optional[MacroTable] = None,
+    edges: Optional[List[HeaderEdge]] = None,
 ) -> Tuple[bool, CPPIncludes]:
     found = False
     ret = CPPIncludes(set(), set(), set(), set())
     check = False
 
-    logging.info(f"_findCPPIncludeForFile: {file}")
+    logging.debug("_findCPPIncludeForFile: %s", file)
+    resolver = _asResolver(includes_dirs)
 
     if remapPaths is not None and file in remapPaths:
         # We take care of the include directory somewhere else
         ret.foundHeaders.add((file, None))
         return True, ret
 
-    for d in includes_dirs:
-        use_generated_dir = False
-        if d == "/generated":
-            full_file_name = file
-            use_generated_dir = True
-        elif d.startswith("/generated"):
-            full_file_name = f"{d.replace('/generated', '')}/{file}"
-            use_generated_dir = True
-        elif d.startswith("/"):
-            full_file_name = f"{d}/{file}"
+    for entry in resolver.entries:
+        d = entry.dir
+        use_generated_dir = entry.kind == IncludeDirKind.generated
+        if entry.kind == IncludeDirKind.relative:
+            full_file_name = f"{current_dir}{entry.prefix}{file}"
         else:
-            full_file_name = f"{current_dir}/{d}/{file}"
+            full_file_name = f"{entry.prefix}{file}"
 
         if use_generated_dir and full_file_name in generatedFiles:
             # The search header is a generated one that whose path match the includes
@@ -100,7 +298,7 @@ def _findCPPIncludeForFile(
                 generatedFileFullName = full_file_name
                 tempDir = generatedFiles[full_file_name][1]
                 full_file_name = f"{tempDir}/{full_file_name}"
-            logging.debug(f"Found generated {file} in the includes variable")
+            logging.debug("Found generated %s in the includes variable", file)
             break
 
         # Search in the compiler include, depending on how things were done in the Ninja file
@@ -116,7 +314,7 @@ def _findCPPIncludeForFile(
                 assert isinstance(imp.opaque, BazelCCImport)
                 if full_file_name2 in imp.opaque.hdrs:
                     foundCCImport = True
-                    logging.debug(f"Found {full_file_name} in {imp}")
+                    logging.debug("Found %s in %s", full_file_name, imp)
                     ret.neededImports.add(imp)
                     break
             found = True
@@ -125,7 +323,7 @@ def _findCPPIncludeForFile(
         if found and os.path.exists(full_file_name2):
             if not foundCCImport:
                 logging.debug(
-                    f"Found {file} in the compiler include path: {cdir} skipping"
+                    "Found %s in the compiler include path: %s skipping", file, cdir
                 )
             break
 
@@ -140,7 +338,7 @@ def _findCPPIncludeForFile(
             # we don't want to use the workDir as a prefix for the pre generated files
             tempDir = workDir
             full_file_name = f"{workDir}{full_file_name}"
-            logging.info(f"Found generated {file} in in the pregenerated with {d}")
+            logging.debug("Found generated %s in in the pregenerated with %s", file, d)
             # We let _finalizeHeadersForNonGeneratedFileForBuild figure out what to do
             break
 
@@ -149,13 +347,13 @@ def _findCPPIncludeForFile(
 
         # Beyond this point we know that the file exists in a particular include path
 
-        logging.debug(f"Found {file} in the includes variable using {d}")
+        logging.debug("Found %s in the includes variable using %s", file, d)
         # Check if the file is part of the cc_imports as we don't want to recurse for headers there
         # We have to do it twice because now we are not looking at a file in the standard include paths
         for imp in cc_imports:
             assert isinstance(imp.opaque, BazelCCImport)
             if full_file_name in imp.opaque.hdrs:
-                logging.info(f"Found {full_file_name} in cc_import {imp}")
+                logging.debug("Found %s in cc_import %s", full_file_name, imp)
                 ret.neededImports.add(imp)
                 found = True
                 break
@@ -172,13 +370,21 @@ def _findCPPIncludeForFile(
                     (full_file_name.replace(f"{generatedDir}/", ""), "/generated")
                 )
             elif full_file_name.startswith(srcDir):
-                logging.info(
-                    f"Found {file} {full_file_name} in the includes variable using {d} in source directory {srcDir}"
+                logging.debug(
+                    "Found %s %s in the includes variable using %s in source directory %s",
+                    file,
+                    full_file_name,
+                    d,
+                    srcDir,
                 )
                 ret.foundHeaders.add((full_file_name, d))
             else:
-                logging.info(
-                    f"Found {file} {full_file_name} in the includes variable using {d} but didn't start with {srcDir}"
+                logging.debug(
+                    "Found %s %s in the includes variable using %s but didn't start with %s",
+                    file,
+                    full_file_name,
+                    d,
+                    srcDir,
                 )
                 continue
         else:
@@ -189,32 +395,30 @@ def _findCPPIncludeForFile(
         break
 
     if check:
-        cppIncludes = findCPPIncludes(
+        edge = HeaderEdge(
             full_file_name,
-            includes_dirs,
-            compilerIncludes,
-            cc_imports,
-            generatedFiles,
             use_generated_dir,
             generatedDir,
-            workDir,
-            srcDir=srcDir,
-            remapPaths=remapPaths,
+            tempDir if use_generated_dir else None,
         )
-        if use_generated_dir:
-            newfoundHeaders = set()
-            for e in cppIncludes.foundHeaders:
-                # The list of header might include headers with the same temporary folder used by the current file
-                # the reason for that is that current file a.h might have #include "b.h" and b.h is generated
-                # so we end-up with returning /tmp/tmpxxbbcc/subfolder1/subfolder2/b.h
-                if e[0].startswith(tempDir):
-                    cppIncludes.neededGeneratedFiles.add(
-                        (e[0].replace(tempDir, "/generated"), e[1])
-                    )
-                else:
-                    newfoundHeaders.add((e[0], e[1]))
-            cppIncludes.foundHeaders = newfoundHeaders
-        ret += cppIncludes
+        if edges is not None:
+            # The caller is building the header graph, it will follow the edge itself
+            edges.append(edge)
+        else:
+            cppIncludes = findCPPIncludes(
+                full_file_name,
+                resolver,
+                compilerIncludes,
+                cc_imports,
+                generatedFiles,
+                use_generated_dir,
+                generatedDir,
+                workDir,
+                srcDir=srcDir,
+                remapPaths=remapPaths,
+                macros=macros,
+            )
+            ret += _edgeClosure(edge, cppIncludes)
 
     return found, ret
 
@@ -222,7 +426,7 @@ def _findCPPIncludeForFile(
 def _findCPPIncludeForFileSameDir(
     name: str,
     file: str,
-    includes_dirs: List[str],
+    includes_dirs: Union[IncludeResolver, List[str]],
     current_dir: str,
     cc_imports: List[BuildTarget],
     compilerIncludes: List[str],
@@ -232,6 +436,8 @@ def _findCPPIncludeForFileSameDir(
     workDir: str = "",
     srcDir: str = "",
     remapPaths: Optional[List[str]] = None,
+    macros: Optional[MacroTable] = None,
+    edges: Optional[List[HeaderEdge]] = None,
 ) -> Tuple[bool, CPPIncludes]:
     ret = CPPIncludes(set(), set(), set(), set())
     found = False
@@ -241,7 +447,9 @@ def _findCPPIncludeForFileSameDir(
 
     found = True
     logging.debug(
-        f"Found {file} in the same directory as the looked file, generated ?: {generated}"
+        "Found %s in the same directory as the looked file, generated ?: %s",
+        file,
+        generated,
     )
     # We need a way of dealing with path with ..
     full_file_name = resolvePath(full_file_name)
@@ -256,7 +464,7 @@ def _findCPPIncludeForFileSameDir(
         # So we will need to iterate on the dict look for the values
         foundGenerated = False
         for k, v in generatedFiles.items():
-            # logging.info(f"Checking {k} against {name}")
+            # logging.debug(f"Checking {k} against {name}")
             if name.endswith(k):
                 foundGenerated = True
                 genericGeneratedHeader = (
@@ -288,6 +496,9 @@ def _findCPPIncludeForFileSameDir(
 
         ret.foundHeaders.add((full_file_name, None))
 
+    if edges is not None:
+        edges.append(HeaderEdge(full_file_name, generated, generatedDir))
+        return found, ret
     cppIncludes = findCPPIncludes(
         full_file_name,
         includes_dirs,
@@ -299,50 +510,35 @@ def _findCPPIncludeForFileSameDir(
         workDir,
         srcDir,
         remapPaths,
+        macros,
     )
     ret += cppIncludes
     return found, ret
 
 
-def findCPPIncludes(
-    name: str,
-    includes_dirs: List[str],
-    compilerIncludes: List[str],
-    cc_imports: List[BuildTarget],
-    generatedFiles: Dict[str, Any],
-    generated: bool = False,
-    generatedDir: Optional[str] = None,
-    workDir: str = "",
-    srcDir: str = "",
-    remapPaths: Optional[List[str]] = None,
-) -> CPPIncludes:
-    key = f"{name}"
-    seenkey = f"{name} {includes_dirs}"
-    ret = CPPIncludes(set(), set(), set(), set())
-    # There is sometimes loop, as we don't really implement the #pragma once
-    # deal with it
-    if key in cache:
-        return cache[key]
-    if seenkey in seen:
-        return ret
-    seen.add(seenkey)
+def _buildHeaderNode(
+    name: str, generated: bool, generatedDir: Optional[str], ctx: _ScanContext
+) -> HeaderNode:
+    resolver = ctx.resolver
+    compilerIncludes = ctx.compilerIncludes
+    cc_imports = ctx.cc_imports
+    generatedFiles = ctx.generatedFiles
+    workDir = ctx.workDir
+    srcDir = ctx.srcDir
+    remapPaths = ctx.remapPaths
+    macros = ctx.macros
+    node = HeaderNode(CPPIncludes(set(), set(), set(), set()), [])
+    ret = node.direct
+    edges = node.edges
     current_dir = os.path.dirname(os.path.abspath(name))
-    logging.debug(f"Handling findCPPIncludes {name}")
-    with open(name, "r") as f:
-        content = f.readlines()
-    for line in content:
+    logging.debug("Handling findCPPIncludes %s", name)
+    for file, is_angled in scanIncludes(name, macros):
         found = False
-        match = re.match(r'\s*#\s*include ((?:<|").*(?:>|"))', line)
-        if not match:
-            continue
-        current_include = match.group(1)
-        file = current_include[1:-1]
-
-        if current_include.startswith('"'):
+        if not is_angled:
             found, cppIncludes = _findCPPIncludeForFileSameDir(
                 name,
                 file,
-                includes_dirs,
+                resolver,
                 current_dir,
                 cc_imports,
                 compilerIncludes,
@@ -352,14 +548,16 @@ def findCPPIncludes(
                 workDir,
                 srcDir,
                 remapPaths,
+                macros,
+                edges,
             )
             if not found:
-                if len(includes_dirs) == 0:
-                    logging.info(f"No include dirs for {name} with {file}")
+                if len(resolver) == 0:
+                    logging.debug("No include dirs for %s with %s", name, file)
                     continue
                 found, cppIncludes = _findCPPIncludeForFile(
                     file,
-                    includes_dirs,
+                    resolver,
                     current_dir,
                     cc_imports,
                     compilerIncludes,
@@ -368,15 +566,17 @@ def findCPPIncludes(
                     workDir,
                     srcDir,
                     remapPaths,
+                    macros,
+                    edges,
                 )
-            ret += cppIncludes
+            ret.update(cppIncludes)
         else:
-            if len(includes_dirs) == 0:
-                logging.info(f"No include dirs for {name} with {file}")
+            if len(resolver) == 0:
+                logging.debug("No include dirs for %s with %s", name, file)
                 continue
             found, cppIncludes = _findCPPIncludeForFile(
                 file,
-                includes_dirs,
+                resolver,
                 current_dir,
                 cc_imports,
                 compilerIncludes,
@@ -385,12 +585,14 @@ def findCPPIncludes(
                 workDir,
                 srcDir,
                 remapPaths,
+                macros,
+                edges,
             )
-            ret += cppIncludes
+            ret.update(cppIncludes)
 
         if not found:
             logging.warning(
-                f"Could not find {file} as used by {name}, include dirs {includes_dirs}"
+                f"Could not find {file} as used by {name}, include dirs {resolver}"
             )
 
         # We don't include compiler includes in the list of includes
@@ -399,15 +601,15 @@ def findCPPIncludes(
                 full_file_name = f"{d}/{file}"
                 if not os.path.exists(full_file_name) or os.path.isdir(full_file_name):
                     continue
-                logging.debug(f"Found {file} in the compiler includes")
+                logging.debug("Found %s in the compiler includes", file)
                 found = True
                 break
 
             if file in generatedFiles:
-                logging.info(f"Found missing header {file} in the generated files")
+                logging.debug("Found missing header %s in the generated files", file)
                 (found, cppIncludes) = _findCPPIncludeForFile(
                     file,
-                    includes_dirs,
+                    resolver,
                     current_dir,
                     cc_imports,
                     compilerIncludes,
@@ -415,19 +617,247 @@ def findCPPIncludes(
                     generatedDir,
                     workDir,
                     srcDir,
+                    macros=macros,
+                    edges=edges,
                 )
-                ret += cppIncludes
+                ret.update(cppIncludes)
                 found = True
 
         if not found:
-            logging.info(
-                f"Not found {file} in the compiler includes for {name} wih includes {includes_dirs}"
+            logging.debug(
+                "Not found %s in the compiler includes for %s wih includes %s",
+                file,
+                name,
+                resolver,
             )
             ret.notFoundHeaders.add(file)
-    if len(ret.notFoundHeaders) > 0:
-        ret.notFoundHeaders = set(
-            filter(lambda x: not x.endswith(".pb.h"), ret.notFoundHeaders)
-        )
-        logging.debug(f"Could not find {set(ret.notFoundHeaders)} in {name}")
-    cache[key] = ret
-    return ret
+    return node
+
+
+def _closeComponent(
+    component: List[str], nodes: Dict[str, HeaderNode], macros: Optional[MacroTable]
+) -> None:
+    # The closures of the components that component depends on are already cached,
+    # headers including each other (no #pragma once support) share the same closure
+    members = set(component)
+    closures = {name: CPPIncludes(set(), set(), set(), set()) for name in component}
+    for name in component:
+        closures[name].update(nodes[name].direct)
+    cyclic = len(component) > 1 or any(
+        e.name in members for e in nodes[component[0]].edges
+    )
+    changed = True
+    while changed:
+        changed = False
+        for name in component:
+            closure = closures[name]
+            before = closure.size()
+            for edge in nodes[name].edges:
+                if edge.name in members:
+                    child = closures[edge.name]
+                else:
+                    child = cache[(edge.name, macros)]
+                closure.update(_edgeClosure(edge, child))
+            changed = changed or (cyclic and closure.size() != before)
+
+    for name in component:
+        closure = closures[name]
+        if len(closure.notFoundHeaders) > 0:
+            closure.notFoundHeaders = set(
+                filter(lambda x: not x.endswith(".pb.h"), closure.notFoundHeaders)
+            )
+            logging.debug("Could not find %s in %s", closure.notFoundHeaders, name)
+        cache[(name, macros)] = closure.frozen()
+
+
+def _computeClosures(root: HeaderEdge, ctx: _ScanContext) -> None:
+    # Tarjan's algorithm over the header graph, the graph is built while it's
+    # walked and the components are closed in reverse topological order
+    nodes: Dict[str, HeaderNode] = {}
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    stack: List[str] = []
+    onStack: Set[str] = set()
+
+    def enter(edge: HeaderEdge) -> Tuple[str, Iterator[HeaderEdge]]:
+        node = _buildHeaderNode(edge.name, edge.generated, edge.generatedDir, ctx)
+        nodes[edge.name] = node
+        index[edge.name] = low[edge.name] = len(index)
+        stack.append(edge.name)
+        onStack.add(edge.name)
+        return edge.name, iter(node.edges)
+
+    work = [enter(root)]
+    while work:
+        name, children = work[-1]
+        for edge in children:
+            if (edge.name, ctx.macros) in cache:
+                continue
+            if edge.name not in index:
+                work.append(enter(edge))
+                break
+            if edge.name in onStack:
+                low[name] = min(low[name], index[edge.name])
+        else:
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[name])
+            if low[name] == index[name]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onStack.discard(member)
+                    component.append(member)
+                    if member == name:
+                        break
+                _closeComponent(component, nodes, ctx.macros)
+
+
+def findCPPIncludes(
+    name: str,
+    includes_dirs: Union[IncludeResolver, List[str]],
+    compilerIncludes: List[str],
+    cc_imports: List[BuildTarget],
+    generatedFiles: Dict[str, Any],
+    generated: bool = False,
+    generatedDir: Optional[str] = None,
+    workDir: str = "",
+    srcDir: str = "",
+    remapPaths: Optional[List[str]] = None,
+    macros: Optional[MacroTable] = None,
+) -> CPPIncludes:
+    # The included files depend on the macros when conditionals are evaluated
+    key = (name, macros)
+    if key in cache:
+        return cache[key]
+    ctx = _ScanContext(
+        _asResolver(includes_dirs),
+        compilerIncludes,
+        cc_imports,
+        generatedFiles,
+        workDir,
+        srcDir,
+        remapPaths,
+        macros,
+    )
+    _computeClosures(HeaderEdge(name, generated, generatedDir), ctx)
+    return cache[key]
+
+
+def _includeDirFromSpellings(
+    path: str, files: List[str], recorded: AbstractSet[str], resolver: IncludeResolver
+) -> Tuple[bool, Optional[str]]:
+    """How one of files (in the order the compiler opened them) included path.
+
+    The #include are resolved like the compiler did, a file exists if it was recorded.
+    Returns (True, the include directory or None if relative to the includer) or
+    (False, None) if no #include resolves to path (ie. computed includes).
+    """
+    for f in files:
+        if f == path:
+            continue
+        currentDir = os.path.dirname(f)
+        try:
+            includes = scanIncludes(f)
+        except OSError:
+            continue
+        for spelling, angled in includes:
+            if not angled:
+                sameDir = resolvePath(f"{currentDir}/{spelling}")
+                if sameDir == path:
+                    return True, None
+                if sameDir in recorded:
+                    continue
+            for entry in resolver.entries:
+                if entry.kind == IncludeDirKind.relative:
+                    candidate = resolvePath(f"{currentDir}{entry.prefix}{spelling}")
+                elif entry.kind == IncludeDirKind.absolute:
+                    candidate = resolvePath(f"{entry.prefix}{spelling}")
+                else:
+                    continue
+                if candidate in recorded:
+                    if candidate == path:
+                        return True, entry.dir
+                    break
+    return False, None
+
+
+def includesFromRecordedDeps(
+    name: str,
+    deps: List[str],
+    includes_dirs: Union[IncludeResolver, List[str]],
+    compilerIncludes: List[str],
+    cc_imports: List[BuildTarget],
+    workDir: str,
+    srcDir: str,
+) -> Optional[CPPIncludes]:
+    """The same result as findCPPIncludes but from the headers that the compiler recorded
+    when it built name (ie. `ninja -t deps`).
+
+    A header is attributed to the include directory containing it, a header in the
+    directory of name to no include directory. When several include directories contain
+    it, the #include of the recorded files are read to find the one that was used; None
+    is returned if none of them resolves to it, name has to be scanned.
+    """
+    ret = CPPIncludes(set(), set(), set(), set())
+    resolver = _asResolver(includes_dirs)
+    if not workDir.endswith(os.path.sep):
+        workDir = f"{workDir}{os.path.sep}"
+    sourceDir = os.path.dirname(name)
+    paths = [
+        resolvePath(dep if dep.startswith(os.path.sep) else f"{workDir}{dep}")
+        for dep in deps
+    ]
+    recorded = set(paths)
+    inTree = [name] + [p for p in paths if p != name and p.startswith(srcDir)]
+    for path in paths:
+        if path == name:
+            continue
+        foundCCImport = False
+        for imp in cc_imports:
+            assert isinstance(imp.opaque, BazelCCImport)
+            if path in imp.opaque.hdrs:
+                ret.neededImports.add(imp)
+                foundCCImport = True
+                break
+        if foundCCImport:
+            continue
+        if any(d and path.startswith(f"{d}{os.path.sep}") for d in compilerIncludes):
+            continue
+        if path.startswith(workDir):
+            relative = path[len(workDir) :]
+            includeDir = "/generated"
+            for entry in resolver.entries:
+                if entry.kind == IncludeDirKind.generated and relative.startswith(
+                    entry.prefix
+                ):
+                    includeDir = entry.dir
+                    break
+            ret.neededGeneratedFiles.add((relative, includeDir))
+        elif path.startswith(srcDir):
+            foundDir = None
+            if os.path.dirname(path) != sourceDir:
+                candidates = [
+                    entry.dir
+                    for entry in resolver.entries
+                    if entry.kind == IncludeDirKind.absolute
+                    and path.startswith(entry.prefix)
+                ]
+                if len(candidates) > 1:
+                    resolved, foundDir = _includeDirFromSpellings(
+                        path, inTree, recorded, resolver
+                    )
+                    if not resolved:
+                        logging.debug(
+                            "Can't tell how %s was included by %s, scanning it",
+                            path,
+                            name,
+                        )
+                        return None
+                elif candidates:
+                    foundDir = candidates[0]
+            ret.foundHeaders.add((path, foundDir))
+        else:
+            logging.debug("Skipping %s recorded for %s, not in the tree", path, name)
+    return ret.frozen()
@@ -0,0 +1,319 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import cppfileparser
+from bazel import BazelCCImport
+from includescanner import MacroTable, ScanCache, Stamp, statStamp, useScanCache
+from logutils import configureLogging
+from parser import (
+    BUILD_CUSTOMIZATION_DIRECTORY,
+    ConversionState,
+    build_arg_parser,
+    build_file_path,
+    convert,
+    write_build_files,
+)
+from protoparser import ProtoGraph
+
+
+class WarmState(ConversionState):
+    """The state kept by the daemon between two conversions.
+
+    Only what doesn't depend on the ninja graph is kept: the graph and the header closures
+    are mutated by a conversion and are rebuilt for each request.
+    """
+
+    def __init__(self):
+        self.scanCache = ScanCache()
+        self._compilerIncludes: Optional[List[str]] = None
+        self._predefinedMacros: Optional[Tuple[Optional[MacroTable]]] = None
+        self._ccImports: Dict[Tuple[str, str], List[BazelCCImport]] = {}
+        self._protoGraph: Optional[ProtoGraph] = None
+
+    def compiler_includes(self) -> List[str]:
+        if self._compilerIncludes is None:
+            self._compilerIncludes = super().compiler_includes()
+        return self._compilerIncludes
+
+    def predefined_macros(self) -> Optional[MacroTable]:
+        if self._predefinedMacros is None:
+            self._predefinedMacros = (super().predefined_macros(),)
+        return self._predefinedMacros[0]
+
+    def cc_imports(
+        self, raw_imports: List[str], location: str, cache_dir: Optional[str]
+    ) -> List[BazelCCImport]:
+        digest = hashlib.sha1("".join(raw_imports).encode()).hexdigest()
+        key = (digest, location)
+        if key not in self._ccImports:
+            self._ccImports[key] = super().cc_imports(raw_imports, location, cache_dir)
+        return self._ccImports[key]
+
+    def scannedStamps(self) -> Dict[str, Stamp]:
+        """The files scanned by the conversions (sources, headers and protos) with the
+        stamp they had when they were scanned."""
+        ret = self.scanCache.stamps()
+        if self._protoGraph is not None:
+            ret.update(self._protoGraph.stamps())
+        return ret
+
+    def proto_graph(self, cache_dir: Optional[str]) -> ProtoGraph:
+        graph = super().proto_graph(cache_dir)
+        if self._protoGraph is None or self._protoGraph.cacheFile != graph.cacheFile:
+            self._protoGraph = graph
+        # The imports of the unchanged protos are kept, not where they are found
+        self._protoGraph.reset()
+        return self._protoGraph
+
+
+@dataclass
+class _Result:
+    output: Dict[str, str]
+    rootdir: str
+    stamps: Dict[str, Stamp]
+
+
+def _inputFiles(args: argparse.Namespace) -> List[str]:
+    rootdir = args.rootdir
+    if BUILD_CUSTOMIZATION_DIRECTORY.startswith("/"):
+        customization = BUILD_CUSTOMIZATION_DIRECTORY
+    else:
+        customization = os.path.join(rootdir, BUILD_CUSTOMIZATION_DIRECTORY)
+    files = [args.filename, os.path.join(customization, "postprocessing.py")]
+    files.extend(args.imports or [])
+    if args.configure_files_list:
+        files.append(args.configure_files_list)
+    if args.recorded_deps in ("auto", "ninja"):
+        files.append(os.path.join(os.path.dirname(args.filename), ".ninja_deps"))
+    elif args.recorded_deps != "none":
+        files.append(args.recorded_deps)
+    return [os.path.abspath(f) for f in files]
+
+
+def _changed(result: _Result) -> List[str]:
+    return sorted(f for f, stamp in result.stamps.items() if statStamp(f) != stamp)
+
+
+class Daemon:
+    """Convert ninja files on request, reusing what didn't change since the last time.
+
+    A request whose inputs (ninja file, imports, postprocessing, configure files list,
+    scanned sources and headers and their directories) have the same mtime and size as
+    for the previous identical request gets the previous result. Otherwise the
+    conversion is run again but only the files that changed are rescanned.
+    """
+
+    def __init__(self):
+        self.state = WarmState()
+        self._results: Dict[Tuple[str, ...], _Result] = {}
+        # What was last written for a request, unchanged BUILD files are not rewritten
+        self._written: Dict[Tuple[str, ...], Dict[str, str]] = {}
+        # The files and directories a request depends on, known even if it failed
+        self._watched: Dict[Tuple[str, ...], Set[str]] = {}
+
+    def _stamps(self, args: argparse.Namespace) -> Dict[str, Stamp]:
+        files = set(_inputFiles(args))
+        for path in self.state.scannedStamps():
+            files.add(path)
+            # Catches the headers added next to the ones already scanned
+            files.add(os.path.dirname(path))
+        return {f: statStamp(f) for f in files}
+
+    def convert(self, argv: List[str], cwd: str, write: bool = False) -> Dict[str, Any]:
+        start = time.time()
+        previous = os.getcwd()
+        os.chdir(cwd)
+        try:
+            return self._convert(argv, cwd, write, start)
+        finally:
+            os.chdir(previous)
+
+    def _convert(
+        self, argv: List[str], cwd: str, write: bool, start: float
+    ) -> Dict[str, Any]:
+        args = build_arg_parser().parse_args(argv)
+        key = (cwd, *argv)
+        result = self._results.get(key)
+        cached = result is not None and not _changed(result)
+        if not cached:
+            # Stamped before the conversion so that a file modified while converting is
+            # seen as modified by the next request
+            stamps = self._stamps(args)
+            self._watched[key] = set(stamps)
+            output, rootdir = self.convertWarm(args)
+            # The files scanned for the first time are only known now, their stamp is
+            # the one they had when they were scanned
+            for path, stamp in self.state.scannedStamps().items():
+                stamps.setdefault(path, stamp)
+                directory = os.path.dirname(path)
+                if directory not in stamps:
+                    stamps[directory] = statStamp(directory)
+            result = _Result(output, rootdir, stamps)
+            self._results[key] = result
+            self._watched[key] = set(stamps)
+        assert result is not None
+        written: List[str] = []
+        if write:
+            last = self._written.setdefault(key, {})
+            changed = {
+                name: content
+                for name, content in result.output.items()
+                if last.get(name) != content
+                or not os.path.exists(build_file_path(result.rootdir, name))
+            }
+            written = write_build_files(changed, result.rootdir, args.post_treatment)
+            last.update(changed)
+        return {
+            "ok": True,
+            "cached": cached,
+            "seconds": time.time() - start,
+            "files": result.output,
+            "written": written,
+        }
+
+    def convertWarm(self, args: argparse.Namespace) -> Tuple[Dict[str, str], str]:
+        """Convert args with the warm state, nothing is reused from a previous result."""
+        # The header closures depend on the graph, they can't be reused
+        cppfileparser.cache.clear()
+        useScanCache(self.state.scanCache)
+        try:
+            return convert(args, self.state)
+        finally:
+            useScanCache(None)
+
+    def changedPaths(self, argv: List[str], cwd: str) -> List[str]:
+        """The files modified since the last conversion of argv (all of them if none)."""
+        result = self._results.get((cwd, *argv))
+        if result is None:
+            return self.watchedPaths(argv, cwd)
+        return _changed(result)
+
+    def watchedPaths(self, argv: List[str], cwd: str) -> List[str]:
+        """The files and directories whose modification can change the result of argv."""
+        return sorted(self._watched.get((cwd, *argv), ()))
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self.convert(
+                request["argv"], request["cwd"], request.get("write", False)
+            )
+        except SystemExit as e:
+            return {"ok": False, "error": f"Conversion exited with {e.code}"}
+        except Exception as e:
+            logging.exception("Conversion failed")
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        reply: Dict[str, Any]
+        try:
+            request = json.loads(line)
+            command = request.get("command")
+        except (ValueError, AttributeError) as e:
+            # The client waits for a reply
+            reply = {"ok": False, "error": f"Invalid request: {e}"}
+        else:
+            if command == "stop":
+                reply = {"ok": True}
+                # shutdown() waits for serve_forever(), which is running this handler
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                reply = self.server.daemon.handle(request)  # type: ignore[attr-defined]
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+def _removeStaleSocket(socketPath: str):
+    """Remove the socket left by a daemon that is gone.
+
+    Raise FileExistsError if socketPath is not a socket or a daemon still listens on it.
+    """
+    try:
+        mode = os.lstat(socketPath).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{socketPath} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socketPath)
+        except OSError:
+            logging.info("Removing the stale socket %s", socketPath)
+            os.unlink(socketPath)
+            return
+    raise FileExistsError(f"A daemon is already listening on {socketPath}")
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    # Conversions use process wide caches, requests are served one at a time
+    def __init__(self, socketPath: str, daemon: Optional[Daemon] = None):
+        _removeStaleSocket(socketPath)
+        self.daemon = daemon or Daemon()
+        super().__init__(socketPath, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):  # type: ignore[arg-type]
+            os.unlink(self.server_address)  # type: ignore[arg-type]
+
+
+def sendRequest(socketPath: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketPath)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def requestConversion(socketPath: str, argv: List[str]) -> None:
+    """Have the daemon listening on socketPath convert (and write) the BUILD files."""
+    reply = sendRequest(socketPath, {"argv": argv, "cwd": os.getcwd(), "write": True})
+    if not reply["ok"]:
+        logging.error("The daemon failed to convert: %s", reply["error"])
+        sys.exit(-1)
+    print(
+        f"Wrote {len(reply['written'])} BUILD files in {reply['seconds']:.2f}s"
+        f"{' (cached)' if reply['cached'] else ''}",
+        file=sys.stdout,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Keep the conversion state warm and convert on request"
+    )
+    parser.add_argument(
+        "--socket",
+        required=True,
+        help="Path of the Unix socket to listen on, use it with `parser.py --server`",
+    )
+    parser.add_argument("-v", "--verbose", action="count", default=0)
+    parser.add_argument("-q", "--quiet", action="count", default=0)
+    args = parser.parse_args(argv)
+    configureLogging(args.verbose, args.quiet)
+
+    try:
+        server = DaemonServer(args.socket)
+    except FileExistsError as e:
+        logging.fatal(str(e))
+        sys.exit(-1)
+    with server:
+        logging.info("Listening on %s", args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -1,5 +1,6 @@
+import logging
 import os
-from typing import List
+from typing import List, Optional
 
 
 def resolvePath(path: str) -> str:
@@ -21,3 +22,36 @@ def resolvePath(path: str) -> str:
             cur += 1
 
     return os.path.sep.join(dest)
+
+
+def defaultCacheDir() -> Optional[str]:
+    """$XDG_CACHE_HOME/ninja2bazel, ~/.cache/ninja2bazel if it's not set, None when there
+    is no home directory."""
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        home = os.path.expanduser("~")
+        if home == "~":
+            return None
+        base = os.path.join(home, ".cache")
+    return os.path.join(base, "ninja2bazel")
+
+
+def writeCacheFile(path: str, content: str) -> bool:
+    """Atomically replace the cache file path with content.
+
+    The caches are only an optimization: a failure is logged and False is returned.
+    """
+    tmpFile = f"{path}.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmpFile, "w") as f:
+            f.write(content)
+        os.replace(tmpFile, path)
+    except OSError as e:
+        logging.debug("Can't write the cache file %s: %s", path, e)
+        try:
+            os.unlink(tmpFile)
+        except OSError:
+            pass
+        return False
+    return True
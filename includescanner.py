@@ -0,0 +1,541 @@
+import bisect
+import mmap
+import os
+import re
+from enum import Enum
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+# (spelling, is_angled) for each #include/#include_next/#import of a file
+Include = Tuple[str, bool]
+
+# Files bigger than this are mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+
+# Only the lines starting with # are looked at, the regex engine does the prefiltering
+_DIRECTIVE_RE = re.compile(rb"^[ \t]*#[ \t]*([a-z_]+)([^\n]*)", re.MULTILINE)
+
+_STRING_RE = re.compile(rb'"(?:\\.|[^"\\])*"')
+_STRIP_COMMENTS_RE = re.compile(rb"/\*.*?(?:\*/|$)|//.*")
+
+_INCLUDE_DIRECTIVES = (b"include", b"include_next", b"import")
+
+
+class _Branch(Enum):
+    # A branch is active but it's not known if it's the one taken
+    unknown = 1
+    # The branch is active and the following ones are not
+    taken = 2
+    # The branch is inactive, a following one might be taken
+    pending = 3
+    # The branch and all the following ones are inactive
+    done = 4
+
+
+def literalCondition(expression: bytes) -> Optional[bool]:
+    """Evaluate the condition of #if/#elif, only "0" and "1" are known."""
+    expression = expression.strip()
+    if expression == b"0":
+        return False
+    if expression == b"1":
+        return True
+    return None
+
+
+# Macros identifying a platform or a compiler, they are never defined by the code itself so
+# when they are not predefined by the compiler it's safe to consider them undefined.
+# Anything else that is not known might come from a header and is left unknown.
+PLATFORM_MACROS = frozenset(
+    [
+        "WIN32",
+        "_WIN32",
+        "_WIN64",
+        "__WIN32__",
+        "__WINDOWS__",
+        "_WINDOWS",
+        "__CYGWIN__",
+        "__MINGW32__",
+        "__MINGW64__",
+        "_MSC_VER",
+        "_MSC_FULL_VER",
+        "__APPLE__",
+        "__MACH__",
+        "__FreeBSD__",
+        "__NetBSD__",
+        "__OpenBSD__",
+        "__DragonFly__",
+        "__sun",
+        "__SVR4",
+        "_AIX",
+        "__hpux",
+        "__ANDROID__",
+        "__EMSCRIPTEN__",
+        "__HAIKU__",
+        "__QNX__",
+        "__BORLANDC__",
+        "__INTEL_COMPILER",
+        "__ibmxl__",
+        "__linux__",
+        "__linux",
+        "linux",
+        "__unix__",
+        "__unix",
+        "__GNUC__",
+        "__clang__",
+    ]
+)
+
+_DEFINE_RE = re.compile(r"^#define\s+([A-Za-z_]\w*)(?:\s+(.*))?$", re.MULTILINE)
+_FLAG_RE = re.compile(r"(?:^|\s)-([DU])\s*([A-Za-z_]\w*)(?:=(\S*))?")
+_TOKEN_RE = re.compile(
+    r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|([A-Za-z_]\w*)|(&&|\|\||==|!=|<=|>=|<<|>>|\S))"
+)
+_MAX_EXPANSION_DEPTH = 8
+
+# None is used for "unknown", it propagates through the operators unless the result
+# doesn't depend on it (0 && unknown)
+Value = Optional[int]
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class MacroTable:
+    """The macros known to be defined (and undefined) when a file is compiled."""
+
+    def __init__(self, values: Dict[str, str], undefined: FrozenSet[str] = frozenset()):
+        self.values = values
+        self.undefined = undefined
+        self._withFlags: Dict[Tuple[str, str], "MacroTable"] = {}
+
+    @classmethod
+    def fromPredefined(cls, text: str) -> "MacroTable":
+        """Build the table from the output of `cc -dM -E`."""
+        return cls(
+            {m.group(1): (m.group(2) or "").strip() for m in _DEFINE_RE.finditer(text)}
+        )
+
+    def withFlags(self, defines: str, flags: str) -> "MacroTable":
+        """Get the table with the -D/-U of DEFINES and FLAGS applied, tables are interned."""
+        key = (defines, flags)
+        table = self._withFlags.get(key)
+        if table is None:
+            values = dict(self.values)
+            undefined = set(self.undefined)
+            for match in _FLAG_RE.finditer(f"{defines} {flags}"):
+                kind, name, value = match.groups()
+                if kind == "D":
+                    values[name] = "1" if value is None else value
+                    undefined.discard(name)
+                else:
+                    values.pop(name, None)
+                    undefined.add(name)
+            table = MacroTable(values, frozenset(undefined))
+            self._withFlags[key] = table
+        return table
+
+    def isDefined(self, name: str, local: Set[str]) -> Optional[bool]:
+        if name in local:
+            # Defined or undefined by the file itself, we don't track where
+            return None
+        if name in self.values:
+            return True
+        if name in self.undefined or name in PLATFORM_MACROS:
+            return False
+        return None
+
+    def evaluate(self, expression: bytes, local: Set[str]) -> Optional[bool]:
+        try:
+            tokens = [
+                t
+                for t in _TOKEN_RE.findall(os.fsdecode(expression))
+                if t != ("", "", "")
+            ]
+            parser = _ExpressionParser(self, tokens, local, 0)
+            value = parser.parse()
+        except (_Unsupported, IndexError, ValueError, ZeroDivisionError):
+            return None
+        if value is None:
+            return None
+        return value != 0
+
+    def _macroValue(self, name: str, local: Set[str], depth: int) -> Value:
+        defined = self.isDefined(name, local)
+        if defined is False:
+            return 0
+        if defined is None:
+            if name == "true":
+                return 1
+            if name == "false":
+                return 0
+            return None
+        if depth >= _MAX_EXPANSION_DEPTH:
+            return None
+        tokens = [t for t in _TOKEN_RE.findall(self.values[name]) if t != ("", "", "")]
+        if not tokens:
+            raise _Unsupported(name)
+        return _ExpressionParser(self, tokens, local, depth + 1).parse()
+
+
+_BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "|": 3,
+    "^": 4,
+    "&": 5,
+    "==": 6,
+    "!=": 6,
+    "<": 7,
+    ">": 7,
+    "<=": 7,
+    ">=": 7,
+    "<<": 8,
+    ">>": 8,
+    "+": 9,
+    "-": 9,
+    "*": 10,
+    "/": 10,
+    "%": 10,
+}
+
+
+def _parseNumber(number: str) -> int:
+    if number[:2] in ("0x", "0X"):
+        return int(number, 16)
+    if len(number) > 1 and number.startswith("0"):
+        return int(number, 8)
+    return int(number)
+
+
+def _applyBinary(op: str, left: Value, right: Value) -> Value:
+    if op == "&&":
+        if left == 0 or right == 0:
+            return 0
+        return None if left is None or right is None else 1
+    if op == "||":
+        if (left is not None and left != 0) or (right is not None and right != 0):
+            return 1
+        return None if left is None or right is None else 0
+    if left is None or right is None:
+        return None
+    if op in ("/", "%") and right == 0:
+        raise ZeroDivisionError(op)
+    return {
+        "|": lambda: left | right,
+        "^": lambda: left ^ right,
+        "&": lambda: left & right,
+        "==": lambda: int(left == right),
+        "!=": lambda: int(left != right),
+        "<": lambda: int(left < right),
+        ">": lambda: int(left > right),
+        "<=": lambda: int(left <= right),
+        ">=": lambda: int(left >= right),
+        "<<": lambda: left << right,
+        ">>": lambda: left >> right,
+        "+": lambda: left + right,
+        "-": lambda: left - right,
+        "*": lambda: left * right,
+        "/": lambda: int(left / right),
+        "%": lambda: left % right,
+    }[op]()
+
+
+class _ExpressionParser:
+    # Precedence climbing over the tokens of a #if expression, the ternary operator
+    # and the function-like macros are not supported and make the result unknown
+    def __init__(
+        self,
+        macros: MacroTable,
+        tokens: List[Tuple[str, str, str]],
+        local: Set[str],
+        depth: int,
+    ):
+        self.macros = macros
+        self.tokens = tokens
+        self.local = local
+        self.depth = depth
+        self.pos = 0
+
+    def parse(self) -> Value:
+        value = self._binary(1)
+        if self.pos != len(self.tokens):
+            raise _Unsupported(self.tokens[self.pos])
+        return value
+
+    def _peekOperator(self) -> Optional[str]:
+        if self.pos >= len(self.tokens):
+            return None
+        return self.tokens[self.pos][2] or None
+
+    def _binary(self, minPrecedence: int) -> Value:
+        left = self._unary()
+        while True:
+            op = self._peekOperator()
+            precedence = _BINARY_PRECEDENCE.get(op or "")
+            if precedence is None or precedence < minPrecedence:
+                return left
+            self.pos += 1
+            right = self._binary(precedence + 1)
+            left = _applyBinary(op, left, right)
+
+    def _unary(self) -> Value:
+        number, name, op = self.tokens[self.pos]
+        self.pos += 1
+        if number:
+            return _parseNumber(number)
+        if name == "defined":
+            return self._defined()
+        if name:
+            if self._peekOperator() == "(":
+                raise _Unsupported(name)
+            return self.macros._macroValue(name, self.local, self.depth)
+        if op == "(":
+            value = self._binary(1)
+            if self._peekOperator() != ")":
+                raise _Unsupported(op)
+            self.pos += 1
+            return value
+        if op in ("!", "-", "+", "~"):
+            value = self._unary()
+            if value is None:
+                return None
+            if op == "!":
+                return int(value == 0)
+            if op == "-":
+                return -value
+            if op == "~":
+                return ~value
+            return value
+        raise _Unsupported(op)
+
+    def _defined(self) -> Value:
+        parenthesized = self._peekOperator() == "("
+        if parenthesized:
+            self.pos += 1
+        name = self.tokens[self.pos][1]
+        if not name:
+            raise _Unsupported(self.tokens[self.pos])
+        self.pos += 1
+        if parenthesized:
+            if self._peekOperator() != ")":
+                raise _Unsupported(name)
+            self.pos += 1
+        defined = self.macros.isDefined(name, self.local)
+        return None if defined is None else int(defined)
+
+
+def _condition(
+    rest: bytes, macros: Optional[MacroTable], local: Set[str]
+) -> Optional[bool]:
+    if b"/" in rest:
+        rest = _STRIP_COMMENTS_RE.sub(b"", rest)
+    if macros is None:
+        return literalCondition(rest)
+    return macros.evaluate(rest, local)
+
+
+def _definedCondition(
+    directive: bytes, rest: bytes, macros: Optional[MacroTable], local: Set[str]
+) -> Optional[bool]:
+    # #ifdef, #ifndef, #elifdef and #elifndef
+    if macros is None:
+        return None
+    name = rest.split(maxsplit=1)
+    if not name:
+        return None
+    defined = macros.isDefined(os.fsdecode(name[0]), local)
+    if defined is None or not directive.endswith(b"ndef"):
+        return defined
+    return not defined
+
+
+def _branchFor(value: Optional[bool]) -> _Branch:
+    if value is None:
+        return _Branch.unknown
+    return _Branch.taken if value else _Branch.pending
+
+
+def _parseSpelling(rest: bytes) -> Optional[Include]:
+    rest = rest.strip()
+    if rest.startswith(b'"'):
+        end = rest.find(b'"', 1)
+        angled = False
+    elif rest.startswith(b"<"):
+        end = rest.find(b">", 1)
+        angled = True
+    else:
+        # Computed includes (#include FOO_H) are not supported
+        return None
+    if end <= 1:
+        return None
+    return os.fsdecode(rest[1:end]), angled
+
+
+def _startsComment(content: Union[bytes, mmap.mmap], pos: int) -> bool:
+    # A "/*" in a string or after a // is not the start of a comment, only the beginning
+    # of the line is checked, it's much cheaper than tokenizing the whole file
+    prefix = content[content.rfind(b"\n", 0, pos) + 1 : pos]
+    if b'"' in prefix:
+        prefix = _STRING_RE.sub(b"", prefix)
+        if b'"' in prefix:
+            return False
+    return b"//" not in prefix
+
+
+def _blockComments(content: Union[bytes, mmap.mmap]) -> Tuple[List[int], List[int]]:
+    starts: List[int] = []
+    ends: List[int] = []
+    pos = content.find(b"/*")
+    while pos != -1:
+        if not _startsComment(content, pos):
+            pos = content.find(b"/*", pos + 2)
+            continue
+        end = content.find(b"*/", pos + 2)
+        end = len(content) if end == -1 else end + 2
+        starts.append(pos)
+        ends.append(end)
+        pos = content.find(b"/*", end)
+    return starts, ends
+
+
+def scanIncludesInBuffer(
+    content: Union[bytes, mmap.mmap], macros: Optional[MacroTable] = None
+) -> Tuple[Include, ...]:
+    """Return the includes of content, skipping comments and inactive #if regions.
+
+    Without macros only #if 0/#if 1 are evaluated, with them the conditions that only
+    depend on known macros are evaluated as well.
+    """
+    if content.find(b"#") == -1:
+        return ()
+    ret: List[Include] = []
+    starts, ends = _blockComments(content)
+    # One entry per #if level: (was the parent active, state of the current branch)
+    stack: List[Tuple[bool, _Branch]] = []
+    active = True
+    # Macros (un)defined by the file, their value depends on where we are in the file
+    local: Set[str] = set()
+    for match in _DIRECTIVE_RE.finditer(content):
+        if starts:
+            idx = bisect.bisect_right(starts, match.start(1)) - 1
+            if idx >= 0 and match.start(1) < ends[idx]:
+                continue
+        directive = match.group(1)
+        rest = match.group(2)
+        if directive in _INCLUDE_DIRECTIVES:
+            if active:
+                include = _parseSpelling(rest)
+                if include is not None:
+                    ret.append(include)
+            continue
+
+        if directive in (b"if", b"ifdef", b"ifndef"):
+            if not active:
+                stack.append((False, _Branch.done))
+            elif directive == b"if":
+                stack.append((True, _branchFor(_condition(rest, macros, local))))
+            else:
+                value = _definedCondition(directive, rest, macros, local)
+                stack.append((True, _branchFor(value)))
+        elif directive in (b"elif", b"elifdef", b"elifndef", b"else"):
+            if not stack:
+                continue
+            parentActive, branch = stack[-1]
+            if not parentActive or branch == _Branch.taken:
+                branch = _Branch.done
+            elif branch != _Branch.done:
+                if directive == b"else":
+                    if branch == _Branch.pending:
+                        branch = _Branch.taken
+                elif directive == b"elif":
+                    branch = _branchFor(_condition(rest, macros, local))
+                else:
+                    value = _definedCondition(directive, rest, macros, local)
+                    branch = _branchFor(value)
+            stack[-1] = (parentActive, branch)
+        elif directive == b"endif":
+            if stack:
+                stack.pop()
+        elif directive in (b"define", b"undef"):
+            if macros is not None:
+                name = rest.split(b"(", 1)[0].split(maxsplit=1)
+                if name:
+                    local.add(os.fsdecode(name[0]))
+            continue
+        else:
+            continue
+        active = not stack or (
+            stack[-1][0] and stack[-1][1] in (_Branch.unknown, _Branch.taken)
+        )
+    return tuple(ret)
+
+
+def _scanFile(path: str, macros: Optional[MacroTable]) -> Tuple[Include, ...]:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ()
+        if size < MMAP_THRESHOLD:
+            return scanIncludesInBuffer(f.read(), macros)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return scanIncludesInBuffer(content, macros)
+
+
+# (st_mtime_ns, st_size) of a file or a directory, None if it doesn't exist
+Stamp = Optional[Tuple[int, int]]
+
+
+def statStamp(path: str) -> Stamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class ScanCache:
+    """The includes of the scanned files, kept as long as the files don't change.
+
+    It's only useful to processes that convert the same tree several times (ie. the
+    daemon), a single conversion scans each file once.
+    """
+
+    def __init__(self):
+        self._entries: Dict[
+            Tuple[str, Optional[MacroTable]], Tuple[Stamp, Tuple[Include, ...]]
+        ] = {}
+
+    def scan(self, path: str, macros: Optional[MacroTable]) -> Tuple[Include, ...]:
+        stamp = statStamp(path)
+        entry = self._entries.get((path, macros))
+        if entry is not None and stamp is not None and entry[0] == stamp:
+            return entry[1]
+        includes = _scanFile(path, macros)
+        self._entries[(path, macros)] = (stamp, includes)
+        return includes
+
+    def files(self) -> Set[str]:
+        return {path for path, _ in self._entries}
+
+    def stamps(self) -> Dict[str, Stamp]:
+        """The stamp of the files when they were scanned."""
+        return {path: entry[0] for (path, _), entry in self._entries.items()}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_scanCache: Optional[ScanCache] = None
+
+
+def useScanCache(cache: Optional[ScanCache]) -> None:
+    """Make scanIncludes() go through cache, None disables it."""
+    global _scanCache
+    _scanCache = cache
+
+
+def scanIncludes(path: str, macros: Optional[MacroTable] = None) -> Tuple[Include, ...]:
+    """Return the (spelling, is_angled) includes of the file at path."""
+    if _scanCache is not None:
+        return _scanCache.scan(path, macros)
+    return _scanFile(path, macros)
@@ -0,0 +1,158 @@
+import glob
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Union
+
+_MAGIC = re.compile(r"[*?[]")
+
+
+def _translateComponent(component: str) -> str:
+    ret = []
+    # Like glob, wildcards don't match the hidden files
+    if component[:1] in ("*", "?", "["):
+        ret.append(r"(?!\.)")
+    i = 0
+    while i < len(component):
+        c = component[i]
+        i += 1
+        if c == "*":
+            ret.append("[^/]*")
+        elif c == "?":
+            ret.append("[^/]")
+        elif c == "[":
+            # A ] right after [ or [! is part of the class
+            start = i
+            if component[start : start + 1] == "!":
+                start += 1
+            if component[start : start + 1] == "]":
+                start += 1
+            end = component.find("]", start)
+            if end == -1:
+                ret.append(r"\[")
+                continue
+            content = component[i:end]
+            i = end + 1
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            ret.append(f"[{content.replace(chr(92), chr(92) * 2)}]")
+        else:
+            ret.append(re.escape(c))
+    return "".join(ret)
+
+
+def translateGlob(pattern: str) -> str:
+    """Translate a recursive glob pattern into a regex matching the same paths."""
+    components = pattern.split("/")
+    ret = []
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+        if component == "**":
+            # Zero or more directories, or everything below when it's the last component
+            if last:
+                ret.append(r"(?:(?!\.)[^/]*(?:/(?!\.)[^/]*)*)?")
+            else:
+                ret.append(r"(?:(?!\.)[^/]*/)*")
+        else:
+            ret.append(_translateComponent(component) + ("" if last else "/"))
+    return "".join(ret) + r"\Z"
+
+
+class LazyGlob:
+    """A glob() of an imports file, evaluated only when the paths are needed."""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        components = pattern.split("/")
+        static = []
+        for component in components[:-1]:
+            if _MAGIC.search(component):
+                break
+            static.append(component)
+        # The static part of the pattern, only the paths below it can match
+        self.prefix = "/".join(static)
+        self._regex: Optional[Pattern[str]] = None
+        self._paths: Optional[List[str]] = None
+
+    def matches(self, path: str) -> bool:
+        if self._regex is None:
+            self._regex = re.compile(translateGlob(self.pattern))
+        return self._regex.match(path) is not None
+
+    def paths(self) -> List[str]:
+        if self._paths is None:
+            self._paths = glob.glob(self.pattern, recursive=True)
+        return self._paths
+
+    def __repr__(self) -> str:
+        return f"LazyGlob({self.pattern!r})"
+
+
+class _PrefixTrieNode:
+    def __init__(self):
+        self.children: Dict[str, "_PrefixTrieNode"] = {}
+        self.globs: List[LazyGlob] = []
+
+
+class HeaderSet:
+    """The hdrs of a cc_import: plain paths and globs.
+
+    Membership is answered from the patterns, the file system is only enumerated when
+    the list of headers is iterated (ie. when the BUILD file is generated).
+    """
+
+    def __init__(self, entries: Iterable[Union[str, LazyGlob]] = ()):
+        self.entries: List[Union[str, LazyGlob]] = []
+        self._files: set[str] = set()
+        self._trie = _PrefixTrieNode()
+        self._list: Optional[List[str]] = None
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry: Union[str, LazyGlob]) -> None:
+        self.entries.append(entry)
+        self._list = None
+        if isinstance(entry, str):
+            self._files.add(entry)
+            return
+        node = self._trie
+        for component in entry.prefix.split("/") if entry.prefix else []:
+            node = node.children.setdefault(component, _PrefixTrieNode())
+        node.globs.append(entry)
+
+    def __contains__(self, path: object) -> bool:
+        if not isinstance(path, str):
+            return False
+        if path in self._files:
+            return True
+        node: Optional[_PrefixTrieNode] = self._trie
+        components = path.split("/")
+        for component in components:
+            assert node is not None
+            for g in node.globs:
+                if g.matches(path):
+                    return True
+            node = node.children.get(component)
+            if node is None:
+                return False
+        return False
+
+    def _paths(self) -> List[str]:
+        if self._list is None:
+            self._list = []
+            for entry in self.entries:
+                if isinstance(entry, str):
+                    self._list.append(entry)
+                else:
+                    self._list.extend(entry.paths())
+        return self._list
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths())
+
+    def __len__(self) -> int:
+        return len(self._paths())
+
+    def __getitem__(self, index: int) -> str:
+        return self._paths()[index]
+
+    def __repr__(self) -> str:
+        return f"HeaderSet({self.entries!r})"
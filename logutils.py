@@ -0,0 +1,43 @@
+import logging
+from typing import Any, Callable
+
+LOG_FORMAT = "%(name)s - %(levelname)s - %(message)s - Line: %(lineno)d"
+# Per-file/per-target messages are logged at DEBUG, INFO only has the per-run ones
+DEFAULT_LEVEL = logging.INFO
+
+
+def verbosityToLevel(verbose: int = 0, quiet: int = 0) -> int:
+    """
+    Every -v lowers the level by one step (INFO -> DEBUG), every -q raises it
+    (INFO -> WARNING -> ERROR -> CRITICAL).
+    """
+    level = DEFAULT_LEVEL + (quiet - verbose) * 10
+    return min(max(level, logging.DEBUG), logging.CRITICAL)
+
+
+def configureLogging(verbose: int = 0, quiet: int = 0) -> int:
+    level = verbosityToLevel(verbose, quiet)
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logging.getLogger().setLevel(level)
+    return level
+
+
+class Lazy:
+    """
+    Defer the rendering of an expensive payload (a dict dump, a sorted set ...) to the moment
+    the record is actually emitted:
+
+        logging.debug("Missing %s", Lazy(_printNiceDict, parser.missing))
+    """
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.fn(*self.args))
+
+    def __repr__(self) -> str:
+        return repr(self.fn(*self.args))
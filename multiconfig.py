@@ -0,0 +1,263 @@
+import argparse
+import ast
+import copy
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from bazel import _merge_rules_cc_loads, importSortKey
+from daemon import Daemon
+
+DEFAULT_CONDITION = "//conditions:default"
+INCOMPATIBLE = "@platforms//:incompatible"
+
+
+def parseConfigs(specs: List[str]) -> List[Tuple[str, str]]:
+    """Split the LABEL=NINJA_FILE configurations, LABEL is the config_setting used in the
+    select() of the attributes that differ."""
+    configs = []
+    for spec in specs:
+        label, sep, filename = spec.partition("=")
+        if not sep or not label or not filename:
+            logging.fatal(f"Configuration {spec} is not in the form LABEL=NINJA_FILE")
+            sys.exit(-1)
+        if label in dict(configs):
+            logging.fatal(f"Configuration {label} is specified twice")
+            sys.exit(-1)
+        configs.append((label, filename))
+    return configs
+
+
+def convertConfigs(
+    args: argparse.Namespace,
+    configs: List[Tuple[str, str]],
+    daemon: Optional[Daemon] = None,
+) -> Tuple[Dict[str, str], str]:
+    """Convert the ninja file of each configuration and merge the BUILD files.
+
+    The conversions share the warm state of a daemon: a source or a header common to
+    several configurations is scanned once.
+    """
+    daemon = daemon or Daemon()
+    outputs: Dict[str, Dict[str, str]] = {}
+    rootdir = args.rootdir
+    for label, filename in configs:
+        logging.info("Converting configuration %s", label)
+        configArgs = copy.copy(args)
+        configArgs.filename = filename
+        outputs[label], rootdir = daemon.convertWarm(configArgs)
+    return mergeConfigs(outputs), rootdir
+
+
+@dataclass
+class _Stanza:
+    source: str
+    # Only for the targets
+    rule: Optional[str] = None
+    # name -> (source, source of the items if it's a list)
+    keywords: Dict[str, Tuple[str, Optional[List[str]]]] = field(default_factory=dict)
+
+
+@dataclass
+class _BuildFile:
+    loads: List[str] = field(default_factory=list)
+    assignments: Dict[str, str] = field(default_factory=dict)
+    # Keyed by target name, the other statements by their source
+    stanzas: Dict[str, _Stanza] = field(default_factory=dict)
+
+
+def _segment(content: str, node: ast.AST) -> str:
+    segment = ast.get_source_segment(content, node)
+    assert segment is not None
+    return segment
+
+
+def _parseBuildFile(content: str) -> _BuildFile:
+    ret = _BuildFile()
+    for stmt in ast.parse(content).body:
+        source = _segment(content, stmt)
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+            target = stmt.targets[0]
+            if isinstance(target, ast.Name):
+                ret.assignments[target.id] = _segment(content, stmt.value)
+                continue
+        call = stmt.value if isinstance(stmt, ast.Expr) else None
+        if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+            ret.stanzas[source] = _Stanza(source)
+            continue
+        if call.func.id == "load":
+            ret.loads.append(source)
+            continue
+        names = [
+            k.value.value
+            for k in call.keywords
+            if k.arg == "name" and isinstance(k.value, ast.Constant)
+        ]
+        if not names or call.args or any(k.arg is None for k in call.keywords):
+            ret.stanzas[source] = _Stanza(source)
+            continue
+        stanza = _Stanza(source, call.func.id)
+        for k in call.keywords:
+            assert k.arg is not None
+            items = None
+            if isinstance(k.value, ast.List):
+                items = [_segment(content, e) for e in k.value.elts]
+            stanza.keywords[k.arg] = (_segment(content, k.value), items)
+        ret.stanzas[str(names[0])] = stanza
+    return ret
+
+
+def _renderList(items: List[str], indent: str) -> str:
+    if not items:
+        return "[]"
+    lines = ["["]
+    lines.extend(f"{indent}    {item}," for item in items)
+    lines.append(f"{indent}]")
+    return "\n".join(lines)
+
+
+def _renderSelect(values: Dict[str, str], indent: str) -> str:
+    """A select() on the configurations, the first one is also the default: a build
+    without any of the config_setting (bazel query, plain bazel build) still analyzes."""
+    if DEFAULT_CONDITION not in values:
+        values = {**values, DEFAULT_CONDITION: next(iter(values.values()))}
+    lines = ["select({"]
+    lines.extend(f"{indent}    {json.dumps(k)}: {v}," for k, v in values.items())
+    lines.append(f"{indent}}})")
+    return "\n".join(lines)
+
+
+def _mergeList(values: Dict[str, List[str]]) -> str:
+    """The items common to all the configurations followed by a select() of the others."""
+    first = next(iter(values.values()))
+    common = [i for i in first if all(i in items for items in values.values())]
+    rest = {
+        label: [i for i in items if i not in common] for label, items in values.items()
+    }
+    if not any(rest.values()):
+        # Only the order or the duplicates differ
+        return _renderList(common, " " * 4)
+    selected = _renderSelect(
+        {label: _renderList(items, " " * 8) for label, items in rest.items()}, " " * 4
+    )
+    if not common:
+        return selected
+    return f"{_renderList(common, ' ' * 4)} + {selected}"
+
+
+def _mergeTarget(stanzas: Dict[str, Optional[_Stanza]]) -> str:
+    present = {label: s for label, s in stanzas.items() if s is not None}
+    first = next(iter(present.values()))
+    # A configuration without the target gets the values of another one, the target is
+    # incompatible with it anyway
+    filled = {label: s or first for label, s in stanzas.items()}
+    keywords: Dict[str, None] = {}
+    for stanza in present.values():
+        keywords.update(dict.fromkeys(stanza.keywords))
+
+    lines = [f"{first.rule}("]
+    for kw in keywords:
+        values = {label: s.keywords.get(kw) for label, s in filled.items()}
+        sources = {v[0] if v is not None else None for v in values.values()}
+        if len(sources) == 1:
+            value = sources.pop()
+        elif all(v is None or v[1] is not None for v in values.values()):
+            value = _mergeList(
+                {label: v[1] if v else [] for label, v in values.items()}  # type: ignore[misc]
+            )
+        else:
+            # None is the default value of the attribute
+            value = _renderSelect(
+                {label: v[0] if v else "None" for label, v in values.items()}, " " * 4
+            )
+        lines.append(f"    {kw} = {value},")
+    if len(present) != len(stanzas) and "target_compatible_with" not in keywords:
+        compatible = {label: "[]" for label in present}
+        compatible[DEFAULT_CONDITION] = json.dumps([INCOMPATIBLE])
+        lines.append(
+            f"    target_compatible_with = {_renderSelect(compatible, ' ' * 4)},"
+        )
+    lines.append(")")
+    return "\n".join(lines)
+
+
+def _mergeBuildFiles(location: str, files: Dict[str, Optional[_BuildFile]]) -> str:
+    present = [f for f in files.values() if f is not None]
+    loads = set()
+    for f in present:
+        loads.update(f.loads)
+    top = sorted(_merge_rules_cc_loads(loads), key=importSortKey)
+    if top:
+        top.extend(["", ""])
+
+    vals = []
+    assignments: Dict[str, None] = {}
+    for f in present:
+        assignments.update(dict.fromkeys(f.assignments))
+    for name in assignments:
+        # Only the flags are assigned, an empty list is the same as not having them
+        values = {
+            label: f.assignments.get(name, "[]") if f else "[]"
+            for label, f in files.items()
+        }
+        if len(set(values.values())) == 1:
+            value = next(iter(values.values()))
+        else:
+            value = _renderSelect(values, "")
+        vals.append(f"{name} = {value}\n")
+
+    keys: Dict[str, None] = {}
+    for f in present:
+        keys.update(dict.fromkeys(f.stanzas))
+    for key in keys:
+        stanzas = {
+            label: f.stanzas.get(key) if f else None for label, f in files.items()
+        }
+        sources = {s.source for s in stanzas.values() if s is not None}
+        rules = {s.rule for s in stanzas.values() if s is not None}
+        if None in rules:
+            # Not a target, kept as is
+            vals.extend([sources.pop(), ""])
+            continue
+        if len(sources) == 1 and None not in stanzas.values():
+            stanza = sources.pop()
+        elif len(rules) > 1:
+            logging.warning(
+                "%s is a %s depending on the configuration, keeping the first one",
+                key,
+                " or a ".join(sorted(str(r) for r in rules)),
+            )
+            stanza = next(s.source for s in stanzas.values() if s is not None)
+        else:
+            stanza = _mergeTarget(stanzas)
+        vals.extend([f"# Location {location}", stanza, ""])
+    return "\n".join(top) + "\n".join(vals)
+
+
+def mergeConfigs(outputs: Dict[str, Dict[str, str]]) -> Dict[str, str]:
+    """Merge the BUILD files generated for each configuration (keyed by its label).
+
+    Targets are matched by name, the attributes that differ between configurations are
+    turned into select(), a list keeps the items common to all the configurations and
+    selects the others. A target missing from some configurations is made incompatible
+    with them.
+    """
+    locations: Dict[str, None] = {}
+    for output in outputs.values():
+        locations.update(dict.fromkeys(output))
+    ret = {}
+    for location in locations:
+        contents = {label: output.get(location) for label, output in outputs.items()}
+        if len(set(contents.values())) == 1:
+            ret[location] = next(iter(contents.values()))  # type: ignore[assignment]
+            continue
+        ret[location] = _mergeBuildFiles(
+            location,
+            {
+                label: _parseBuildFile(c) if c is not None else None
+                for label, c in contents.items()
+            },
+        )
+    return ret
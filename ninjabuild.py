@@ -9,13 +9,32 @@ import tempfile
 import time
 from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
-from bazel import BazelBuild, BazelCCImport
-from build import Build, BuildTarget, Rule, TargetType, TopLevelGroupingStrategy
+from bazel import BazelBuild, BazelCCImport, TargetRegistry
+from build import (
+    Build,
+    BuildTarget,
+    Rule,
+    TargetType,
+    TopLevelGroupingStrategy,
+    classifyVirtualTargets,
+    virtualTargetsReport,
+)
 from build_visitor import BazelBuildVisitorContext, BuildVisitor, PrintVisitorContext
-from configure_file import ConfigureFile
-from cppfileparser import CPPIncludes, findCPPIncludes, parseIncludes
+from configure_file import ConfigureFile, ConfigureFiles
+from cppfileparser import (
+    CPPIncludes,
+    findCPPIncludes,
+    includeResolverForDirs,
+    includeResolverForFlags,
+    includesFromRecordedDeps,
+)
 from helpers import resolvePath
-from protoparser import findProtoIncludes
+from includescanner import MacroTable
+from logutils import Lazy
+from ninjatools import RecordedDeps, readDepfile
+from parallelgen import genBazelInWorkers
+from profiling import phase
+from protoparser import ProtoGraph, protocIncludeDirs
 from visitor import PrunedVisitorContext, VisitorContext
 
 IGNORED_STANZA = [
@@ -99,6 +118,15 @@ class NinjaParser:
         self.generatedFilesLogged: Set[Tuple[str, Optional[str]]] = set()
         self.all_targets: Dict[str, BuildTarget] = {}
         self.cc_imports: List[BuildTarget] = []
+        # When set the #if/#ifdef of the scanned files are evaluated
+        self.predefinedMacros: Optional[MacroTable] = None
+        # Exported files of pregenerated headers are created while finalizing the headers,
+        # the registry has to be passed to genBazelBuildFiles()
+        self.registry = TargetRegistry()
+        # Headers recorded by a previous build (ie. `ninja -t deps`) keyed by output, the
+        # sources with a record (or a depfile when it's not None) are not scanned
+        self.recordedDeps: Optional[RecordedDeps] = None
+        self.protoGraph = ProtoGraph()
 
     def getShortName(self, name, workDir=None, generated=False) -> Tuple[str, str]:
         if name.startswith(self.codeRootDir):
@@ -227,8 +255,8 @@ class NinjaParser:
                         not val.startswith(workDir)
                         and "f{workDir}{val}" in maybeOutputs
                     ):
-                        logging.info(
-                            f"Skipping {val} as it's a duplicate of {workDir}{val}"
+                        logging.debug(
+                            "Skipping %s as it's a duplicate of %s%s", val, workDir, val
                         )
                     else:
                         shortName = self.getShortName(val)
@@ -283,12 +311,12 @@ class NinjaParser:
                     )
                     or realPath.startswith(self.codeRootDir)
                 ):
-                    logging.debug(f"Marking {s} as an known dependency")
+                    logging.debug("Marking %s as an known dependency", s)
                     inputs.append(self._getBuildTarget(s).markAsFile())
                 else:
                     ext = self.externals.get(s)
                     if s in self.manually_generated:
-                        logging.info(f"Marking {s} as a manually generated target")
+                        logging.info("Marking %s as a manually generated target", s)
                         m = self.manually_generated[s]
                         mv = self._getBuildTarget(m)
                         mv.markAsManual()
@@ -296,7 +324,7 @@ class NinjaParser:
                         continue
                     elif ext is None:
                         logging.debug(
-                            f"Marking {s} as an external dependency {realPath}"
+                            "Marking %s as an external dependency %s", s, realPath
                         )
                         quiet = False
                         if s.endswith("CMakeLists.txt"):
@@ -312,7 +340,7 @@ class NinjaParser:
                 if not v:
                     v = self._getBuildTarget(s)
                     if s in self.manually_generated:
-                        logging.info(f"Marking {s} as a manually generated target")
+                        logging.info("Marking %s as a manually generated target", s)
                         m = self.manually_generated[s]
                         v = self._getBuildTarget(m)
                         v.markAsManual()
@@ -348,14 +376,14 @@ class NinjaParser:
                         m = self.manually_generated[vprime]
                         v = self._getBuildTarget(m)
                         logging.info(
-                            f"Marking {vprime} as a manually generated target by {v}"
+                            "Marking %s as a manually generated target by %s", vprime, v
                         )
                         v.markAsManual()
                     else:
                         quiet = True
                         v.markAsExternal(quiet)
                 elif v.name.startswith(self.codeRootDir):
-                    logging.info(f"Marking {v} as an known dependency")
+                    logging.debug("Marking %s as an known dependency", v)
                     v.markAsFile()
                 elif v.name.endswith("CMakeLists.txt"):
                     quiet = True
@@ -364,7 +392,7 @@ class NinjaParser:
                     imp = self.getCCImportForExternalDep(v)
                     if imp is None:
                         if d not in self.missing:
-                            logging.info(f"Missing {d} as an external dependency")
+                            logging.info("Missing %s as an external dependency", d)
                             v.markAsExternal()
                             self.missing[d] = v
                         else:
@@ -384,7 +412,7 @@ class NinjaParser:
         for i in range(len(outputs)):
             o = outputs[i]
             key = str(o)
-            logging.info(f"Dealing with output {o.name}")
+            logging.debug("Dealing with output %s", o.name)
             key = str(o)
             t = self.missing.get(key)
             if t is not None:
@@ -400,7 +428,7 @@ class NinjaParser:
             o = outputs[i]
             for elem in outputs:
                 if elem.name == f"{workDir}{o.name}":
-                    logging.info(f"Setting alias {o.name} to {elem.name}")
+                    logging.debug("Setting alias %s to %s", o.name, elem.name)
                     o.setAlias(elem)
             if o.alias is not None:
                 self.all_outputs[str(o)] = o.alias
@@ -426,7 +454,7 @@ class NinjaParser:
 
     def handleVariable(self, name: str, value: str):
         self.vars[self.currentContext][name] = value
-        logging.debug(f"Var {name} = {self.vars[self.currentContext][name]}")
+        logging.debug("Var %s = %s", name, self.vars[self.currentContext][name])
 
     def handleInclude(self, arr: List[str]):
         dir = self.directories[-1]
@@ -454,7 +482,9 @@ class NinjaParser:
                 "COMMAND", ""
             ) or "/bin/cmake" in build.vars.get("COMMAND", ""):
                 logging.debug(
-                    f'Command for {target.name}: {build.vars.get("COMMAND")} is not a "core" one'
+                    'Command for %s: %s is not a "core" one',
+                    target.name,
+                    build.vars.get("COMMAND"),
                 )
             return
         cmd, runDir = coreRet
@@ -505,10 +535,10 @@ class NinjaParser:
 
         cacheDir = f"{cacheDirBase}/{sha1}"
         if os.path.exists(cacheDir):
-            logging.info(f"Using cache for {cmd} SHA1:{sha1}")
+            logging.info("Using cache for %s SHA1:%s", cmd, sha1)
             _copyFilesBackNForth(cacheDir, tempDir)
         else:
-            logging.info(f"Running in {tempDir} {cmd} SHA1:{sha1}")
+            logging.info("Running in %s %s SHA1:%s", tempDir, cmd, sha1)
             res = subprocess.run(cmd, shell=True)
             if res.returncode != 0:
                 logging.warn(f"Got an exception when trying to run {cmd} in {tempDir}")
@@ -520,17 +550,17 @@ class NinjaParser:
         return tempDir
 
     def getCCImportForExternalDep(self, target: BuildTarget) -> Optional[BuildTarget]:
-        logging.debug(f"Checking {target.name} as part of CCimport")
+        logging.debug("Checking %s as part of CCimport", target.name)
         for imp in self.cc_imports:
             assert isinstance(imp.opaque, BazelCCImport)
-            # logging.info(f"Dealing with {imp} {imp.staticLibrary}")
+            # logging.debug(f"Dealing with {imp} {imp.staticLibrary}")
             if target.name.endswith(".a") and imp.opaque.staticLibrary is not None:
-                # logging.info(f"Looking for {target.name} in {imp}")
+                # logging.debug(f"Looking for {target.name} in {imp}")
                 if target.name in imp.opaque.staticLibrary:
                     return imp
             if target.name.endswith(".so") and imp.opaque.sharedLibrary is not None:
                 if target.name in imp.opaque.sharedLibrary:
-                    # logging.info(f"Looking for {target.name} in {imp}")
+                    # logging.debug(f"Looking for {target.name} in {imp}")
                     return imp
         return None
 
@@ -551,12 +581,13 @@ class NinjaParser:
             workDir = workDir[:-1]
         if isCPPLikeFile(fileName):
             if self.cacheHeaders.get(fileName):
-                logging.debug(f"Already processed {fileName}")
+                logging.debug("Already processed %s", fileName)
                 return
             else:
-                logging.debug(f"Processing {fileName}")
+                logging.debug("Processing %s", fileName)
 
-            includes_dirs: List[str] = []
+            resolver = includeResolverForDirs([])
+            macros = None
             includes = None
             for b in target.usedbybuilds:
                 includes = b.vars.get("INCLUDES", "")
@@ -564,25 +595,8 @@ class NinjaParser:
                     # Find the first build where we have includes and
                     # for those include replace workDir by the tempTopFolder
                     # so that we have a chance of finding our generated headers
-
-                    includes_dirs = parseIncludes(includes)
-                    updated_include_dirs = []
-                    for dir in includes_dirs:
-                        if dir.startswith(workDir):
-                            updated_include_dirs.append(
-                                dir.replace(workDir, tempTopFolder)
-                            )
-                            # We want to clobber the "/" at the end so that
-                            # the constructed path looks nothing like a real
-                            # path and more something like /generatedinclude
-                            updated_include_dirs.append(
-                                dir.replace(workDir + "/", "/generated")
-                            )
-                        else:
-                            updated_include_dirs.append(dir)
-
-                    includes_dirs = updated_include_dirs
-
+                    resolver = includeResolverForFlags(includes, workDir, tempTopFolder)
+                    macros = self._macrosForBuild(b)
                     break
             if includes is None:
                 logging.warn(
@@ -592,7 +606,7 @@ class NinjaParser:
                 return
             cppIncludes = findCPPIncludes(
                 os.path.sep.join([fileFolder, fileName]),
-                includes_dirs,
+                resolver,
                 self.compilerIncludes,
                 self.cc_imports,
                 self.generatedFiles,
@@ -601,14 +615,15 @@ class NinjaParser:
                 workDir,
                 srcDir,
                 list(self.remapPaths.keys()),
+                macros,
             )
             if len(cppIncludes.notFoundHeaders) > 0 and includes != "":
                 logging.warning(
                     f"Couldn't find {cppIncludes.notFoundHeaders} headers for generated file {fileName}"
                 )
             if debug:
-                logging.info(
-                    f"For file {fileName} found headers {cppIncludes.foundHeaders}"
+                logging.debug(
+                    "For file %s found headers %s", fileName, cppIncludes.foundHeaders
                 )
             for i in build.outputs:
                 if not (
@@ -618,7 +633,7 @@ class NinjaParser:
                     # There might be a lot more files we are not interested with it right now
                     continue
                 logging.debug(
-                    f"Setting headers for {i.name} {len(cppIncludes.foundHeaders)}"
+                    "Setting headers for %s %s", i.name, len(cppIncludes.foundHeaders)
                 )
                 allIncludes = []
                 for h in list(cppIncludes.foundHeaders):
@@ -636,8 +651,9 @@ class NinjaParser:
                 # We make the decision to not deal with generated files that are needed by other
                 # generated files
                 for h in list(cppIncludes.neededGeneratedFiles):
-                    logging.info(
-                        f"Not adding {h[0]} to the list of includes because we are dealing with a generated file"
+                    logging.debug(
+                        "Not adding %s to the list of includes because we are dealing with a generated file",
+                        h[0],
                     )
 
                 i.setIncludedFiles(allIncludes)
@@ -669,10 +685,12 @@ class NinjaParser:
     def _finalizeHeadersForNonGeneratedFiles(
         self, current_dir: str, top_levels: List[BuildTarget]
     ):
-        logging.info(
-            f"Finalizing headers for non-generated files in {current_dir} {top_levels}"
+        logging.debug(
+            "Finalizing headers for non-generated files in %s %s",
+            current_dir,
+            top_levels,
         )
-        logging.info(f"There are {len(self.all_outputs.values())} outputs")
+        logging.info("There are %s outputs", len(self.all_outputs.values()))
         all_outputs = set()
         for bt in top_levels:
             all_outputs.update(self._find_deps(bt))
@@ -702,7 +720,7 @@ class NinjaParser:
                 ):
                     continue
                 else:
-                    logging.debug(f"Adding generated input {g} to build {build}")
+                    logging.debug("Adding generated input %s to build %s", g, build)
                     build.addInput(g)
 
     def _finalizeHeadersForNonGeneratedFileForBuild(
@@ -716,7 +734,11 @@ class NinjaParser:
         tempDirName = None
         shortedName = elem.name.replace(workDir, "")
         logging.debug(
-            f"Dealing with {elem.name} {shortedName} {isCPPLikeFile(elem.name)} {shortedName}"
+            "Dealing with %s %s %s %s",
+            elem.name,
+            shortedName,
+            isCPPLikeFile(elem.name),
+            shortedName,
         )
         if isCPPLikeFile(shortedName):
             if elem.is_a_file:
@@ -727,47 +749,59 @@ class NinjaParser:
                 tempDirName = tmp[1]
                 # tmp is a tuple build / path where the generated file is stored
                 if tempDirName is None:
-                    logging.info(f"Path for {tmp[0]} is None skipping")
+                    logging.debug("Path for %s is None skipping", tmp[0])
                     return generatedOutputsNeeded
                 filename = f"{tempDirName}/{shortedName}"
             else:
                 return generatedOutputsNeeded
-            includes_dirs = parseIncludes(build.vars.get("INCLUDES", ""))
-            if len(includes_dirs) == 0 and build.rulename.name == "CUSTOM_COMMAND":
-                logging.info(
-                    f"Skipping looking for headers in file for a custom command build with no includes {build}"
+            resolver = includeResolverForFlags(build.vars.get("INCLUDES", ""), workDir)
+            if len(resolver) == 0 and build.rulename.name == "CUSTOM_COMMAND":
+                logging.debug(
+                    "Skipping looking for headers in file for a custom command build with no includes %s",
+                    build,
                 )
                 return generatedOutputsNeeded
             logging.debug(
-                f"Looking for header in {filename} with includes {includes_dirs} in {build}"
-            )
-            updated_include_dirs = []
-            for dir in includes_dirs:
-                if dir.startswith(workDir):
-                    updated_include_dirs.append(dir.replace(workDir, "/generated"))
-                elif workDir.endswith("/") and dir.startswith(workDir[:-1]):
-                    updated_include_dirs.append(dir.replace(workDir[:-1], "/generated"))
-                else:
-                    updated_include_dirs.append(dir)
-
-            cppIncludes = findCPPIncludes(
+                "Looking for header in %s with includes %s in %s",
                 filename,
-                updated_include_dirs,
-                self.compilerIncludes,
-                self.cc_imports,
-                self.generatedFiles,
-                generated,
-                tempDirName,
-                workDir,
-                srcDir,
-                list(self.remapPaths.keys()),
+                resolver,
+                build,
             )
+
+            deps = None if generated else self._recordedDepsForBuild(build, workDir)
+            recorded = None
+            if deps is not None:
+                recorded = includesFromRecordedDeps(
+                    filename,
+                    deps,
+                    resolver,
+                    self.compilerIncludes,
+                    self.cc_imports,
+                    workDir,
+                    srcDir,
+                )
+            if recorded is not None:
+                cppIncludes = recorded
+            else:
+                cppIncludes = findCPPIncludes(
+                    filename,
+                    resolver,
+                    self.compilerIncludes,
+                    self.cc_imports,
+                    self.generatedFiles,
+                    generated,
+                    tempDirName,
+                    workDir,
+                    srcDir,
+                    list(self.remapPaths.keys()),
+                    self._macrosForBuild(build),
+                )
             if len(cppIncludes.notFoundHeaders) > 0:
                 for h in cppIncludes.notFoundHeaders:
                     if h in self.generatedFiles:
                         if h in self.generatedFilesLogged:
-                            logging.info(
-                                f"Found missing header {h} in the generated files"
+                            logging.debug(
+                                "Found missing header %s in the generated files", h
                             )
                     else:
                         if h not in self.missingFiles:
@@ -787,7 +821,9 @@ class NinjaParser:
                 if h2 not in self.generatedFilesLogged:
                     if tempDirName is not None and h2[0].startswith(tempDirName):
                         h2 = (h2[0].replace(f"{tempDirName}/", ""), h2[1])
-                    logging.info(f"Needed generated include file {h2}, for {filename}")
+                    logging.info(
+                        "Needed generated include file %s, for %s", h2, filename
+                    )
                     self.generatedFilesLogged.add(h2)
 
                 if h2[0].endswith(".pb.h"):
@@ -800,7 +836,7 @@ class NinjaParser:
                             # We need to add it so that the include path is correctly build
                             elem.addIncludedFile((f"FAKE{h2[0]}", h2[1]))
                     continue
-                logging.info(f"dirName {tempDirName} {h2[0]}")
+                logging.debug("dirName %s %s", tempDirName, h2[0])
                 if os.path.exists(f"{workDir}/{h2[0]}"):
                     includeDir = (
                         f"{workDir}pregenerated/{h2[1].replace('/generated', '')}"
@@ -813,10 +849,14 @@ class NinjaParser:
                         ctx=None,
                         fileLocation=None,
                         ispregenerated=True,
+                        registry=self.registry,
                     )
                     elem.addDeps(ef)
-                    logging.info(
-                        f"Adding {h2[0]} to pre generated files as it exists in {workDir} include Dir {includeDir}"
+                    logging.debug(
+                        "Adding %s to pre generated files as it exists in %s include Dir %s",
+                        h2[0],
+                        workDir,
+                        includeDir,
                     )
                 else:
                     for bldTgt in self.generatedFiles[h2[0]][0].outputs:
@@ -828,22 +868,21 @@ class NinjaParser:
                         includeDir = h2[1]
                         if bldTgt.name == h2[0]:
                             logging.debug(
-                                f"For {filename} need generated file  {h2[0]} requires build target {bldTgt.name}"
+                                "For %s need generated file  %s requires build target %s",
+                                filename,
+                                h2[0],
+                                bldTgt.name,
                             )
                             generatedOutputsNeeded.add(bldTgt)
                 elem.addIncludedFile((h2[0], includeDir))
 
         if elem.is_a_file and isProtoLikeFile(elem.name):
-            for part in build.vars.get("COMMAND", "").split("&&"):
-                if "/protoc" in part:
-                    regex = r"-I ([^ ]+)"
-                    matches = re.findall(regex, part)
-                    for match in matches:
-                        if match not in includes_dirs:
-                            includes_dirs.append(match)
-
-            protos = findProtoIncludes(elem.name, includes_dirs)
-            logging.info(f"Found proto includes {protos} for {elem.name}")
+            for match in protocIncludeDirs(build.vars.get("COMMAND", "")):
+                if match not in includes_dirs:
+                    includes_dirs.append(match)
+
+            protos = self.protoGraph.findProtoIncludes(elem.name, includes_dirs)
+            logging.debug("Found proto includes %s for %s", protos, elem.name)
             for f, deps in protos.items():
                 # FIrst create build target for f if it didn't exists already
                 if f != elem.name:
@@ -853,7 +892,7 @@ class NinjaParser:
                 for p in deps:
                     if p[1] == "@":
                         tgtname = f"@{p[0]}"
-                        logging.debug(f"Adding external dependency {tgtname}")
+                        logging.debug("Adding external dependency %s", tgtname)
                         dep = self._getBuildTarget(tgtname, (tgtname, None))
                         dep.markAsExternal()
                         tgt.addDeps(dep)
@@ -867,7 +906,11 @@ class NinjaParser:
                         # included protobuf
                         (d, _) = self.getShortName(p[1], workDir)
                         logging.debug(
-                            f"Adding internal dependency {p[0]} to {f} ({tgt.name}) delta directory: {d}"
+                            "Adding internal dependency %s to %s (%s) delta directory: %s",
+                            p[0],
+                            f,
+                            tgt.name,
+                            d,
                         )
                         dep = self._getBuildTarget(p[0])
                         dep.addTargetSpecificParameters({"stripImportPrefix": f"/{d}"})
@@ -990,7 +1033,7 @@ class NinjaParser:
                 self.handleInclude(arr[1:])
                 continue
 
-            logging.debug(f"{line} {len(line)}")
+            logging.debug("%s %s", line, len(line))
         self.directories.pop()
 
     def setCCImports(self, cc_imports: List[BazelCCImport]):
@@ -1001,9 +1044,60 @@ class NinjaParser:
             for imp in cc_imports
         ]
 
+    def setRecordedDeps(self, recordedDeps: Optional[RecordedDeps]):
+        self.recordedDeps = recordedDeps
+
+    def _recordedDepsForBuild(self, build: Build, workDir: str) -> Optional[List[str]]:
+        # The record is for the whole build, it can only be attributed to its source if
+        # there is only one
+        if self.recordedDeps is None or len(build.getInputs()) != 1:
+            return None
+        for o in build.outputs:
+            deps = self.recordedDeps.get(o.name)
+            if deps is None and workDir != "" and o.name.startswith(workDir):
+                deps = self.recordedDeps.get(o.name[len(workDir) :])
+            if deps is not None:
+                return deps
+        return self._depfileForBuild(build, workDir)
+
+    def _depfileForBuild(self, build: Build, workDir: str) -> Optional[List[str]]:
+        # ninja deletes the depfiles it moves to .ninja_deps (deps = gcc), the ones left
+        # are from rules without deps
+        depfile = build.vars.get("DEP_FILE")
+        if depfile is None:
+            return None
+        depfile = os.path.join(workDir, depfile)
+        try:
+            depfileMtime = os.stat(depfile).st_mtime_ns
+        except OSError:
+            return None
+        deps = readDepfile(depfile)
+        if deps is None:
+            return None
+        # Same rule as the .ninja_deps: stale if the source or a header changed since
+        for dep in [build.getInputs()[0].name, *deps]:
+            path = os.path.join(workDir, dep)
+            try:
+                if os.stat(path).st_mtime_ns > depfileMtime:
+                    logging.debug("Skipping %s, older than %s", depfile, path)
+                    return None
+            except OSError:
+                return None
+        return deps
+
     def setCompilerIncludes(self, compilerIncludes: List[str]):
         self.compilerIncludes = compilerIncludes
 
+    def setPredefinedMacros(self, predefinedMacros: Optional[MacroTable]):
+        self.predefinedMacros = predefinedMacros
+
+    def _macrosForBuild(self, build: Build) -> Optional[MacroTable]:
+        if self.predefinedMacros is None:
+            return None
+        return self.predefinedMacros.withFlags(
+            build.vars.get("DEFINES", ""), build.vars.get("FLAGS", "")
+        )
+
     def pruneTransitivePhonyTargets(self):
         # FIXME
         # revist that at some point
@@ -1019,19 +1113,19 @@ class NinjaParser:
 
     def _visitGraph(self, target: BuildTarget):
         if target in self.visited:
-            logging.info(f"Already visited {target.name}")
+            logging.debug("Already visited %s", target.name)
             return
         else:
-            logging.info(f"Visiting {target.name}")
+            logging.debug("Visiting %s", target.name)
             self.visited.add(target)
         build = target.producedby
         if build is None:
             return
         for tgt in build.getInputs():
-            logging.info(f"Visiting input {tgt.name}")
+            logging.debug("Visiting input %s", tgt.name)
             # self._visitGraph(tgt)
         for tgt in build.depends:
-            logging.info(f"Visiting depend{tgt.name}")
+            logging.debug("Visiting depend%s", tgt.name)
             # self._visitGraph(tgt)
 
     def _visitGraphToPrune(
@@ -1056,7 +1150,7 @@ class NinjaParser:
                     self._visitGraphToPrune(childBuild, ctx, build, attr, i)
         # We want to do that after we have visited all the inputs / depends
         if canBePruned(build) and attribute is not None:
-            logging.info(f"Pruning {build}")
+            logging.debug("Pruning %s", build)
             # Take the inputs of the build and in the parent build replace the input/dependency on this build's output by the inputs
             assert len(build.depends) == 0
             assert parentBuild is not None
@@ -1072,6 +1166,13 @@ class NinjaParser:
                 set(filter(lambda x: x is not None, newElements)),
             )
 
+    def classifyVirtualTargets(self):
+        classifyVirtualTargets(self.all_targets.values())
+        logging.debug(
+            "Virtual targets:\n%s",
+            Lazy(virtualTargetsReport, self.all_targets.values()),
+        )
+
     def resolveAliases(self):
         for b in self.buildEdges:
             for attr in ["_inputs", "depends"]:
@@ -1130,6 +1231,7 @@ def genBazel(
     flagsToIgnore: List[str],
     configure_files: Optional[Dict[str, ConfigureFile]] = None,
     configure_binary_dir: Optional[str] = None,
+    configure_files_batch: bool = False,
 ):
     if rootdir.endswith("/"):
         dir = rootdir
@@ -1144,6 +1246,7 @@ def genBazel(
         prefix=bb.prefix,
         configure_files=configure_files,
         configure_binary_dir=configure_binary_dir,
+        configure_files_batch=configure_files_batch,
     )
 
     visitor = BuildVisitor.getVisitor()
@@ -1162,16 +1265,26 @@ def getBuildTargets(
     cc_imports: List[BazelCCImport],
     compilerIncludes: List[str],
     top_level_targets: List[str],
+    predefinedMacros: Optional[MacroTable] = None,
+    registry: Optional[TargetRegistry] = None,
+    recordedDeps: Optional[RecordedDeps] = None,
+    protoGraph: Optional[ProtoGraph] = None,
 ) -> List[BuildTarget]:
     TopLevelGroupingStrategy(directoryPrefix)
 
     parser = NinjaParser(codeRootDir)
+    if registry is not None:
+        parser.registry = registry
+    if protoGraph is not None:
+        parser.protoGraph = protoGraph
     parser.setManuallyGeneratedTargets(manuallyGenerated)
     parser.setContext(ninjaFileName)
     parser.setRemapPath(remap)
     parser.setDirectoryPrefix(directoryPrefix)
     parser.setCompilerIncludes(compilerIncludes)
+    parser.setPredefinedMacros(predefinedMacros)
     parser.setCCImports(cc_imports)
+    parser.setRecordedDeps(recordedDeps)
     parser.parse(raw_ninja, dir)
     logging.info("Parsing done")
     parser.endContext(ninjaFileName)
@@ -1180,13 +1293,18 @@ def getBuildTargets(
 
     if len(parser.missing) != 0 and "all" in top_level_targets:
         logging.error(
-            f"Something is wrong there is {len(parser.missing)} missing dependencies:\n {_printNiceDict(parser.missing)}"
+            "Something is wrong there is %s missing dependencies:\n %s",
+            len(parser.missing),
+            Lazy(_printNiceDict, parser.missing),
         )
         return []
 
     top_levels = getToplevels(parser, top_level_targets)
-    logging.info(f"Found {len(top_levels)} top levels")
-    parser.finalizeHeaders(dir, top_levels)
+    logging.info("Found %s top levels", len(top_levels))
+    with phase("finalizeHeaders"):
+        parser.finalizeHeaders(dir, top_levels)
+    # finalizeHeaders is the last one to add inputs/depends, the graph is frozen from now on
+    parser.classifyVirtualTargets()
     return top_levels
 
 
@@ -1212,8 +1330,11 @@ def genBazelBuildFiles(
     buildCustomizationDirectory: str,
     configure_files: Optional[Dict[str, ConfigureFile]] = None,
     configure_binary_dir: Optional[str] = None,
+    configure_files_batch: bool = False,
+    registry: Optional[TargetRegistry] = None,
+    jobs: int = 1,
 ) -> Dict[str, str]:
-    bb = BazelBuild(prefix)
+    bb = BazelBuild(prefix, registry)
     if buildCustomizationDirectory.startswith("/"):
         dir = buildCustomizationDirectory
     else:
@@ -1224,13 +1345,13 @@ def genBazelBuildFiles(
     additionalsBazelIncludes: Dict[str, List[str]] = {}
 
     postprocessingFilename = f"{dir}/postprocessing.py"
-    logging.info(f"Looking for postprocessing file {postprocessingFilename}")
+    logging.info("Looking for postprocessing file %s", postprocessingFilename)
     if os.path.exists(postprocessingFilename):
         sys.path.append(dir)
         import postprocessing as pp  # type: ignore
 
         flagsToIgnore = pp.getFlagsToIgnore()
-        logging.info(f"Flags to ignore {flagsToIgnore}")
+        logging.info("Flags to ignore %s", flagsToIgnore)
         commonFlags = pp.getCommonFlags()
         additionalsBazelIncludes = pp.getAdditionalBazelIncludes()
         for e in pp.postProcessingList:
@@ -1238,9 +1359,32 @@ def genBazelBuildFiles(
             bb.setCommonFlags(commonFlags)
             bb.setAdditionalBazelHeaders(additionalsBazelIncludes)
 
-    for e in sorted(top_levels):
+    def generate(e: BuildTarget, bb: BazelBuild):
         e.markTopLevel()
-        genBazel(e, bb, rootdir, flagsToIgnore, configure_files, configure_binary_dir)
+        genBazel(
+            e,
+            bb,
+            rootdir,
+            flagsToIgnore,
+            configure_files,
+            configure_binary_dir,
+            configure_files_batch,
+        )
+
+    ordered = sorted(top_levels)
+    if (
+        jobs <= 1
+        or len(ordered) <= 1
+        or not genBazelInWorkers(
+            ordered,
+            bb,
+            generate,
+            jobs,
+            configure_files if isinstance(configure_files, ConfigureFiles) else None,
+        )
+    ):
+        for e in ordered:
+            generate(e, bb)
 
     bb.cleanup()
 
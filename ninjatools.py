@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import subprocess
+from typing import Dict, List, Optional
+
+# The headers (and the source) each output was built from, as recorded by ninja
+RecordedDeps = Dict[str, List[str]]
+
+# mod0/CMakeFiles/mod0.dir/src/s0.cc.o: #deps 3, deps mtime 1700000000000000000 (VALID)
+_DEPS_RECORD_RE = re.compile(r"^(.+): #deps (\d+), deps mtime (\d+) \((\w+)\)$")
+
+NINJA_DEPS_SIGNATURE = b"# ninjadeps\n"
+# The high bit of the size of a record is set for the deps records, not for the paths
+_DEPS_RECORD_FLAG = 0x80000000
+
+
+def parseToolDeps(text: str) -> RecordedDeps:
+    """Parse the output of `ninja -t deps`.
+
+    The STALE records (the output changed since they were recorded) are skipped, the
+    includes of their sources will be scanned.
+    """
+    ret: RecordedDeps = {}
+    current: Optional[List[str]] = None
+    for line in text.splitlines():
+        if line.startswith(" ") and current is not None:
+            current.append(line.strip())
+            continue
+        current = None
+        match = _DEPS_RECORD_RE.match(line)
+        if match is None:
+            continue
+        if match.group(4) != "VALID":
+            logging.debug("Skipping the %s deps of %s", match.group(4), match.group(1))
+            continue
+        current = ret[match.group(1)] = []
+    return ret
+
+
+def runToolDeps(buildDir: str, ninja: str = "ninja") -> RecordedDeps:
+    if shutil.which(ninja) is None:
+        logging.warning("Can't find %s, the includes will be scanned", ninja)
+        return {}
+    result = subprocess.run(
+        [ninja, "-C", buildDir, "-t", "deps"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        logging.warning(
+            "`%s -t deps` failed, the includes will be scanned: %s",
+            ninja,
+            result.stderr.strip(),
+        )
+        return {}
+    return parseToolDeps(result.stdout)
+
+
+def _mtime(path: str, version: int) -> int:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    # Nanoseconds since the version 4 of the log, seconds before
+    return st.st_mtime_ns if version >= 4 else int(st.st_mtime)
+
+
+def parseNinjaDeps(data: bytes, buildDir: str) -> RecordedDeps:
+    """Parse the binary deps log (.ninja_deps) that ninja keeps in the build directory.
+
+    The records of the outputs that are missing or newer than their record are skipped,
+    as are the ones with a dependency (the source or a header) that is missing or newer
+    than the record: the output is dirty for ninja. A truncated log (ninja was
+    interrupted) is read up to the last complete record.
+    """
+    if not data.startswith(NINJA_DEPS_SIGNATURE):
+        raise ValueError("Not a ninja deps log")
+    offset = len(NINJA_DEPS_SIGNATURE)
+    if len(data) < offset + 4:
+        raise ValueError("Truncated ninja deps log")
+    (version,) = struct.unpack_from("<i", data, offset)
+    if version not in (3, 4):
+        raise ValueError(f"Unsupported ninja deps log version {version}")
+    offset += 4
+    paths: List[str] = []
+    records: Dict[int, tuple] = {}
+    while offset + 4 <= len(data):
+        (size,) = struct.unpack_from("<I", data, offset)
+        isDeps = bool(size & _DEPS_RECORD_FLAG)
+        size &= ~_DEPS_RECORD_FLAG
+        if size % 4 or offset + 4 + size > len(data):
+            break
+        record = data[offset + 4 : offset + 4 + size]
+        offset += 4 + size
+        if isDeps:
+            if version >= 4:
+                outId, low, high = struct.unpack_from("<iII", record)
+                mtime, first = (high << 32) | low, 12
+            else:
+                outId, mtime = struct.unpack_from("<ii", record)
+                first = 8
+            ids = struct.unpack_from(f"<{(size - first) // 4}i", record, first)
+            # The last record of an output is the one that counts
+            records[outId] = (mtime, ids)
+            continue
+        (checksum,) = struct.unpack_from("<I", record, size - 4)
+        if checksum != ~len(paths) & 0xFFFFFFFF:
+            break
+        paths.append(
+            record[: size - 4].rstrip(b"\0").decode("utf-8", "surrogateescape")
+        )
+
+    mtimes: Dict[int, int] = {}
+
+    def pathMtime(pathId: int) -> int:
+        ret = mtimes.get(pathId)
+        if ret is None:
+            ret = mtimes[pathId] = _mtime(
+                os.path.join(buildDir, paths[pathId]), version
+            )
+        return ret
+
+    ret: RecordedDeps = {}
+    for outId, (mtime, ids) in records.items():
+        if outId >= len(paths) or any(i >= len(paths) for i in ids):
+            continue
+        output = paths[outId]
+        outputMtime = pathMtime(outId)
+        if outputMtime == 0 or outputMtime > mtime:
+            logging.debug("Skipping the STALE deps of %s", output)
+            continue
+        # Like ninja, the output is dirty if the source or a header was modified (or
+        # removed) since it was built: a new #include wouldn't be in the record
+        if any(pathMtime(i) == 0 or pathMtime(i) > mtime for i in ids):
+            logging.debug("Skipping the deps of %s, an input changed", output)
+            continue
+        ret[output] = [paths[i] for i in ids]
+    return ret
+
+
+def readNinjaDeps(path: str) -> RecordedDeps:
+    with open(path, "rb") as f:
+        return parseNinjaDeps(f.read(), os.path.dirname(path))
+
+
+def parseDepfile(text: str) -> List[str]:
+    """The dependencies of the first rule of a Makefile-like depfile (gcc -MD)."""
+    text = text.replace("\\\r\n", " ").replace("\\\n", " ")
+    words: List[str] = []
+    current = ""
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text) and text[i + 1] in " #":
+            current += text[i + 1]
+            i += 2
+            continue
+        if c == "$" and text[i + 1 : i + 2] == "$":
+            current += "$"
+            i += 2
+            continue
+        if c.isspace():
+            if current:
+                words.append(current)
+                current = ""
+            if c == "\n" and any(w.endswith(":") for w in words):
+                # The phony rules of the headers (-MP) follow
+                break
+        else:
+            current += c
+        i += 1
+    if current:
+        words.append(current)
+    for i, word in enumerate(words):
+        if word.endswith(":"):
+            return words[i + 1 :]
+    return []
+
+
+def readDepfile(path: str) -> Optional[List[str]]:
+    try:
+        with open(path, "r") as f:
+            return parseDepfile(f.read())
+    except OSError:
+        return None
+
+
+def loadRecordedDeps(source: str, buildDir: str) -> RecordedDeps:
+    """Load the header dependencies recorded by a previous build.
+
+    source is `auto` to read the .ninja_deps of buildDir if it was built (nothing if it
+    can't be read), `ninja` to run `ninja -t deps` in buildDir, `none` or a file: a
+    .ninja_deps, the output of `ninja -t deps` or the same data as JSON ({output: [deps]}).
+    """
+    if source == "none":
+        return {}
+    if source == "auto":
+        path = os.path.join(buildDir, ".ninja_deps")
+        if not os.path.exists(path):
+            return {}
+        try:
+            deps = readNinjaDeps(path)
+        except (OSError, ValueError) as e:
+            # Not asked for explicitly, the includes can still be scanned
+            logging.warning("Can't read %s, the includes will be scanned: %s", path, e)
+            return {}
+    elif source == "ninja":
+        deps = runToolDeps(buildDir)
+    else:
+        with open(source, "rb") as f:
+            raw = f.read()
+        if raw.startswith(NINJA_DEPS_SIGNATURE):
+            deps = parseNinjaDeps(raw, buildDir)
+        else:
+            content = raw.decode("utf-8", "surrogateescape")
+            if content.lstrip().startswith("{"):
+                deps = json.loads(content)
+            else:
+                deps = parseToolDeps(content)
+    logging.info("Loaded the recorded dependencies of %s outputs", len(deps))
+    return deps
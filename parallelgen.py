@@ -0,0 +1,348 @@
+import gc
+import logging
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
+
+from bazel import BaseBazelTarget, BazelBuild, BazelCCImport
+from build import BuildTarget
+from configure_file import ConfigureFiles
+
+BazelObject = Union[BaseBazelTarget, BazelCCImport]
+GenerateFunc = Callable[[BuildTarget, BazelBuild], None]
+Label = Tuple[Any, ...]
+
+# Caches rebuilt when rendering, they are not merged
+_SKIPPED_ATTRIBUTES = {"_renderedLabels"}
+_CONTAINERS = (set, frozenset, list, tuple)
+
+
+@dataclass(frozen=True)
+class _Ref:
+    """A reference to the object at index in PartialBuild.objects."""
+
+    index: int
+
+
+@dataclass
+class PartialBuild:
+    """The Bazel targets generated by a worker for some top levels.
+
+    The targets reference each other and their hash depends on their attributes, they
+    can't be unpickled as they are: the objects are flattened, the references between
+    them (and from the other fields) are _Ref.
+    """
+
+    # (class, label, attributes without references, attributes with references)
+    objects: List[Tuple[Type[Any], Label, Dict[str, Any], Dict[str, Any]]]
+    targets: List[_Ref]
+    registry: Dict[Tuple[Any, ...], _Ref]
+    staticFiles: Dict[str, _Ref]
+    protoNames: Dict[str, str]
+    # The configure_file() lookups that didn't match, for the report of the parent
+    configureMisses: Dict[str, List[str]] = field(default_factory=dict)
+
+
+class MergeConflict(Exception):
+    """Two workers generated different values for the same attribute of a target."""
+
+
+def _label(o: BazelObject) -> Label:
+    rule = getattr(o, "rule", None)
+    return (
+        type(o),
+        getattr(o, "type", None),
+        o.name,
+        o.location,
+        rule.name if rule is not None else None,
+    )
+
+
+def _isBazelObject(value: Any) -> bool:
+    return isinstance(value, (BaseBazelTarget, BazelCCImport))
+
+
+def flattenBuild(bb: BazelBuild) -> PartialBuild:
+    ids: Dict[int, int] = {}
+    objects: List[BazelObject] = []
+
+    def ref(o: BazelObject) -> _Ref:
+        index = ids.get(id(o))
+        if index is None:
+            index = ids[id(o)] = len(objects)
+            objects.append(o)
+        return _Ref(index)
+
+    def encode(value: Any) -> Any:
+        """value with _Ref instead of the objects, value itself if it has none."""
+        if _isBazelObject(value):
+            return ref(value)
+        if type(value) in _CONTAINERS:
+            items = [encode(v) for v in value]
+            if all(e is v for e, v in zip(items, value)):
+                return value
+            return type(value)(items)
+        if type(value) is dict:
+            encoded = {encode(k): encode(v) for k, v in value.items()}
+            if all(
+                ek is k and ev is v
+                for (ek, ev), (k, v) in zip(encoded.items(), value.items())
+            ):
+                return value
+            return encoded
+        return value
+
+    targets = [ref(t) for t in bb.bazelTargets]
+    registry = {key: ref(o) for key, o in bb.registry._objects.items()}
+    staticFiles = {name: ref(ef) for name, ef in bb.registry.staticFiles.items()}
+    flattened = []
+    # objects grows while the attributes are encoded
+    i = 0
+    while i < len(objects):
+        o = objects[i]
+        plain = {}
+        linked = {}
+        for name, value in vars(o).items():
+            if name in _SKIPPED_ATTRIBUTES:
+                continue
+            encoded = encode(value)
+            if encoded is value:
+                plain[name] = value
+            else:
+                linked[name] = encoded
+        flattened.append((type(o), _label(o), plain, linked))
+        i += 1
+    return PartialBuild(
+        flattened, targets, registry, staticFiles, dict(bb.registry.protoNames)
+    )
+
+
+def _same(a: Any, b: Any) -> bool:
+    if _isBazelObject(a) or _isBazelObject(b):
+        return a is b
+    # The objects that don't define __eq__ (ie. the headers of the cc_imports) are
+    # copies coming from different workers
+    return a == b or pickle.dumps(a) == pickle.dumps(b)
+
+
+def _hashableItems(items: List[Any]) -> Set[Any]:
+    seen = set()
+    for v in items:
+        try:
+            seen.add(v)
+        except TypeError:
+            pass
+    return seen
+
+
+def _extendList(current: List[Any], new: List[Any], seen: Set[Any]):
+    """Append the items of new that aren't in current, seen has its hashable items."""
+    for v in new:
+        try:
+            if v in seen:
+                continue
+            seen.add(v)
+        except TypeError:
+            if v in current:
+                continue
+        current.append(v)
+
+
+def _mergeValue(current: Any, new: Any, where: str) -> Any:
+    if isinstance(current, set) and isinstance(new, set):
+        current.update(new)
+        return current
+    if isinstance(current, dict) and isinstance(new, dict):
+        for k, v in new.items():
+            if k in current and not _same(current[k], v):
+                raise MergeConflict(f"{where}[{k!r}]")
+            current[k] = v
+        return current
+    if not _same(current, new):
+        raise MergeConflict(f"{where}: {current!r} != {new!r}")
+    return current
+
+
+class _Merger:
+    def __init__(self):
+        self.canonical: Dict[Label, BazelObject] = {}
+        self.targets: Dict[Label, None] = {}
+        self.registry: Dict[Tuple[Any, ...], BazelObject] = {}
+        self.staticFiles: Dict[str, BazelObject] = {}
+        self.protoNames: Dict[str, str] = {}
+        # The items of the merged lists, a list can get one per partial
+        self.listItems: Dict[Tuple[Label, str], Set[Any]] = {}
+
+    def add(self, partial: PartialBuild):
+        local: List[BazelObject] = []
+        created: List[bool] = []
+        # The attributes used by the hash (name, type ...) are set before the objects
+        # are put in sets
+        for cls, label, plain, _ in partial.objects:
+            o = self.canonical.get(label)
+            created.append(o is None)
+            if o is None:
+                o = cls.__new__(cls)
+                o.__dict__.update(plain)
+                o._renderedLabels = {}
+                self.canonical[label] = o
+            local.append(o)
+
+        def decode(value: Any) -> Any:
+            if isinstance(value, _Ref):
+                return local[value.index]
+            if type(value) in _CONTAINERS:
+                return type(value)(decode(v) for v in value)
+            if type(value) is dict:
+                return {decode(k): decode(v) for k, v in value.items()}
+            return value
+
+        for (_, label, plain, linked), o, isNew in zip(partial.objects, local, created):
+            if isNew:
+                for name, value in linked.items():
+                    setattr(o, name, decode(value))
+                continue
+            for attributes, convert in ((plain, None), (linked, decode)):
+                for name, value in attributes.items():
+                    if convert is not None:
+                        value = convert(value)
+                    current = getattr(o, name, None)
+                    if isinstance(current, list) and isinstance(value, list):
+                        seen = self.listItems.get((label, name))
+                        if seen is None:
+                            seen = _hashableItems(current)
+                            self.listItems[(label, name)] = seen
+                        _extendList(current, value, seen)
+                        value = current
+                    elif hasattr(o, name):
+                        value = _mergeValue(current, value, f"{o!r}.{name}")
+                    setattr(o, name, value)
+
+        for t in partial.targets:
+            self.targets[_label(local[t.index])] = None
+        for key, r in partial.registry.items():
+            self.registry.setdefault(key, local[r.index])
+        for filename, r in partial.staticFiles.items():
+            if (
+                self.staticFiles.setdefault(filename, local[r.index])
+                is not local[r.index]
+            ):
+                raise MergeConflict(f"Exported file {filename}")
+        for name, protoName in partial.protoNames.items():
+            if self.protoNames.setdefault(name, protoName) != protoName:
+                raise MergeConflict(f"Proto name of {name}")
+
+    def install(self, bb: BazelBuild):
+        values = list(self.protoNames.values())
+        if len(set(values)) != len(values):
+            raise MergeConflict("A proto name is used for different protos")
+        for label in self.targets:
+            bb.bazelTargets.add(self.canonical[label])
+        bb.registry._objects = self.registry
+        bb.registry.staticFiles = self.staticFiles  # type: ignore[assignment]
+        bb.registry.protoNames = self.protoNames
+        bb.registry.protoNameValues = set(values)
+
+
+def mergePartials(bb: BazelBuild, partials: List[PartialBuild]):
+    """Union the targets of the partials into bb, by label.
+
+    The partials are merged in order, the sets (and lists) of a target are the union of
+    the ones of the partials, the other values must be the same in all of them or
+    MergeConflict is raised and bb is left untouched.
+    """
+    merger = _Merger()
+    for partial in partials:
+        merger.add(partial)
+    merger.install(bb)
+
+
+# Set before the workers are forked, they inherit it
+_work: Optional[
+    Tuple[List[BuildTarget], BazelBuild, GenerateFunc, Optional[ConfigureFiles]]
+] = None
+
+
+def _genPartial(chunk: Tuple[int, int]) -> PartialBuild:
+    assert _work is not None
+    # What was inherited from the parent is never freed, the collections don't have to
+    # go through it (it also keeps the pages shared with the parent)
+    gc.freeze()
+    topLevels, bb, generate, configureFiles = _work
+    for e in topLevels[chunk[0] : chunk[1]]:
+        generate(e, bb)
+    partial = flattenBuild(bb)
+    if configureFiles is not None:
+        partial.configureMisses = configureFiles.misses
+    return partial
+
+
+def _chunks(count: int, jobs: int) -> List[Tuple[int, int]]:
+    size, extra = divmod(count, jobs)
+    ret = []
+    start = 0
+    for i in range(jobs):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            ret.append((start, end))
+        start = end
+    return ret
+
+
+def genBazelInWorkers(
+    topLevels: List[BuildTarget],
+    bb: BazelBuild,
+    generate: GenerateFunc,
+    jobs: int,
+    configureFiles: Optional[ConfigureFiles] = None,
+) -> bool:
+    """Generate the targets of the sorted top levels with jobs forked workers and merge
+    what they generated into bb (and the configure_file() misses into configureFiles).
+
+    The top levels are split in contiguous ranges, one per worker (a worker that picks
+    a second range generates it on top of the first one, like the serial walk does).
+
+    Returns False without modifying bb when it's not possible (no fork, a worker failed
+    or was killed, the partials don't merge), the caller has to generate the targets
+    serially.
+    """
+    global _work
+    if "fork" not in multiprocessing.get_all_start_methods():
+        logging.warning("Can't fork the workers, generating the targets serially")
+        return False
+    chunks = _chunks(len(topLevels), jobs)
+    _work = (topLevels, bb, generate, configureFiles)
+    try:
+        # A worker that dies (ie. killed by the OOM killer) breaks the pool instead of
+        # leaving the parent waiting for its result
+        with ProcessPoolExecutor(
+            len(chunks), mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            partials = list(executor.map(_genPartial, chunks))
+        mergePartials(bb, partials)
+    except MergeConflict as e:
+        logging.warning(
+            "The workers generated different targets (%s), retrying serially", e
+        )
+        return False
+    except BrokenProcessPool as e:
+        logging.warning("A worker died (%s), retrying serially", e)
+        return False
+    except Exception:
+        logging.exception("Generating the targets in workers failed, retrying serially")
+        return False
+    finally:
+        _work = None
+    if configureFiles is not None:
+        for partial in partials:
+            for output, candidates in partial.configureMisses.items():
+                configureFiles.misses.setdefault(output, candidates)
+    logging.info(
+        "Generated the targets of %s top levels with %s workers",
+        len(topLevels),
+        len(chunks),
+    )
+    return True
@@ -6,12 +6,20 @@ import shutil
 import subprocess
 import sys
 import time
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
-from build import CONFIGURE_FILE_TOOL_PATH
+from bazel import BazelCCImport, TargetRegistry
+from build import CONFIGURE_FILE_TOOL_PATH, BuildTarget
 from cc_import_parse import parseCCImports
 from configure_file import parse_configure_files_list, parse_configure_vars
+from helpers import defaultCacheDir
+from includescanner import MacroTable
+from logutils import Lazy, configureLogging
 from ninjabuild import genBazelBuildFiles, getBuildTargets
+from ninjatools import loadRecordedDeps
+from profiling import PROFILE_MODES, phase, runProfiled
+from protoparser import ProtoGraph
+from visitor import VisitorContext
 
 
 def parse_manually_generated(manually_generated: List[str]) -> Dict[str, str]:
@@ -126,44 +134,30 @@ def _add_needed_configure_output(outputs: Set[str], path: Optional[str], binary_
         outputs.add(f"pregenerated/{normalized}")
 
 
-def collect_needed_configure_outputs(top_levels: List[object], binary_dir: str) -> Set[str]:
+def collect_needed_configure_outputs(top_levels: List[BuildTarget], binary_dir: str) -> Set[str]:
     outputs: Set[str] = set()
-    seen: Set[str] = set()
-
-    def visit(target: object) -> None:
-        name = getattr(target, "name", None)
-        if name in seen:
-            return
-        if name is not None:
-            seen.add(name)
-            _add_needed_configure_output(outputs, name, binary_dir)
-        _add_needed_configure_output(outputs, getattr(target, "shortName", None), binary_dir)
-
-        for include, include_dir in getattr(target, "includes", set()):
+    seen: Set[BuildTarget] = set()
+
+    def visitor(target: BuildTarget, ctx: VisitorContext, _var: bool = False) -> bool:
+        # Shared across the top levels, returning False skips the already visited subgraph
+        if target in seen:
+            return False
+        seen.add(target)
+        _add_needed_configure_output(outputs, target.name, binary_dir)
+        _add_needed_configure_output(outputs, target.shortName, binary_dir)
+
+        for include, include_dir in target.includes:
             _add_needed_configure_output(outputs, include, binary_dir)
             if include_dir is not None:
                 _add_needed_configure_output(outputs, os.path.join(include_dir, include), binary_dir)
-
-        build = getattr(target, "producedby", None)
-        if build is None:
-            return
-        for dep in build.getInputs():
-            visit(dep)
-        for dep in build.depends:
-            if dep.depsAreVirtual():
-                continue
-            visit(dep)
+        return True
 
     for top_level in top_levels:
-        visit(top_level)
+        top_level.visitGraph(visitor, VisitorContext(False))
     return outputs
 
 
-def main(argv=None):
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(name)s - %(levelname)s - %(message)s - Line: %(lineno)d",
-    )
+def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Process Ninja build input file.")
     parser.add_argument("filename", type=str, help="Ninja build input file")
     parser.add_argument("rootdir", type=str, help="Root directory")
@@ -208,9 +202,164 @@ def main(argv=None):
         action="append",
         help="CMake configure_file variable in the form key=value",
     )
+    parser.add_argument(
+        "--configure_files_batch",
+        action="store_true",
+        help="Render all the configure_file outputs sharing the same value files with a single genrule",
+    )
+    parser.add_argument(
+        "--evaluate-conditionals",
+        action="store_true",
+        help="Skip the #include in #if/#ifdef branches that are dead given the DEFINES/FLAGS of the build "
+        "and the macros predefined by the compiler",
+    )
+    parser.add_argument(
+        "--recorded-deps",
+        metavar="SOURCE",
+        default="auto",
+        help="Take the includes of the sources from the dependencies recorded by a previous build "
+        "instead of scanning them: `auto` (default) reads the .ninja_deps and the depfiles of the "
+        "build directory if it was built, `ninja` runs `ninja -t deps` in it, `none` scans everything, "
+        "otherwise it's a .ninja_deps or a file with the output of `ninja -t deps`",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Generate the Bazel targets of the top level targets with that many worker processes, "
+        "0 for one per CPU",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Where the parsed imports and the imports of the protos are cached between runs, "
+        "`none` disables the cache "
+        "(default: $XDG_CACHE_HOME/ninja2bazel or ~/.cache/ninja2bazel)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the conversion with cProfile or tracemalloc, collapsed stacks are also written",
+    )
+    parser.add_argument(
+        "--profile-output",
+        default="ninja2bazel-profile",
+        help="Prefix of the files written when --profile is used",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Log more, -v enables the per-file/per-target DEBUG messages",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="count",
+        default=0,
+        help="Log less, -q only shows warnings, -qq only errors",
+    )
+    parser.add_argument(
+        "--server",
+        metavar="SOCKET",
+        help="Ask the daemon listening on SOCKET (see `parser.py serve`) to do the conversion",
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        metavar="LABEL=NINJA_FILE",
+        help="Convert the ninja file of another configuration and select() what differs on LABEL, "
+        "the positional ninja file is then given as LABEL=NINJA_FILE too",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and rewrite the impacted BUILD files when an input or a scanned file changes",
+    )
+    return parser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] == "serve":
+        import daemon
+
+        return daemon.main(argv[1:])
+
+    args = build_arg_parser().parse_args(argv)
+    configureLogging(args.verbose, args.quiet)
+    if args.config and (args.server or args.watch):
+        logging.fatal("--config can't be used with --server or --watch")
+        sys.exit(-1)
+    if args.server:
+        import daemon
+
+        return daemon.requestConversion(args.server, argv)
+    if args.watch:
+        import watch
+
+        try:
+            return watch.watch(argv, os.getcwd())
+        except KeyboardInterrupt:
+            return None
+    if args.profile:
+        return runProfiled(args.profile, args.profile_output, _run, args)
+    return _run(args)
+
+
+def cache_dir(args: argparse.Namespace) -> Optional[str]:
+    """The directory of the caches kept between runs, None if they are disabled."""
+    if args.cache_dir == "none":
+        return None
+    return args.cache_dir or defaultCacheDir()
+
+
+class ConversionState:
+    """What a conversion needs that doesn't come from the ninja graph.
+
+    A one shot conversion computes everything, the daemon keeps it between requests.
+    """
+
+    def compiler_includes(self) -> List[str]:
+        return getCompilerIncludesDir()
 
-    args = parser.parse_args(argv)
+    def predefined_macros(self) -> Optional[MacroTable]:
+        return getCompilerPredefinedMacros()
 
+    def cc_imports(
+        self, raw_imports: List[str], location: str, cache_dir: Optional[str]
+    ) -> List[BazelCCImport]:
+        if len(raw_imports) == 0:
+            return []
+        return parseCCImports(
+            raw_imports, location, os.path.join(cache_dir, "cc_imports") if cache_dir else None
+        )
+
+    def proto_graph(self, cache_dir: Optional[str]) -> ProtoGraph:
+        return ProtoGraph(os.path.join(cache_dir, "proto_imports.json") if cache_dir else None)
+
+
+def _run(args: argparse.Namespace):
+    if args.config:
+        import multiconfig
+
+        configs = multiconfig.parseConfigs([args.filename, *args.config])
+        output, rootdir = multiconfig.convertConfigs(args, configs)
+    else:
+        output, rootdir = convert(args)
+    write_build_files(output, rootdir, args.post_treatment)
+
+
+def convert(
+    args: argparse.Namespace, state: Optional[ConversionState] = None
+) -> Tuple[Dict[str, str], str]:
+    """Convert the ninja file of args, return the content of the BUILD files and the rootdir."""
+    if state is None:
+        state = ConversionState()
     filename = args.filename
     rootdir = args.rootdir
     manually_generated = parse_manually_generated(args.manually_generated)
@@ -243,13 +392,16 @@ def main(argv=None):
                 raw_imports.extend(f.readlines())
 
     start = time.time()
-    cc_imports = parseCCImports(raw_imports, location)
+    cc_imports = state.cc_imports(raw_imports, location, cache_dir(args))
     end = time.time()
     print(f"Time to parse cc_imports: {end - start}", file=sys.stdout)
     start = time.time()
-    compilerIncludes = getCompilerIncludesDir()
+    compilerIncludes = state.compiler_includes()
     end = time.time()
     print(f"Time to getCompilerIncludes: {end - start}", file=sys.stdout)
+    predefinedMacros = None
+    if args.evaluate_conditionals:
+        predefinedMacros = state.predefined_macros()
     start = time.time()
 
     prefix = ""
@@ -273,18 +425,31 @@ def main(argv=None):
             (fromPath, toPath) = e.split("=")
             remap[fromPath] = toPath
 
-    top_levels_targets = getBuildTargets(
-        raw_ninja,
-        cur_dir,
-        filename,
-        manually_generated,
-        rootdir,
-        prefix,
-        remap,
-        cc_imports,
-        compilerIncludes,
-        args.top_level_target or ["all"],
-    )
+    recorded_deps = None
+    if args.recorded_deps != "none":
+        recorded_deps = loadRecordedDeps(args.recorded_deps, cur_dir)
+
+    # Shared by the parsing and the generation so that a target is created only once
+    registry = TargetRegistry()
+    proto_graph = state.proto_graph(cache_dir(args))
+    with phase("getBuildTargets"):
+        top_levels_targets = getBuildTargets(
+            raw_ninja,
+            cur_dir,
+            filename,
+            manually_generated,
+            rootdir,
+            prefix,
+            remap,
+            cc_imports,
+            compilerIncludes,
+            args.top_level_target or ["all"],
+            predefinedMacros,
+            registry,
+            recorded_deps,
+            proto_graph,
+        )
+    proto_graph.save()
     end = time.time()
     print(f"Time to getBuildTargets: {end - start}", file=sys.stdout)
     start = time.time()
@@ -307,28 +472,47 @@ def main(argv=None):
     if configure_files:
         install_configure_file_tool(rootdir, args.prefix)
     logging.info("Generating Bazel BUILD files from buildTargets")
-    logging.info(f"There are {len(top_levels_targets)} top level targets")
+    logging.info("There are %s top level targets", len(top_levels_targets))
 
-    output = genBazelBuildFiles(
-        top_levels_targets,
-        rootdir,
-        prefix,
-        BUILD_CUSTOMIZATION_DIRECTORY,
-        configure_files,
-        cur_dir,
-    )
+    with phase("genBazelBuildFiles"):
+        output = genBazelBuildFiles(
+            top_levels_targets,
+            rootdir,
+            prefix,
+            BUILD_CUSTOMIZATION_DIRECTORY,
+            configure_files,
+            cur_dir,
+            args.configure_files_batch,
+            registry,
+            args.jobs or os.cpu_count() or 1,
+        )
     end = time.time()
     print(f"Time to generate Bazel's BUILD files: {end - start}", file=sys.stdout)
+    if configure_files.misses:
+        logging.info("%s", Lazy(configure_files.missReport, cur_dir))
     logging.info("Done")
+    return output, rootdir
+
+
+def build_file_path(rootdir: str, name: str) -> str:
+    return f"{rootdir}{name}{os.path.sep}BUILD.bazel"
+
+
+def write_build_files(
+    output: Dict[str, str], rootdir: str, post_treatments: Optional[List[str]]
+) -> List[str]:
+    written = []
     for name, content in output.items():
         if len(content) > 1:
             logging.info(
-                f"Wrote {rootdir}{name}{os.path.sep}BUILD.bazel len = {len(content)}"
+                "Wrote %s%s%sBUILD.bazel len = %s", rootdir, name, os.path.sep, len(content)
             )
-            build_file = f"{rootdir}{name}{os.path.sep}BUILD.bazel"
+            build_file = build_file_path(rootdir, name)
             with open(build_file, "w") as f:
                 f.write(content)
-            run_post_treatments(build_file, args.post_treatment)
+            run_post_treatments(build_file, post_treatments)
+            written.append(build_file)
+    return written
 
 
 def getCompilerIncludesDir(compiler: str = "clang++") -> List[str]:
@@ -340,5 +524,20 @@ def getCompilerIncludesDir(compiler: str = "clang++") -> List[str]:
     return ret
 
 
+def getCompilerPredefinedMacros(compiler: str = "clang++") -> Optional[MacroTable]:
+    # Without them the platform macros can't be told apart from the ones coming from the
+    # code, None disables the evaluation of the conditionals
+    cmd = [compiler, "-dM", "-E", "-x", "c++", "-"]
+    try:
+        result = subprocess.run(cmd, input="", capture_output=True, text=True)
+    except OSError as e:
+        logging.warning("Can't get the predefined macros of %s: %s", compiler, e)
+        return None
+    if result.returncode != 0 or not result.stdout:
+        logging.warning("Can't get the predefined macros of %s: %s", compiler, result.stderr)
+        return None
+    return MacroTable.fromPredefined(result.stdout)
+
+
 if __name__ == "__main__":
     main()
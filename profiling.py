@@ -0,0 +1,139 @@
+import cProfile
+import contextlib
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# Stack of the phases currently running, the outermost phase comes first
+_phases: List[str] = []
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Mark a phase of the conversion (ie. getBuildTargets) so that the samples taken while it's
+    running are attributed to it in the collapsed stacks.
+    """
+    _phases.append(name)
+    try:
+        yield
+    finally:
+        _phases.pop()
+
+
+def currentPhases() -> Tuple[str, ...]:
+    return tuple(_phases)
+
+
+def _frameName(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Periodically sample the stack of a thread and aggregate the samples as collapsed stacks
+    (the format used by flamegraph.pl and speedscope).
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_SAMPLING_INTERVAL,
+        threadId: Optional[int] = None,
+    ):
+        self.interval = interval
+        self.threadId = threadId if threadId is not None else threading.get_ident()
+        self.samples: Dict[Tuple[str, ...], int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.threadId)
+        if frame is None:
+            return
+        stack: List[str] = []
+        while frame is not None:
+            stack.append(_frameName(frame))
+            frame = frame.f_back
+        stack.reverse()
+        key = tuple(f"phase:{p}" for p in currentPhases()) + tuple(stack)
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="ninja2bazel-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self) -> List[str]:
+        return [
+            f"{';'.join(stack)} {count}" for stack, count in sorted(self.samples.items())
+        ]
+
+    def write(self, filename: str) -> None:
+        with open(filename, "w") as f:
+            for line in self.collapsed():
+                f.write(f"{line}\n")
+
+
+def runProfiled(
+    mode: str,
+    outputPrefix: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    **kwargs: Any,
+) -> Any:
+    """
+    Run fn under the requested profiler, the results are written next to outputPrefix:
+    * <outputPrefix>.pstats (cprofile) or <outputPrefix>.tracemalloc (tracemalloc)
+    * <outputPrefix>.collapsed, collapsed stacks with the phases as root frames
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode {mode}, expected one of {PROFILE_MODES}")
+
+    sampler = StackSampler()
+    profiler = None
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+    else:
+        tracemalloc.start()
+
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        if profiler is not None:
+            profiler.dump_stats(f"{outputPrefix}.pstats")
+            logging.warning(f"Wrote cProfile stats to {outputPrefix}.pstats")
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot.dump(f"{outputPrefix}.tracemalloc")
+            logging.warning(
+                f"Wrote tracemalloc snapshot to {outputPrefix}.tracemalloc, peak = {peak} bytes"
+            )
+        sampler.write(f"{outputPrefix}.collapsed")
+        logging.warning(f"Wrote collapsed stacks to {outputPrefix}.collapsed")
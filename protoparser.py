@@ -1,43 +1,187 @@
+import hashlib
+import json
 import logging
 import os
 import re
-from typing import Dict, List, Tuple
-
-seen = set()
-cache: Dict[str, Dict[str, List[Tuple[str, str]]]] = {}
-
-
-def findProtoIncludes(
-    name: str, includeDirs: List[str]
-) -> Dict[str, List[Tuple[str, str]]]:
-    key = f"{name} {includeDirs}"
-    # There is sometimes loop, as we don't really implement the #pragma once
-    # deal with it
-    if key in cache:
-        return cache[key]
-    if key in seen:
-        return {}
-    seen.add(key)
-    logging.debug(f"Handling findProtoIncludes {name}")
-    with open(name, "r") as f:
-        content = f.readlines()
-    ret: Dict[str, List[Tuple[str, str]]] = {}
-    ret[name] = []
-    for line in content:
-        match = re.match(r'import "(.*)";', line)
-        if match is None:
-            continue
-        if match.group(1).startswith("google/"):
-            ret[name].append((match.group(1), "@"))
-            continue
-        for d in includeDirs:
-            filename = f"{d}{os.path.sep}{match.group(1)}"
-            if os.path.exists(filename):
-                logging.info(f"Found {match.group(1)} in {d}")
-                ret[name].append((filename, d))
-                ret.update(findProtoIncludes(filename, includeDirs))
-                break
-            else:
-                logging.debug(f"Did not find {filename}")
-    cache[key] = ret
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from helpers import writeCacheFile
+from includescanner import Stamp, statStamp
+
+# Bump when the format of the cached imports changes
+_CACHE_VERSION = 1
+_IMPORT_RE = re.compile(r'import "(.*)";')
+_PROTOC_INCLUDE_RE = re.compile(r"-I ([^ ]+)")
+
+# A resolved import: (path, include directory where it was found) or (name, "@") for the
+# well known protos of google/
+ProtoImport = Tuple[str, str]
+ProtoClosure = Dict[str, List[ProtoImport]]
+
+
+@lru_cache(maxsize=None)
+def protocIncludeDirs(command: str) -> Tuple[str, ...]:
+    """The -I directories of the protoc invocations of a COMMAND, without duplicates."""
+    ret: Dict[str, None] = {}
+    for part in command.split("&&"):
+        if "/protoc" in part:
+            ret.update(dict.fromkeys(_PROTOC_INCLUDE_RE.findall(part)))
+    return tuple(ret)
+
+
+def scanProtoImports(content: str) -> List[str]:
+    ret = []
+    for line in content.splitlines():
+        match = _IMPORT_RE.match(line)
+        if match is not None:
+            ret.append(match.group(1))
     return ret
+
+
+class ProtoGraph:
+    """The import graph of the .proto files.
+
+    Each file is scanned once (the imports are also kept in cacheFile, keyed by the hash
+    of the content), an import is resolved once per set of include directories and the
+    closures are walked on the resolved edges.
+    """
+
+    def __init__(self, cacheFile: Optional[str] = None):
+        self.cacheFile = cacheFile
+        self._cachedImports: Optional[Dict[str, List[str]]] = None
+        # The digests of the files scanned, only them are saved
+        self._usedDigests: Set[str] = set()
+        self._dirty = False
+        self._imports: Dict[str, Tuple[Stamp, List[str]]] = {}
+        # Interned include directories, the keys below use their index
+        self._dirSets: Dict[Tuple[str, ...], int] = {}
+        self._resolved: Dict[Tuple[int, str], Optional[ProtoImport]] = {}
+        self._edges: Dict[Tuple[int, str], List[ProtoImport]] = {}
+        self._closures: Dict[Tuple[int, str], ProtoClosure] = {}
+
+    def reset(self):
+        """Forget what depends on the tree, the files are rescanned only if they changed."""
+        self._resolved.clear()
+        self._edges.clear()
+        self._closures.clear()
+
+    def _diskImports(self) -> Dict[str, List[str]]:
+        if self._cachedImports is None:
+            self._cachedImports = {}
+            if self.cacheFile is not None:
+                try:
+                    with open(self.cacheFile, "r") as f:
+                        cached = json.load(f)
+                    if cached.get("version") == _CACHE_VERSION:
+                        self._cachedImports = cached["imports"]
+                except (OSError, ValueError, KeyError, AttributeError):
+                    pass
+        return self._cachedImports
+
+    def save(self):
+        """Write the imports of the files scanned to cacheFile, the ones of the files that
+        were not scanned are dropped. A failure is not fatal."""
+        if self.cacheFile is None or self._cachedImports is None:
+            return
+        if not self._dirty and len(self._usedDigests) == len(self._cachedImports):
+            return
+        imports = {d: self._cachedImports[d] for d in self._usedDigests}
+        content = json.dumps({"version": _CACHE_VERSION, "imports": imports})
+        if writeCacheFile(self.cacheFile, content):
+            self._cachedImports = imports
+            self._dirty = False
+
+    def imports(self, name: str) -> List[str]:
+        """The names imported by the file name."""
+        stamp = statStamp(name)
+        entry = self._imports.get(name)
+        if entry is not None and stamp is not None and entry[0] == stamp:
+            return entry[1]
+        logging.debug("Scanning the imports of %s", name)
+        with open(name, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+        cached = self._diskImports()
+        self._usedDigests.add(digest)
+        imports = cached.get(digest)
+        if imports is None:
+            imports = scanProtoImports(raw.decode("utf-8", "surrogateescape"))
+            cached[digest] = imports
+            self._dirty = True
+        self._imports[name] = (stamp, imports)
+        return imports
+
+    def stamps(self) -> Dict[str, Stamp]:
+        """The stamp of the files when they were scanned."""
+        return {name: entry[0] for name, entry in self._imports.items()}
+
+    def _dirSet(self, includeDirs: List[str]) -> int:
+        key = tuple(includeDirs)
+        ret = self._dirSets.get(key)
+        if ret is None:
+            ret = self._dirSets[key] = len(self._dirSets)
+        return ret
+
+    def _resolve(
+        self, imported: str, dirSet: int, includeDirs: List[str]
+    ) -> Optional[ProtoImport]:
+        key = (dirSet, imported)
+        if key in self._resolved:
+            return self._resolved[key]
+        ret = None
+        if imported.startswith("google/"):
+            ret = (imported, "@")
+        else:
+            for d in includeDirs:
+                filename = f"{d}{os.path.sep}{imported}"
+                if os.path.exists(filename):
+                    logging.debug("Found %s in %s", imported, d)
+                    ret = (filename, d)
+                    break
+            else:
+                logging.debug("Did not find %s in %s", imported, includeDirs)
+        self._resolved[key] = ret
+        return ret
+
+    def _edgesOf(
+        self, name: str, dirSet: int, includeDirs: List[str]
+    ) -> List[ProtoImport]:
+        key = (dirSet, name)
+        ret = self._edges.get(key)
+        if ret is None:
+            ret = []
+            for imported in self.imports(name):
+                resolved = self._resolve(imported, dirSet, includeDirs)
+                if resolved is not None:
+                    ret.append(resolved)
+            self._edges[key] = ret
+        return ret
+
+    def findProtoIncludes(self, name: str, includeDirs: List[str]) -> ProtoClosure:
+        """The imports of name and of all the files it imports, keyed by file in the
+        order they are first imported. Loops are followed once."""
+        dirSet = self._dirSet(includeDirs)
+        key = (dirSet, name)
+        ret = self._closures.get(key)
+        if ret is not None:
+            return ret
+        ret = {}
+        todo = [name]
+        while todo:
+            current = todo.pop()
+            if current in ret:
+                continue
+            edges = self._edgesOf(current, dirSet, includeDirs)
+            ret[current] = edges
+            todo.extend(reversed([p for p, d in edges if d != "@"]))
+        self._closures[key] = ret
+        return ret
+
+
+# Used when no graph is given, for a single conversion
+graph = ProtoGraph()
+
+
+def findProtoIncludes(name: str, includeDirs: List[str]) -> ProtoClosure:
+    return graph.findProtoIncludes(name, includeDirs)
@@ -13,10 +13,13 @@ from bazel import (
     PyBinaryBazelTarget,
     ShBinaryBazelTarget,
     BazelTarget,
+    BazelTargetSet,
+    TargetRegistry,
     ExportedFile,
     _getPrefix,
     compare_deps,
     compare_imports,
+    depSortKey,
     findCommonPaths,
     globifyPath,
 )
@@ -67,6 +70,44 @@ class TestBazelTarget(unittest.TestCase):
         )
 
 
+class TestBazelTargetSet(unittest.TestCase):
+    def test_indexes(self):
+        a = BazelTarget("cc_library", "a", "src")
+        b = BazelCCProtoLibrary("a", "lib")
+        targets = BazelTargetSet([a])
+        targets |= {b}
+        targets.add(BazelTarget("cc_library", "a", "src"))
+        self.assertEqual(len(targets), 2)
+        self.assertEqual(targets.withName("a"), {a, b})
+        self.assertIs(targets.get("src", "a"), a)
+        self.assertIs(targets.get("lib", "a"), b)
+        targets.discard(BazelTarget("cc_library", "a", "src"))
+        self.assertEqual(targets.withName("a"), {b})
+        self.assertIsNone(targets.get("src", "a"))
+        self.assertEqual(targets.withName("missing"), set())
+
+
+class TestTargetRegistry(unittest.TestCase):
+    def test_registry_is_scoped_to_a_build(self):
+        bb = BazelBuild("src/")
+        lib = bb.registry.getObject(BazelTarget, "cc_library", "lib", "src")
+        self.assertIs(bb.registry.getObject(BazelTarget, "cc_library", "lib", "src"), lib)
+        self.assertIsNot(
+            bb.registry.getObject(BazelTarget, "cc_binary", "lib", "src"), lib
+        )
+        self.assertIsNot(
+            bb.registry.getObject(BazelProtoLibrary, "lib", "src"),
+            bb.registry.getObject(BazelProtoLibrary, "lib", "other"),
+        )
+        self.assertEqual(len(bb.registry), 4)
+        other = BazelBuild("src/")
+        self.assertIsNot(
+            other.registry.getObject(BazelTarget, "cc_library", "lib", "src"), lib
+        )
+        registry = TargetRegistry()
+        self.assertIs(BazelBuild("src/", registry).registry, registry)
+
+
 class TestBazelUtils(unittest.TestCase):
     def test_get_prefix(self):
         t1 = BazelTarget("cc_library", "foo", "src")
@@ -85,6 +126,18 @@ class TestBazelUtils(unittest.TestCase):
             compare_deps(b, a, lambda x: _getPrefix(x, "src", defaultPrefix="foo")), 0
         )
 
+    def test_rendered_label(self):
+        t = BazelTarget("cc_library", "bar", "lib")
+        self.assertEqual(t.renderedLabel("src", "foo"), "//lib:bar")
+        self.assertEqual(t.renderedLabel("lib", "foo"), ":bar")
+        t.location = "other"
+        self.assertEqual(t.renderedLabel("src", "foo"), "//other:bar")
+        labels = ["//lib:bar", "@ext//:ext", ":foo", "//a:b", ":bar"]
+        self.assertEqual(
+            sorted(labels, key=depSortKey),
+            [":bar", ":foo", "@ext//:ext", "//a:b", "//lib:bar"],
+        )
+
     def test_compare_imports(self):
         self.assertEqual(compare_imports('load("@a//:foo")', 'load("@a//:foo")'), 0)
         self.assertLess(compare_imports('load("@a//:foo")', 'load("@b//:bar")'), 0)
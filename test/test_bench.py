@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from bench.run import PHASES, compareToBaseline, runPhases
+from bench.synthetic import SyntheticProject, generateProject
+
+
+class TestBench(unittest.TestCase):
+    def test_generated_project_converts(self) -> None:
+        project = SyntheticProject(
+            libraries=3, sources=2, generatorEvery=0, protoEvery=2, configureEvery=2, appEvery=2
+        )
+        with tempfile.TemporaryDirectory() as td:
+            generated = generateProject(project, td)
+            self.assertTrue(os.path.exists(generated.ninjaFile))
+            # 6 compilations, 3 archives, 2 protoc, 2 pb.cc, 2 apps with their main
+            self.assertEqual(generated.edges, 17)
+            # Keep the caches out of the developer's home
+            env = {"HOME": td, "XDG_CACHE_HOME": f"{td}/cache"}
+            with mock.patch.dict(os.environ, env):
+                results = runPhases(
+                    generated.srcDir, generated.ninjaFile, generated.configureFilesList
+                )
+        for p in PHASES:
+            self.assertIn("seconds", results[p])
+            self.assertGreater(results[p]["peak_rss"], 0)
+        # 3 libraries and 2 apps
+        self.assertEqual(results["output"]["top_levels"], 5)
+
+    def test_compare_to_baseline(self) -> None:
+        baseline = {"1k": {p: {"seconds": 1.0, "peak_rss": 100} for p in PHASES}}
+        results = {"1k": {p: {"seconds": 1.1, "peak_rss": 100} for p in PHASES}}
+        self.assertEqual(compareToBaseline(results, baseline, 1.5), [])
+        results["1k"]["parse"]["seconds"] = 2.0
+        regressions = compareToBaseline(results, baseline, 1.5)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("1k parse seconds"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,9 +6,18 @@ from pathlib import Path
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from bazel import BazelCCImport, BazelGenRuleTarget
-from bazel import BazelTarget, BazelBuild, getObject, bazelcache
-from build import BazelBuildVisitorContext, Build, BuildTarget, Rule
+from bazel import BazelTarget, BazelBuild
+from build import (
+    BazelBuildVisitorContext,
+    Build,
+    BuildTarget,
+    Rule,
+    VirtualReason,
+    classifyVirtualTargets,
+    virtualTargetsReport,
+)
 from ninjabuild import canBePruned
+from visitor import VisitorContext
 
 
 class TestBuildTargetBasics(unittest.TestCase):
@@ -87,6 +96,90 @@ class TestBuildTargetVirtualDeps(unittest.TestCase):
         ext = BuildTarget("ext", ("ext", None)).markAsExternal()
         self.assertFalse(ext.depsAreVirtual())
 
+    def test_classify_virtual_targets_stores_reason(self) -> None:
+        empty = BuildTarget("empty", ("empty", None))
+        Build([empty], Rule("phony"), [], [])
+        src = BuildTarget("src", ("src", None)).markAsFile()
+        ctest = BuildTarget("test", ("test", None))
+        Build([ctest], Rule("phony"), [src], []).vars["COMMAND"] = "/usr/bin/ctest -j4"
+        out1 = BuildTarget("out1", ("out1", None))
+        Build([out1], Rule("cc"), [], [empty])
+        out2 = BuildTarget("out2", ("out2", None))
+        Build([out2], Rule("cc"), [], [ctest])
+        real = BuildTarget("real", ("real", None))
+        Build([real], Rule("cc"), [src], [])
+        out3 = BuildTarget("out3", ("out3", None))
+        Build([out3], Rule("cc"), [], [real, empty])
+
+        targets = [empty, src, ctest, out1, out2, real, out3]
+        classifyVirtualTargets(targets)
+        self.assertEqual(out1.virtual, (True, VirtualReason.empty_phony, empty))
+        self.assertEqual(out2.virtual, (True, VirtualReason.ctest, ctest))
+        # real comes first and isn't virtual
+        self.assertFalse(out3.depsAreVirtual())
+        self.assertEqual(
+            virtualTargetsReport(targets),
+            "  out1: empty phony (empty)\n  out2: ctest (test)",
+        )
+
+
+class TestBuildTargetVisitGraph(unittest.TestCase):
+    def _diamond(self):
+        # top <- a, b ; a <- shared ; b <- shared
+        shared = BuildTarget("shared", ("shared", None)).markAsFile()
+        a = BuildTarget("a", ("a", None))
+        Build([a], Rule("cc"), [shared], [])
+        b = BuildTarget("b", ("b", None))
+        Build([b], Rule("cc"), [shared], [])
+        top = BuildTarget("top", ("top", None))
+        Build([top], Rule("cc"), [b, a], [])
+        return top
+
+    def test_visit_order_and_cleanup(self) -> None:
+        events = []
+
+        class Ctx(VisitorContext):
+            def setup_subcontext(self):
+                newCtx = Ctx(self.parentIsPhony)
+                newCtx.producer = self.producer
+                return newCtx
+
+            def cleanup(self):
+                events.append("cleanup")
+
+        def visitor(el, ctx, _var=False):
+            events.append(el.name)
+            return True
+
+        self._diamond().visitGraph(visitor, Ctx(False))
+        self.assertEqual(
+            events,
+            ["top", "a", "shared", "cleanup", "cleanup"]
+            + ["b", "shared", "cleanup", "cleanup", "cleanup"],
+        )
+
+    def test_visit_once(self) -> None:
+        seen = []
+
+        def visitor(el, ctx, _var=False):
+            seen.append(el.name)
+            return True
+
+        self._diamond().visitGraph(visitor, VisitorContext(False), visitOnce=True)
+        self.assertEqual(seen, ["top", "a", "shared", "b"])
+
+    def test_deep_graph_does_not_recurse(self) -> None:
+        previous = BuildTarget("leaf", ("leaf", None)).markAsFile()
+        for i in range(sys.getrecursionlimit() * 2):
+            t = BuildTarget(f"t{i}", (f"t{i}", None))
+            Build([t], Rule("cc"), [previous], [])
+            previous = t
+        count = []
+        previous.visitGraph(
+            lambda el, ctx, _v=False: count.append(el) or True, VisitorContext(False)
+        )
+        self.assertEqual(len(count), sys.getrecursionlimit() * 2 + 1)
+
 
 class TestBuildUtils(unittest.TestCase):
     def test_handle_cpp_compile_command_filters_flags_and_defines(self) -> None:
@@ -275,9 +368,6 @@ class TestBuildFeatures(unittest.TestCase):
         self.assertIn(generated_src, lib.srcs)
         self.assertNotIn(generated_src, lib.data)
 
-    def setUp(self) -> None:
-        bazelcache.clear()
-
     def _make_ctx(self):
         bb = BazelBuild(prefix="")
         ctx = BazelBuildVisitorContext(False, "", bb, [], prefix="")
@@ -300,7 +390,7 @@ class TestBuildFeatures(unittest.TestCase):
         self.assertEqual(dep.type, "cc_library")
         self.assertIn(dep, bb.bazelTargets)
 
-        shared = getObject(
+        shared = bb.registry.getObject(
             BazelTarget, "cc_shared_library", "shared_libfoo", dep.location
         )
         self.assertEqual(shared.type, "cc_shared_library")
@@ -338,9 +428,6 @@ class TestBuildFeatures(unittest.TestCase):
 
 
 class TestBuildProtoAndLinkHandling(unittest.TestCase):
-    def setUp(self) -> None:
-        bazelcache.clear()
-
     def _ctx(self) -> BazelBuildVisitorContext:
         bb = BazelBuild("")
         ctx = BazelBuildVisitorContext(False, "/src", bb, [], prefix="")
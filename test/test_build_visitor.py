@@ -1,14 +1,11 @@
 import unittest
 
-from bazel import BazelBuild, BazelTarget, bazelcache
+from bazel import BazelBuild, BazelTarget
 from build import BazelBuildVisitorContext, Build, BuildTarget, Rule
 from build_visitor import BuildVisitor
 
 
 class TestBuildVisitorPaths(unittest.TestCase):
-    def setUp(self) -> None:
-        bazelcache.clear()
-
     def test_visitor_handles_alias(self) -> None:
         bb = BazelBuild("")
         ctx = BazelBuildVisitorContext(False, "/root", bb, [], prefix="")
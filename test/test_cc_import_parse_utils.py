@@ -1,7 +1,11 @@
 import os
 import tempfile
 import unittest
+from unittest import mock
+
+import cc_import_parse
 from cc_import_parse import cleanupVar, match_glob, parse_glob, parseCCImports
+from lazyglob import HeaderSet
 
 class TestCCImportParseUtils(unittest.TestCase):
     def test_cleanup_var(self):
@@ -37,5 +41,77 @@ class TestCCImportParseUtils(unittest.TestCase):
         foo = next(i for i in res if i.name == 'foo')
         self.assertTrue(any(d.name == 'dep' for d in foo.deps))
 
+    def test_parse_cc_imports_starlark(self):
+        content = """
+# System libraries
+cc_import(
+    name = "foo",
+    interface_library = "/usr/lib/libfoo.so",
+    hdrs = [
+        "/usr/include/foo.h",  # the main header
+        "/usr/include/foo_config.h",
+    ] + glob(["/usr/include/foo/**/*.h", "/usr/include/foo/*.inc"]),
+    deps = [":dep"],
+    system_provided = 1,
+    skip_wrapping = True,
+)
+
+cc_import(name = "dep", static_library = "/usr/lib/libdep.a")
+"""
+        lines = content.splitlines(keepends=True)
+        with mock.patch.object(cc_import_parse, '_parseCCImportsLines') as legacy:
+            res = {imp.name: imp for imp in parseCCImports(lines, 'src')}
+            legacy.assert_not_called()
+        foo = res['foo']
+        self.assertIsInstance(foo.hdrs, HeaderSet)
+        self.assertIn('/usr/include/foo_config.h', foo.hdrs)
+        self.assertIn('/usr/include/foo/bar/baz.h', foo.hdrs)
+        self.assertIn('/usr/include/foo/x.inc', foo.hdrs)
+        self.assertNotIn('/usr/include/foo/bar/x.inc', foo.hdrs)
+        self.assertEqual(foo.sharedLibrary, '/usr/lib/libfoo.so')
+        self.assertTrue(foo.skipWrapping)
+        self.assertEqual(foo.deps, {res['dep']})
+        self.assertEqual(res['dep'].staticLibrary, '/usr/lib/libdep.a')
+
+    def test_parse_cc_imports_unsupported_expression(self):
+        content = """
+cc_import(
+    name = "foo",
+    hdrs = glob(["/usr/include/foo/*.h"], exclude = ["/usr/include/foo/x.h"]),
+    static_library = "/usr/lib/libfoo.a",
+)
+"""
+        lines = content.splitlines(keepends=True)
+        with mock.patch.object(
+            cc_import_parse, '_parseCCImportsLines', wraps=cc_import_parse._parseCCImportsLines
+        ) as legacy:
+            res = parseCCImports(lines, 'src')
+            legacy.assert_called_once()
+        self.assertEqual([i.name for i in res], ['foo'])
+        self.assertEqual(res[0].staticLibrary, '/usr/lib/libfoo.a')
+
+    def test_parse_cc_imports_cache(self):
+        lines = ['cc_import(\n', '    name = "foo",\n', '    hdrs = ["foo.h"],\n', ')\n']
+        with tempfile.TemporaryDirectory() as td:
+            res = parseCCImports(lines, 'src', td)
+            self.assertEqual(len(os.listdir(td)), 1)
+            with mock.patch.object(cc_import_parse, 'parseStanzas') as parse:
+                cached = parseCCImports(lines, 'src', td)
+                parse.assert_not_called()
+            self.assertEqual([i.name for i in cached], [i.name for i in res])
+            self.assertEqual(list(cached[0].hdrs), ['foo.h'])
+            # A different content is a different entry
+            parseCCImports(lines[:2] + lines[3:], 'src', td)
+            self.assertEqual(len(os.listdir(td)), 2)
+
+    def test_parse_cc_imports_unwritable_cache(self):
+        lines = ['cc_import(\n', '    name = "foo",\n', ')\n']
+        with tempfile.TemporaryDirectory() as td:
+            notADir = os.path.join(td, 'file')
+            with open(notADir, 'w'):
+                pass
+            res = parseCCImports(lines, 'src', os.path.join(notADir, 'cc_imports'))
+            self.assertEqual([i.name for i in res], ['foo'])
+
 if __name__ == '__main__':
     unittest.main()
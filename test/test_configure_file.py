@@ -7,7 +7,14 @@ from pathlib import Path
 
 from bazel import BazelBuild, BazelGenRuleTarget, BazelTarget
 from build import BazelBuildVisitorContext, Build, BuildTarget, TopLevelGroupingStrategy
-from configure_file import find_configure_file, parse_configure_files_list, parse_configure_vars
+from configure_file import (
+    ConfigureFile,
+    ConfigureFiles,
+    _index_value_definitions,
+    find_configure_file,
+    parse_configure_files_list,
+    parse_configure_vars,
+)
 
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,6 +46,26 @@ class TestConfigureFile(unittest.TestCase):
         self.assertIn("/flow/", entry.source.replace(os.path.sep, "/"))
         self.assertEqual(len(entry.value_files), 1)
 
+    def test_index_value_definitions(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a").mkdir()
+            (root / "a" / "CMakeLists.txt").write_text(
+                'set(VERSION "1")\nenv_set(NAME foo)\nset(VERSION_MAJOR 1)\nunset(OTHER)\n'
+            )
+            (root / "b.cmake").write_text("  set (  VERSION)\nmyset(IGNORED 1)\n")
+            (root / "ignored.cc").write_text('set(VERSION "2")\n')
+            index = _index_value_definitions(str(root))
+
+        self.assertEqual(
+            {k: sorted(Path(p).name for p in v) for k, v in index.items()},
+            {
+                "VERSION": ["CMakeLists.txt", "b.cmake"],
+                "NAME": ["CMakeLists.txt"],
+                "VERSION_MAJOR": ["CMakeLists.txt"],
+            },
+        )
+
     def test_parse_configure_files_list_fails_for_missing_placeholder(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             root = Path(td) / "src"
@@ -202,6 +229,32 @@ class TestConfigureFile(unittest.TestCase):
             )
         )
 
+    def test_configure_files_suffix_match(self) -> None:
+        entry_a = ConfigureFile("a.h.cmake", "/b/flow/include/a.h", (), {})
+        entry_b = ConfigureFile("b.h.cmake", "/b/other/include/a.h", (), {})
+        configure_files = ConfigureFiles()
+        configure_files["/b/flow/include/a.h"] = entry_a
+        configure_files["flow/include/a.h"] = entry_a
+        configure_files["other/include/a.h"] = entry_b
+
+        self.assertIs(find_configure_file(configure_files, "include/a.h", "/b"), entry_a)
+        self.assertIs(
+            find_configure_file(configure_files, "pregenerated/other/include/a.h", "/x"),
+            entry_b,
+        )
+        # The candidate ends with a key
+        self.assertIs(
+            find_configure_file(configure_files, "/elsewhere/other/include/a.h", "/x"),
+            entry_b,
+        )
+        # Suffixes are aligned on path components
+        self.assertIsNone(find_configure_file(configure_files, "clude/a.h", "/x"))
+        self.assertIsNone(find_configure_file(configure_files, "pregenerated/nope.h", "/x"))
+        self.assertEqual(sorted(configure_files.misses), ["clude/a.h", "pregenerated/nope.h"])
+        report = configure_files.missReport("/b")
+        self.assertTrue(report.startswith("2 pregenerated file(s) didn't match any of the 2"))
+        self.assertIn("pregenerated/nope.h", report)
+
     def test_render_configure_file_uses_multiple_value_files(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             template = Path(td) / "config.h.cmake"
@@ -245,6 +298,37 @@ class TestConfigureFile(unittest.TestCase):
                 "#define A from-cli\n#define B from-file\n",
             )
 
+    def test_render_configure_file_batch_renders_several_templates(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            template_a = Path(td) / "a.h.cmake"
+            template_b = Path(td) / "b.h.cmake"
+            values = Path(td) / "values.cmake"
+            output_a = Path(td) / "out" / "a.h"
+            output_b = Path(td) / "out" / "sub" / "b.h"
+            template_a.write_text("#define A @A@\n")
+            template_b.write_text("#define B ${B}\n")
+            values.write_text("set(A one)\nset(B two)\n")
+
+            subprocess.run(
+                [
+                    sys.executable,
+                    RENDERER,
+                    "--render",
+                    str(template_a),
+                    str(output_a),
+                    "--render",
+                    str(template_b),
+                    str(output_b),
+                    str(values),
+                    "--var",
+                    "B=cli",
+                ],
+                check=True,
+            )
+
+            self.assertEqual(output_a.read_text(), "#define A one\n")
+            self.assertEqual(output_b.read_text(), "#define B cli\n")
+
     def test_render_configure_file_handles_cmakedefine(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             template = Path(td) / "config.h.cmake"
@@ -391,3 +475,63 @@ class TestConfigureFile(unittest.TestCase):
         self.assertIn("--var CLI_VALUE=abc", content)
         self.assertIn(":pregenerated/include/flow/ProtocolVersion.h", content)
         self.assertTrue(any(isinstance(target, BazelGenRuleTarget) for target in bb.bazelTargets))
+
+    def test_configure_files_batch_gets_one_genrule_per_value_files(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td) / "src"
+            build_dir = Path(td) / "build"
+            pregenerated = build_dir / "pregenerated" / "include" / "batch"
+            root.mkdir()
+            pregenerated.mkdir(parents=True)
+            (root / "Version.h.cmake").write_text("#define V @VERSION@\n")
+            (root / "Features.h.cmake").write_text("#cmakedefine HAS_FEATURE\n")
+            (root / "BatchValues.cmake").write_text("set(VERSION 1)\nset(HAS_FEATURE ON)\n")
+            list_file = Path(td) / "configure_files.txt"
+            list_file.write_text(
+                "configure_file(${CMAKE_CURRENT_SOURCE_DIR}/Version.h.cmake "
+                "${CMAKE_CURRENT_BINARY_DIR}/include/batch/Version.h)\n"
+                "configure_file(${CMAKE_CURRENT_SOURCE_DIR}/Features.h.cmake "
+                "${CMAKE_CURRENT_BINARY_DIR}/include/batch/Features.h)\n"
+            )
+            configure_files = parse_configure_files_list(
+                str(list_file), str(root), str(build_dir), {}
+            )
+            TopLevelGroupingStrategy("")
+            bb = BazelBuild("")
+            current = BazelTarget("cc_library", "batch", ".")
+            ctx = BazelBuildVisitorContext(
+                False,
+                f"{root}{os.path.sep}",
+                bb,
+                [],
+                current=current,
+                prefix=".",
+                configure_files=configure_files,
+                configure_binary_dir=str(build_dir),
+                configure_files_batch=True,
+            )
+            el = BuildTarget("batch.cc", ("batch.cc", "."))
+            el.setIncludedFiles(
+                [
+                    ("include/batch/Version.h", str(pregenerated.parent.parent)),
+                    ("include/batch/Features.h", str(pregenerated.parent.parent)),
+                ]
+            )
+
+            Build._handleIncludeBazelTarget(el, ctx, f"{build_dir}{os.path.sep}")
+            bb.bazelTargets.add(current)
+            content = bb.genBazelBuildContent()["."]
+
+        self.assertEqual(content.count("genrule("), 1)
+        self.assertIn('name = "configure_files_BatchValues_cmake"', content)
+        self.assertIn('":pregenerated/include/batch/Version.h"', content)
+        self.assertIn('":pregenerated/include/batch/Features.h"', content)
+        self.assertIn(
+            "$(location :render_configure_file) "
+            "--render $(location Features.h.cmake) "
+            "$(location pregenerated/include/batch/Features.h) "
+            "--render $(location Version.h.cmake) "
+            "$(location pregenerated/include/batch/Version.h) "
+            "$(location BatchValues.cmake)",
+            content,
+        )
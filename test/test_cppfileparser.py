@@ -5,13 +5,16 @@ from pathlib import Path
 from bazel import BazelCCImport
 from build import BuildTarget
 from cppfileparser import (
+    IncludeDirKind,
     _findCPPIncludeForFile,
     _findCPPIncludeForFileSameDir,
     cache as cpp_cache,
     findAllHeaderFiles,
     findCPPIncludes,
+    includeResolverForDirs,
+    includeResolverForFlags,
+    includesFromRecordedDeps,
     parseIncludes,
-    seen as cpp_seen,
 )
 from helpers import resolvePath
 
@@ -32,6 +35,35 @@ class TestParseIncludes(unittest.TestCase):
         self.assertEqual(parseIncludes(""), [])
 
 
+class TestIncludeResolver(unittest.TestCase):
+    def test_resolvers_are_interned(self):
+        first = includeResolverForFlags("-Ifoo -I/work/gen", "/work")
+        second = includeResolverForFlags("-Ifoo -I/work/gen", "/work")
+        self.assertIs(first, second)
+        self.assertIs(first, includeResolverForDirs(["foo", "/generated/gen"]))
+        self.assertIsNot(first, includeResolverForFlags("-Ifoo", "/work"))
+
+    def test_dirs_are_classified(self):
+        resolver = includeResolverForFlags(
+            "-Ifoo -I/abs -I/work -I/work/gen", "/work", "/tmp/top"
+        )
+        self.assertEqual(
+            resolver.dirs,
+            ("foo", "/abs", "/tmp/top", "/work", "/tmp/top/gen", "/generatedgen"),
+        )
+        self.assertEqual(
+            [(e.kind, e.prefix) for e in resolver.entries],
+            [
+                (IncludeDirKind.relative, "/foo/"),
+                (IncludeDirKind.absolute, "/abs/"),
+                (IncludeDirKind.absolute, "/tmp/top/"),
+                (IncludeDirKind.absolute, "/work/"),
+                (IncludeDirKind.absolute, "/tmp/top/gen/"),
+                (IncludeDirKind.generated, "gen/"),
+            ],
+        )
+
+
 class TestCPPFileParser(unittest.TestCase):
     def test_find_all_header_files(self) -> None:
         with tempfile.TemporaryDirectory() as td:
@@ -132,7 +164,6 @@ class TestCPPFileParser(unittest.TestCase):
 class TestCPPGeneratedHeaders(unittest.TestCase):
     def tearDown(self) -> None:
         cpp_cache.clear()
-        cpp_seen.clear()
 
     def test_generated_header_paths_are_rewritten(self) -> None:
         with tempfile.TemporaryDirectory() as td:
@@ -175,6 +206,29 @@ class TestCPPGeneratedHeaders(unittest.TestCase):
             )
             self.assertIn("nested.h", {h[0] for h in result.neededGeneratedFiles})
 
+    def test_include_cycles_share_their_closure(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "main.cpp").write_text('#include "a.h"\n')
+            (root / "a.h").write_text('#include "b.h"\n#include "a.h"\n')
+            (root / "b.h").write_text('#include "a.h"\n#include "c.h"\n')
+            (root / "c.h").write_text('#include "missing.h"\n')
+
+            main = findCPPIncludes(
+                str(root / "main.cpp"), ["inc"], [], [], {}, srcDir=td
+            )
+            a = cpp_cache[(resolvePath(str(root / "a.h")), None)]
+            b = cpp_cache[(resolvePath(str(root / "b.h")), None)]
+
+            headers = {resolvePath(str(root / h)) for h in ("a.h", "b.h", "c.h")}
+            self.assertEqual({h for h, _ in main.foundHeaders}, headers)
+            # a.h and b.h are in the same cycle, they see each other whatever the
+            # file that was scanned first
+            self.assertEqual(a.foundHeaders, b.foundHeaders)
+            self.assertEqual({h for h, _ in a.foundHeaders}, headers)
+            self.assertEqual(main.notFoundHeaders, {"missing.h"})
+            self.assertIsInstance(a.foundHeaders, frozenset)
+
     def test_not_found_filters_pb_headers_and_uses_cache(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             root = Path(td)
@@ -206,3 +260,87 @@ class TestCPPGeneratedHeaders(unittest.TestCase):
                 td,
             )
             self.assertIs(first, second)
+
+
+class TestIncludesFromRecordedDeps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        self.src = f"{self.td.name}/src"
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def _write(self, name: str, content: str = "") -> str:
+        path = Path(self.src) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        return str(path)
+
+    def test_recorded_deps(self) -> None:
+        src = self.src
+        cc_imp = BazelCCImport("imp")
+        cc_imp.hdrs = ["/usr/include/imp/imp.h"]
+        imp_target = BuildTarget("imp", ("imp", None)).setOpaque(cc_imp)
+        resolver = includeResolverForFlags(
+            f"-I{src}/lib/include -I{src} -I/work/gen/include", "/work/"
+        )
+        source = self._write(
+            "lib/a.cc",
+            '#include "private.h"\n#include <lib/api.h>\n#include "other/o.h"\n',
+        )
+        self._write("lib/private.h")
+        self._write("lib/include/lib/api.h")
+        self._write("other/o.h")
+        result = includesFromRecordedDeps(
+            source,
+            [
+                source,
+                f"{src}/lib/private.h",
+                f"{src}/lib/include/lib/api.h",
+                f"{src}/other/../other/o.h",
+                "gen/include/lib/config.h",
+                "/usr/include/imp/imp.h",
+                "/usr/include/c++/13/string",
+                "/opt/elsewhere/x.h",
+            ],
+            resolver,
+            ["/usr/include/c++/13", "/usr/include"],
+            [imp_target],
+            "/work",
+            f"{src}/",
+        )
+        assert result is not None
+        self.assertEqual(
+            result.foundHeaders,
+            {
+                (f"{src}/lib/private.h", None),
+                # Also in {src}, how it's included tells which one it is
+                (f"{src}/lib/include/lib/api.h", f"{src}/lib/include"),
+                (f"{src}/other/o.h", src),
+            },
+        )
+        self.assertEqual(
+            result.neededGeneratedFiles,
+            {("gen/include/lib/config.h", "/generatedgen/include")},
+        )
+        self.assertEqual(result.neededImports, {imp_target})
+        self.assertEqual(result.notFoundHeaders, frozenset())
+
+    def test_spelling(self) -> None:
+        src = self.src
+        resolver = includeResolverForDirs([f"{src}/sub", src])
+        source = self._write("x/a.cc", '#include "y.h"\n')
+        header = self._write("x/y.h", '#include "sub/foo.h"\n')
+        foo = self._write("sub/foo.h")
+        result = includesFromRecordedDeps(
+            source, [source, header, foo], resolver, [], [], "/work", f"{src}/"
+        )
+        assert result is not None
+        self.assertEqual(result.foundHeaders, {(header, None), (foo, src)})
+        # A computed include, the source has to be scanned
+        self._write("x/y.h", "#include FOO_H\n")
+        self.assertIsNone(
+            includesFromRecordedDeps(
+                source, [source, header, foo], resolver, [], [], "/work", f"{src}/"
+            )
+        )
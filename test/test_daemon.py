@@ -0,0 +1,132 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import includescanner
+from bench.synthetic import SyntheticProject, generateProject
+from daemon import Daemon, DaemonServer, sendRequest
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        # Keep the caches out of the developer's home
+        env = {"HOME": self.td.name, "XDG_CACHE_HOME": f"{self.td.name}/cache"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        project = SyntheticProject(
+            libraries=3,
+            sources=2,
+            generatorEvery=0,
+            protoEvery=0,
+            configureEvery=2,
+            appEvery=2,
+        )
+        self.project = generateProject(project, self.td.name)
+        self.argv = [
+            self.project.ninjaFile,
+            self.project.srcDir,
+            "--configure_files_list",
+            self.project.configureFilesList,
+        ]
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_unchanged_inputs_reuse_the_result(self) -> None:
+        daemon = Daemon()
+        first = daemon.convert(self.argv, self.td.name)
+        self.assertTrue(first["ok"])
+        self.assertFalse(first["cached"])
+        self.assertIn('name = "app0"', "".join(first["files"].values()))
+        self.assertGreater(len(daemon.state.scanCache), 0)
+
+        with mock.patch.object(includescanner, "_scanFile") as scan:
+            second = daemon.convert(self.argv, self.td.name)
+            scan.assert_not_called()
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["files"], first["files"])
+
+    def test_only_modified_files_are_rescanned(self) -> None:
+        daemon = Daemon()
+        first = daemon.convert(self.argv, self.td.name)
+        header = f"{self.project.srcDir}/mod0/include/mod0/h0.h"
+        with open(header, "a") as f:
+            f.write('#include "mod0/extra.h"\n')
+        with open(f"{self.project.srcDir}/mod0/include/mod0/extra.h", "w") as f:
+            f.write("#pragma once\n")
+
+        scanned = []
+        original = includescanner._scanFile
+
+        def scan(path, macros):
+            scanned.append(path)
+            return original(path, macros)
+
+        with mock.patch.object(includescanner, "_scanFile", side_effect=scan):
+            second = daemon.convert(self.argv, self.td.name)
+        self.assertFalse(second["cached"])
+        self.assertEqual(
+            sorted(scanned), sorted([header, f"{os.path.dirname(header)}/extra.h"])
+        )
+        self.assertNotIn("extra.h", "".join(first["files"].values()))
+        self.assertIn("extra.h", "".join(second["files"].values()))
+        # Same result as a conversion from scratch
+        self.assertEqual(
+            Daemon().convert(self.argv, self.td.name), second | {"seconds": mock.ANY}
+        )
+
+    def test_socket(self) -> None:
+        socketPath = os.path.join(self.td.name, "daemon.sock")
+        with DaemonServer(socketPath) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                reply = sendRequest(
+                    socketPath, {"argv": self.argv, "cwd": self.td.name}
+                )
+                self.assertTrue(reply["ok"])
+                self.assertIn('name = "app0"', "".join(reply["files"].values()))
+                reply = sendRequest(
+                    socketPath, {"argv": ["/missing.ninja", "/"], "cwd": self.td.name}
+                )
+                self.assertFalse(reply["ok"])
+                for invalid in [b"not json\n", b"[1, 2]\n"]:
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                        sock.connect(socketPath)
+                        sock.sendall(invalid)
+                        with sock.makefile("rb") as f:
+                            reply = json.loads(f.readline())
+                    self.assertFalse(reply["ok"])
+                    self.assertIn("Invalid request", reply["error"])
+                # The socket of a running daemon is not taken over
+                with self.assertRaises(FileExistsError):
+                    DaemonServer(socketPath)
+            finally:
+                self.assertTrue(sendRequest(socketPath, {"command": "stop"})["ok"])
+                thread.join()
+        self.assertFalse(os.path.exists(socketPath))
+
+    def test_socket_path(self) -> None:
+        socketPath = os.path.join(self.td.name, "daemon.sock")
+        with open(socketPath, "w") as f:
+            f.write("not a socket")
+        with self.assertRaises(FileExistsError):
+            DaemonServer(socketPath)
+        self.assertTrue(os.path.isfile(socketPath))
+        os.unlink(socketPath)
+        # Left by a daemon that was killed
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(socketPath)
+        with DaemonServer(socketPath):
+            pass
+        self.assertFalse(os.path.exists(socketPath))
+
+
+if __name__ == "__main__":
+    unittest.main()
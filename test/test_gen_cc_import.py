@@ -0,0 +1,127 @@
+import importlib.machinery
+import importlib.util
+import os
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+_HELPER = os.path.join(os.path.dirname(__file__), "..", "helpers", "gen_cc_import")
+_loader = importlib.machinery.SourceFileLoader("gen_cc_import", _HELPER)
+_spec = importlib.util.spec_from_loader("gen_cc_import", _loader)
+assert _spec is not None
+gen_cc_import = importlib.util.module_from_spec(_spec)
+_loader.exec_module(gen_cc_import)
+
+
+def _elf64(needed: list[str]) -> bytes:
+    """A minimal 64 bits ELF with a .dynstr and a .dynamic section."""
+    dynstr = b"\0"
+    offsets = []
+    for n in needed:
+        offsets.append(len(dynstr))
+        dynstr += n.encode() + b"\0"
+    dynamic = b"".join(struct.pack("<qQ", 1, o) for o in offsets)
+    dynamic += struct.pack("<qQ", 0, 0)
+
+    dynstrOffset = 64
+    dynamicOffset = dynstrOffset + len(dynstr)
+    shoff = dynamicOffset + len(dynamic)
+    header = b"\x7fELF" + bytes([2, 1, 1]) + b"\0" * 9
+    header += struct.pack(
+        "<HHIQQQIHHHHHH", 3, 62, 1, 0, 0, shoff, 0, 64, 0, 0, 64, 3, 0
+    )
+    sections = struct.pack("<IIQQQQIIQQ", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    sections += struct.pack(
+        "<IIQQQQIIQQ", 0, 3, 0, 0, dynstrOffset, len(dynstr), 0, 0, 1, 0
+    )
+    sections += struct.pack(
+        "<IIQQQQIIQQ", 0, 6, 0, 0, dynamicOffset, len(dynamic), 1, 0, 8, 16
+    )
+    return header + dynstr + dynamic + sections
+
+
+class TestGenCCImport(unittest.TestCase):
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.root = Path(self.td.name)
+        self.lib = self.root / "lib"
+        self.lib.mkdir()
+        (self.root / "include").mkdir()
+        info = self.root / "dpkg" / "info"
+        info.mkdir(parents=True)
+        lists = {
+            "libfoo1.2.3:amd64": [
+                f"{self.lib}/libfoo.so.1",
+                f"{self.lib}/libfoo_extra.so",
+            ],
+            "libfoo-dev:amd64": [
+                str(self.lib),
+                f"{self.lib}/libfoo.so",
+                f"{self.lib}/libfoo.a",
+                f"{self.root}/include/foo.h",
+                f"{self.root}/share/doc/foo/README",
+            ],
+            "libfoo-doc": [f"{self.root}/share/man/foo.3"],
+            "libbar-dev": [f"{self.lib}/libbar.so", f"{self.root}/include/bar.hpp"],
+            "libbar": [f"{self.lib}/libbar.so.2"],
+        }
+        for pkg, files in lists.items():
+            (info / f"{pkg}.list").write_text("".join(f"{f}\n" for f in files))
+        (self.lib / "libfoo.so").write_bytes(_elf64(["libfoo_extra.so", "libc.so.6"]))
+        (self.lib / "libfoo_extra.so").write_bytes(_elf64(["libc.so.6"]))
+        (self.lib / "libbar.so").write_bytes(b"not an elf")
+        self.index = gen_cc_import.DpkgIndex(str(self.root / "dpkg"))
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def test_index(self):
+        self.assertEqual(self.index.owner(f"{self.lib}/libfoo.so"), "libfoo-dev")
+        self.assertIsNone(self.index.owner("/nowhere/libfoo.so"))
+        self.assertEqual(
+            list(self.index.packagesWithPrefix("libfoo")),
+            ["libfoo-dev", "libfoo-doc", "libfoo1.2.3"],
+        )
+
+    def test_elf_needed(self):
+        self.assertEqual(
+            gen_cc_import.elfNeeded(str(self.lib / "libfoo.so")),
+            ["libfoo_extra.so", "libc.so.6"],
+        )
+        self.assertEqual(gen_cc_import.elfNeeded(str(self.lib / "libbar.so")), [])
+        self.assertEqual(gen_cc_import.elfNeeded(str(self.lib / "missing.so")), [])
+
+    def test_library_files(self):
+        res = gen_cc_import.libraryFiles(self.index, f"{self.lib}/libfoo.so.1")
+        self.assertEqual(
+            res.shared_libs, {f"{self.lib}/libfoo.so", f"{self.lib}/libfoo_extra.so"}
+        )
+        self.assertEqual(res.static_libs, {f"{self.lib}/libfoo.a"})
+        self.assertEqual(res.headers, {f"{self.root}/include/foo.h"})
+        self.assertEqual(
+            res.lib2libs, {f"{self.lib}/libfoo_extra.so": [f"{self.lib}/libfoo.so"]}
+        )
+
+    def test_generate(self):
+        paths = [
+            f"{self.lib}/libfoo.so.1",
+            f"{self.lib}/libfoo_extra.so",
+            f"{self.lib}/libbar.so",
+            "/nowhere/libnothing.so",
+        ]
+        with mock.patch("subprocess.run") as run:
+            stanzas = list(gen_cc_import.generate(paths, self.index, jobs=4))
+            run.assert_not_called()
+        names = [s.split('name = "')[1].split('"')[0] for s in stanzas]
+        # libfoo_extra.so was already emitted with libfoo
+        self.assertEqual(sorted(names[:2]), ["libfoo", "libfoo_extra"])
+        self.assertEqual(names[2:], ["libbar"])
+        foo = next(s for s in stanzas if 'name = "libfoo"' in s)
+        self.assertIn(f'static_library = "{self.lib}/libfoo.a"', foo)
+        self.assertIn(f"{self.root}/include/foo.h", foo)
+
+
+if __name__ == "__main__":
+    unittest.main()
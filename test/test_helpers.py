@@ -1,10 +1,35 @@
+import os
+import tempfile
 import unittest
-from helpers import resolvePath
+from unittest import mock
+
+from helpers import defaultCacheDir, resolvePath, writeCacheFile
 
 class TestResolvePath(unittest.TestCase):
     def test_resolve_path(self):
         self.assertEqual(resolvePath('/a/../b/./c'), '/b/c')
         self.assertEqual(resolvePath('foo/./bar/../baz'), 'foo/baz')
 
+class TestCacheDir(unittest.TestCase):
+    def test_default_cache_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/xdg', 'HOME': '/home/u'}):
+            self.assertEqual(defaultCacheDir(), '/xdg/ninja2bazel')
+        with mock.patch.dict(os.environ, {'HOME': '/home/u'}):
+            os.environ.pop('XDG_CACHE_HOME', None)
+            self.assertEqual(defaultCacheDir(), '/home/u/.cache/ninja2bazel')
+        with mock.patch('os.path.expanduser', return_value='~'):
+            with mock.patch.dict(os.environ, {}, clear=True):
+                self.assertIsNone(defaultCacheDir())
+
+    def test_write_cache_file(self):
+        with tempfile.TemporaryDirectory() as td:
+            path = os.path.join(td, 'sub', 'cache.json')
+            self.assertTrue(writeCacheFile(path, '{}'))
+            with open(path) as f:
+                self.assertEqual(f.read(), '{}')
+            # The parent of the cache directory is a file
+            self.assertFalse(writeCacheFile(os.path.join(path, 'other.json'), '{}'))
+            self.assertEqual(os.listdir(os.path.join(td, 'sub')), ['cache.json'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,133 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import includescanner
+from includescanner import MacroTable, scanIncludes, scanIncludesInBuffer
+
+
+class TestIncludeScanner(unittest.TestCase):
+    def test_directives(self):
+        content = (
+            b'#include "a.h"\n'
+            b"  #  include <b.h>\n"
+            b"#include<c.h>\n"
+            b'#include_next "d.h"\n'
+            b"#import <e.h>\n"
+            b"#include FOO_H\n"
+            b'#include "f.h" // "not/this.h"\n'
+            b'#define X "#include <g.h>"\n'
+        )
+        self.assertEqual(
+            scanIncludesInBuffer(content),
+            (
+                ("a.h", False),
+                ("b.h", True),
+                ("c.h", True),
+                ("d.h", False),
+                ("e.h", True),
+                ("f.h", False),
+            ),
+        )
+
+    def test_comments_are_skipped(self):
+        content = (
+            b"/*\n"
+            b'#include "in_comment.h"\n'
+            b"*/\n"
+            b"// #include <line_comment.h>\n"
+            b'#include "a.h" /* multi\n'
+            b'#include "still_in_comment.h"\n'
+            b"*/\n"
+            b'const char *s = "/*";\n'
+            b'#include "b.h"\n'
+        )
+        self.assertEqual(
+            scanIncludesInBuffer(content), (("a.h", False), ("b.h", False))
+        )
+
+    def test_if_0_regions_are_skipped(self):
+        content = (
+            b"#if 0\n"
+            b'#include "dead.h"\n'
+            b"#ifdef FOO\n"
+            b'#include "nested_dead.h"\n'
+            b"#endif\n"
+            b"#else\n"
+            b'#include "alive.h"\n'
+            b"#endif\n"
+            b"#if 1\n"
+            b'#include "one.h"\n'
+            b"#elif SOMETHING\n"
+            b'#include "after_one.h"\n'
+            b"#else\n"
+            b'#include "else_one.h"\n'
+            b"#endif\n"
+            b"#ifdef UNKNOWN\n"
+            b'#include "maybe.h"\n'
+            b"#else\n"
+            b'#include "maybe_not.h"\n'
+            b"#endif\n"
+        )
+        self.assertEqual(
+            [h for h, _ in scanIncludesInBuffer(content)],
+            ["alive.h", "one.h", "maybe.h", "maybe_not.h"],
+        )
+
+    def test_conditionals_are_evaluated_with_macros(self):
+        macros = MacroTable.fromPredefined(
+            "#define __linux__ 1\n#define __GNUC__ 12\n"
+        ).withFlags("-DWITH_SSL -DLEVEL=3", "-O2 -UNDEBUG")
+        content = (
+            b"#ifdef _WIN32\n"
+            b"#include <windows.h>\n"
+            b"#elif defined(__linux__) && __GNUC__ >= 4\n"
+            b"#include <linux.h>\n"
+            b"#else\n"
+            b"#include <other.h>\n"
+            b"#endif\n"
+            b"#if WITH_SSL && LEVEL > 2 /* comment */\n"
+            b"#include <ssl.h>\n"
+            b"#endif\n"
+            b"#ifndef NDEBUG\n"
+            b"#include <debug.h>\n"
+            b"#endif\n"
+            b"#if HAVE_CONFIG_H || __has_include(<x.h>)\n"
+            b"#include <unknown.h>\n"
+            b"#endif\n"
+            b"#define _WIN32 1\n"
+            b"#ifdef _WIN32\n"
+            b"#include <redefined.h>\n"
+            b"#endif\n"
+        )
+        self.assertEqual(
+            [h for h, _ in scanIncludesInBuffer(content, macros)],
+            ["linux.h", "ssl.h", "debug.h", "unknown.h", "redefined.h"],
+        )
+        # Without macros only #if 0/1 are known
+        self.assertEqual(len(scanIncludesInBuffer(content)), 7)
+
+    def test_macro_tables_are_interned(self):
+        macros = MacroTable.fromPredefined("#define __linux__ 1\n")
+        self.assertIs(macros.withFlags("-DA", ""), macros.withFlags("-DA", ""))
+        self.assertIsNot(macros.withFlags("-DA", ""), macros.withFlags("-DB", ""))
+
+    def test_scan_file_with_mmap(self):
+        with tempfile.TemporaryDirectory() as td:
+            path = Path(td) / "big.c"
+            path.write_bytes(
+                b'#include "a.h"\n' + b"int x;\n" * 16 + b"#include <b.h>\n"
+            )
+            self.assertEqual(scanIncludes(str(path)), (("a.h", False), ("b.h", True)))
+            with mock.patch.object(includescanner, "MMAP_THRESHOLD", 16):
+                self.assertEqual(
+                    scanIncludes(str(path)), (("a.h", False), ("b.h", True))
+                )
+            empty = Path(td) / "empty.h"
+            empty.write_bytes(b"")
+            self.assertEqual(scanIncludes(str(empty)), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cc_import_parse import parseCCImports
+from lazyglob import HeaderSet, LazyGlob
+
+
+class TestLazyGlob(unittest.TestCase):
+    def test_matches_like_glob(self):
+        with tempfile.TemporaryDirectory() as td:
+            for f in ["a.h", "b.hpp", ".hidden.h", "sub/c.h", "sub/deep/d.h", "x1/e.h"]:
+                path = os.path.join(td, f)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "w").close()
+            files = [
+                os.path.join(dirpath, f)
+                for dirpath, _, names in os.walk(td)
+                for f in names
+            ]
+            for pattern in ["**/*.h", "*.h", "sub/**", "x?/*.h", "[ab].h*", "[!a]*"]:
+                full = f"{td}/{pattern}"
+                expected = {
+                    f for f in glob.glob(full, recursive=True) if os.path.isfile(f)
+                }
+                headers = HeaderSet([LazyGlob(full)])
+                self.assertEqual({f for f in files if f in headers}, expected, pattern)
+
+    def test_membership_does_not_enumerate(self):
+        headers = HeaderSet(
+            ["/opt/foo/include/foo.h", LazyGlob("/usr/include/boost/**/*.hpp")]
+        )
+        with mock.patch("glob.glob") as globber:
+            self.assertIn("/usr/include/boost/asio/io_context.hpp", headers)
+            self.assertIn("/opt/foo/include/foo.h", headers)
+            self.assertNotIn("/usr/include/boost/asio/io_context.h", headers)
+            self.assertNotIn("/usr/include/openssl/ssl.h", headers)
+            globber.assert_not_called()
+
+    def test_enumerated_when_iterated(self):
+        with tempfile.TemporaryDirectory() as td:
+            open(os.path.join(td, "a.h"), "w").close()
+            headers = HeaderSet(["/explicit.h", LazyGlob(f"{td}/*.h")])
+            self.assertEqual(list(headers), ["/explicit.h", f"{td}/a.h"])
+            self.assertEqual(len(headers), 2)
+            self.assertEqual(headers[1], f"{td}/a.h")
+
+    def test_cc_import_hdrs_are_lazy(self):
+        lines = [
+            "cc_import(",
+            'name = "boost"',
+            'hdrs = glob(["/usr/include/boost/**/*.hpp"])',
+            ")",
+        ]
+        with mock.patch("glob.glob") as globber:
+            imp = parseCCImports(lines, "src")[0]
+            self.assertIn("/usr/include/boost/config.hpp", imp.hdrs)
+            globber.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import logging
+import unittest
+
+from logutils import Lazy, verbosityToLevel
+
+
+class TestLogUtils(unittest.TestCase):
+    def test_verbosity_to_level(self) -> None:
+        self.assertEqual(verbosityToLevel(), logging.INFO)
+        self.assertEqual(verbosityToLevel(verbose=1), logging.DEBUG)
+        self.assertEqual(verbosityToLevel(verbose=3), logging.DEBUG)
+        self.assertEqual(verbosityToLevel(quiet=1), logging.WARNING)
+        self.assertEqual(verbosityToLevel(quiet=2), logging.ERROR)
+        self.assertEqual(verbosityToLevel(quiet=5), logging.CRITICAL)
+
+    def test_lazy_is_only_rendered_when_emitted(self) -> None:
+        calls = []
+
+        def render(d):
+            calls.append(d)
+            return ",".join(sorted(d))
+
+        logger = logging.getLogger("test_logutils")
+        logger.setLevel(logging.INFO)
+        logger.debug("payload %s", Lazy(render, {"b", "a"}))
+        self.assertEqual(calls, [])
+        with self.assertLogs(logger, level=logging.INFO) as cm:
+            logger.info("payload %s", Lazy(render, {"b", "a"}))
+        self.assertEqual(len(calls), 1)
+        self.assertIn("payload a,b", cm.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+import argparse
+import collections
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import includescanner
+import multiconfig
+from bench.synthetic import SyntheticProject, generateProject
+
+_LIB = """load("@rules_cc//cc:defs.bzl", "cc_library")
+
+# Location foo
+cc_library(
+    name = "foo",
+    srcs = [
+        "a.cc",
+        "b.cc",
+    ],
+    copts = [
+        "-DFOO",
+        {copt}
+    ],
+    visibility = ["//visibility:public"],
+)
+"""
+
+_BIN = """# Location foo
+cc_binary(
+    name = "tool",
+    srcs = [
+        "tool.cc",
+    ],
+    linkstatic = {linkstatic},
+)
+"""
+
+
+class TestMergeConfigs(unittest.TestCase):
+    def test_identical_files_are_kept(self) -> None:
+        content = _LIB.format(copt='"-O2",')
+        merged = multiconfig.mergeConfigs(
+            {":opt": {"foo": content}, ":dbg": {"foo": content}}
+        )
+        self.assertEqual(merged, {"foo": content})
+
+    def test_select_differences(self) -> None:
+        merged = multiconfig.mergeConfigs(
+            {
+                ":opt": {
+                    "foo": _LIB.format(copt='"-O2",') + _BIN.format(linkstatic=1),
+                },
+                ":dbg": {
+                    "foo": _LIB.format(copt='"-O0",\n        "-g",'),
+                    "bar": 'exports_files(["x"])\n',
+                },
+            }
+        )
+        self.assertEqual(
+            merged["foo"],
+            """load("@rules_cc//cc:defs.bzl", "cc_library")
+
+# Location foo
+cc_library(
+    name = "foo",
+    srcs = [
+        "a.cc",
+        "b.cc",
+    ],
+    copts = [
+        "-DFOO",
+    ] + select({
+        ":opt": [
+            "-O2",
+        ],
+        ":dbg": [
+            "-O0",
+            "-g",
+        ],
+        "//conditions:default": [
+            "-O2",
+        ],
+    }),
+    visibility = ["//visibility:public"],
+)
+
+# Location foo
+cc_binary(
+    name = "tool",
+    srcs = [
+        "tool.cc",
+    ],
+    linkstatic = 1,
+    target_compatible_with = select({
+        ":opt": [],
+        "//conditions:default": ["@platforms//:incompatible"],
+    }),
+)
+""",
+        )
+        self.assertEqual(merged["bar"], 'exports_files(["x"])\n')
+
+    def test_scalar_and_missing_attributes(self) -> None:
+        merged = multiconfig.mergeConfigs(
+            {
+                ":a": {"foo": _BIN.format(linkstatic=1)},
+                ":b": {
+                    "foo": _BIN.format(linkstatic=0).replace(
+                        "    linkstatic = 0,\n", ""
+                    )
+                },
+                ":c": {"foo": _BIN.format(linkstatic=0)},
+            }
+        )
+        self.assertIn(
+            """    linkstatic = select({
+        ":a": 1,
+        ":b": None,
+        ":c": 0,
+        "//conditions:default": 1,
+    }),
+""",
+            merged["foo"],
+        )
+        self.assertNotIn("target_compatible_with", merged["foo"])
+
+    def test_same_items_in_another_order(self) -> None:
+        merged = multiconfig.mergeConfigs(
+            {
+                ":a": {"foo": _LIB.format(copt='"-O2",\n        "-g",')},
+                ":b": {"foo": _LIB.format(copt='"-g",\n        "-O2",\n        "-g",')},
+            }
+        )
+        self.assertNotIn("select(", merged["foo"])
+        self.assertIn('"-O2",\n        "-g",\n    ],', merged["foo"])
+
+    def test_loads_are_merged(self) -> None:
+        merged = multiconfig.mergeConfigs(
+            {
+                ":a": {"foo": _LIB.format(copt="")},
+                ":b": {
+                    "foo": 'load("@rules_cc//cc:defs.bzl", "cc_binary")\n\n'
+                    + _BIN.format(linkstatic=1)
+                },
+            }
+        )
+        self.assertTrue(
+            merged["foo"].startswith(
+                'load("@rules_cc//cc:defs.bzl", "cc_binary", "cc_library")\n\n#'
+            )
+        )
+
+    def test_parse_configs(self) -> None:
+        self.assertEqual(
+            multiconfig.parseConfigs(["//cfg:dbg=build/a=b.ninja", ":opt=o.ninja"]),
+            [("//cfg:dbg", "build/a=b.ninja"), (":opt", "o.ninja")],
+        )
+        with self.assertRaises(SystemExit):
+            multiconfig.parseConfigs(["build.ninja"])
+        with self.assertRaises(SystemExit):
+            multiconfig.parseConfigs([":a=x.ninja", ":a=y.ninja"])
+
+
+class TestConvertConfigs(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        # Keep the caches out of the developer's home
+        env = {"HOME": self.td.name, "XDG_CACHE_HOME": f"{self.td.name}/cache"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        project = SyntheticProject(
+            libraries=3,
+            sources=2,
+            generatorEvery=0,
+            protoEvery=0,
+            configureEvery=0,
+            appEvery=2,
+        )
+        self.project = generateProject(project, self.td.name)
+        # A debug build without app2
+        with open(self.project.ninjaFile) as f:
+            stanzas = f.read().replace("-DMOD0_BUILD", "-DMOD0_BUILD -DDEBUG")
+        kept = []
+        for stanza in stanzas.split("\n\n"):
+            if stanza.startswith("build all:"):
+                kept.append(stanza.replace(" apps/app2", ""))
+            elif "app2" not in stanza:
+                kept.append(stanza)
+        debugDir = os.path.join(self.td.name, "build-debug")
+        os.mkdir(debugDir)
+        self.debugNinja = os.path.join(debugDir, "build.ninja")
+        with open(self.debugNinja, "w") as f:
+            f.write("\n\n".join(kept))
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_convert(self) -> None:
+        from parser import build_arg_parser
+
+        args: argparse.Namespace = build_arg_parser().parse_args(
+            [
+                f"//cfg:opt={self.project.ninjaFile}",
+                self.project.srcDir,
+                "--config",
+                f"//cfg:dbg={self.debugNinja}",
+            ]
+        )
+        configs = multiconfig.parseConfigs([args.filename, *args.config])
+        scanned: collections.Counter = collections.Counter()
+        original = includescanner._scanFile
+
+        def scan(path, macros):
+            scanned[path] += 1
+            return original(path, macros)
+
+        with mock.patch.object(includescanner, "_scanFile", side_effect=scan):
+            output, rootdir = multiconfig.convertConfigs(args, configs)
+        # The sources common to the configurations are scanned once
+        self.assertTrue(scanned)
+        self.assertEqual(set(scanned.values()), {1})
+        self.assertTrue(rootdir.startswith(self.project.srcDir))
+        build = output["."]
+        self.assertIn('] + select({\n        "//cfg:opt": [],', build)
+        self.assertIn('"-DDEBUG"', build)
+        app2 = build[build.index('name = "app2"') :]
+        self.assertIn('"//cfg:opt": [],\n        "//conditions:default"', app2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,311 @@
+import json
+import os
+import re
+import struct
+import tempfile
+import time
+import unittest
+from typing import Dict, List, Tuple
+from unittest import mock
+
+import cppfileparser
+import includescanner
+from bench.synthetic import SyntheticProject, generateProject
+from ninjatools import (
+    NINJA_DEPS_SIGNATURE,
+    loadRecordedDeps,
+    parseDepfile,
+    parseNinjaDeps,
+    parseToolDeps,
+    readNinjaDeps,
+)
+from parser import build_arg_parser, convert
+
+_TOOL_DEPS = """mod0/CMakeFiles/mod0.dir/src/s0.cc.o: #deps 3, deps mtime 1700000000000000000 (VALID)
+    /src/mod0/src/s0.cc
+    /src/mod0/include/mod0/h0.h
+    gen/config.h
+
+mod0/CMakeFiles/mod0.dir/src/s1.cc.o: #deps 1, deps mtime 1600000000000000000 (STALE)
+    /src/mod0/src/s1.cc
+
+apps/app0: #deps 0, deps mtime 1700000000000000000 (VALID)
+
+"""
+
+
+class TestToolDeps(unittest.TestCase):
+    def test_parse(self) -> None:
+        self.assertEqual(
+            parseToolDeps(_TOOL_DEPS),
+            {
+                "mod0/CMakeFiles/mod0.dir/src/s0.cc.o": [
+                    "/src/mod0/src/s0.cc",
+                    "/src/mod0/include/mod0/h0.h",
+                    "gen/config.h",
+                ],
+                "apps/app0": [],
+            },
+        )
+
+    def test_load(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            text = os.path.join(td, "deps.txt")
+            with open(text, "w") as f:
+                f.write(_TOOL_DEPS)
+            asJson = os.path.join(td, "deps.json")
+            with open(asJson, "w") as f:
+                json.dump(parseToolDeps(_TOOL_DEPS), f)
+            self.assertEqual(loadRecordedDeps(text, td), loadRecordedDeps(asJson, td))
+            with mock.patch("shutil.which", return_value=None):
+                self.assertEqual(loadRecordedDeps("ninja", td), {})
+
+
+def _ninjaDepsLog(records: List[Tuple[str, int, List[str]]], version: int = 4) -> bytes:
+    """A .ninja_deps with the (output, mtime, deps) records, as ninja writes it."""
+    ret = [NINJA_DEPS_SIGNATURE, struct.pack("<i", version)]
+    ids: Dict[str, int] = {}
+    for output, mtime, deps in records:
+        for path in [output, *deps]:
+            if path in ids:
+                continue
+            raw = path.encode()
+            raw += b"\0" * (-len(raw) % 4)
+            ret.append(struct.pack("<I", len(raw) + 4) + raw)
+            ret.append(struct.pack("<I", ~len(ids) & 0xFFFFFFFF))
+            ids[path] = len(ids)
+        if version >= 4:
+            header = struct.pack("<iII", ids[output], mtime & 0xFFFFFFFF, mtime >> 32)
+        else:
+            header = struct.pack("<ii", ids[output], mtime)
+        body = header + struct.pack(f"<{len(deps)}i", *[ids[d] for d in deps])
+        ret.append(struct.pack("<I", len(body) | 0x80000000) + body)
+    return b"".join(ret)
+
+
+class TestNinjaDeps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self.td.name, "gen"))
+        for name in ["a.cc", "a.h", "gen/a.h", "b.cc", "c.cc", "d.cc"]:
+            with open(os.path.join(self.td.name, name), "w"):
+                pass
+        for name in ["a.o", "b.o", "c.o"]:
+            with open(os.path.join(self.td.name, name), "w"):
+                pass
+        self.now = time.time_ns()
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_parse(self) -> None:
+        log = _ninjaDepsLog(
+            [
+                ("a.o", self.now, ["a.cc", "a.h"]),
+                ("b.o", self.now, ["b.cc"]),
+                # Rebuilt, the last record wins
+                ("a.o", self.now, ["a.cc", "gen/a.h"]),
+                # Older than the output
+                ("c.o", 1, ["c.cc"]),
+                # The output doesn't exist
+                ("d.o", self.now, ["d.cc"]),
+            ]
+        )
+        expected = {
+            "a.o": ["a.cc", "gen/a.h"],
+            "b.o": ["b.cc"],
+        }
+        self.assertEqual(parseNinjaDeps(log, self.td.name), expected)
+        # Interrupted while writing the last record
+        self.assertEqual(parseNinjaDeps(log[:-3], self.td.name), expected)
+        with self.assertRaises(ValueError):
+            parseNinjaDeps(b"# ninjalog\n", self.td.name)
+
+    def test_modified_dependencies(self) -> None:
+        log = _ninjaDepsLog(
+            [("a.o", self.now, ["a.cc", "a.h"]), ("b.o", self.now, ["b.cc"])]
+        )
+        later = self.now + 10**9
+        # An #include was added to the source after the build
+        os.utime(os.path.join(self.td.name, "a.cc"), ns=(later, later))
+        self.assertEqual(parseNinjaDeps(log, self.td.name), {"b.o": ["b.cc"]})
+        os.utime(os.path.join(self.td.name, "a.cc"), ns=(self.now, self.now))
+        os.unlink(os.path.join(self.td.name, "a.h"))
+        self.assertEqual(parseNinjaDeps(log, self.td.name), {"b.o": ["b.cc"]})
+
+    def test_version_3(self) -> None:
+        log = _ninjaDepsLog([("a.o", int(time.time()) + 1, ["a.cc"])], version=3)
+        self.assertEqual(parseNinjaDeps(log, self.td.name), {"a.o": ["a.cc"]})
+
+    def test_load(self) -> None:
+        with open(os.path.join(self.td.name, ".ninja_deps"), "wb") as f:
+            f.write(_ninjaDepsLog([("a.o", self.now, ["a.cc"])]))
+        self.assertEqual(loadRecordedDeps("auto", self.td.name), {"a.o": ["a.cc"]})
+        self.assertEqual(
+            loadRecordedDeps(os.path.join(self.td.name, ".ninja_deps"), self.td.name),
+            {"a.o": ["a.cc"]},
+        )
+        self.assertEqual(loadRecordedDeps("none", self.td.name), {})
+        with tempfile.TemporaryDirectory() as empty:
+            self.assertEqual(loadRecordedDeps("auto", empty), {})
+
+    def test_load_unreadable(self) -> None:
+        ninjaDeps = os.path.join(self.td.name, ".ninja_deps")
+        for content in [
+            NINJA_DEPS_SIGNATURE + struct.pack("<i", 5),
+            b"garbage",
+            NINJA_DEPS_SIGNATURE,
+        ]:
+            with open(ninjaDeps, "wb") as f:
+                f.write(content)
+            # The includes are scanned
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(loadRecordedDeps("auto", self.td.name), {})
+            with self.assertRaises(ValueError):
+                readNinjaDeps(ninjaDeps)
+        # Asked for explicitly
+        with self.assertRaises(ValueError):
+            loadRecordedDeps(ninjaDeps, self.td.name)
+
+    def test_depfile(self) -> None:
+        self.assertEqual(
+            parseDepfile(
+                "a.o a.o.d: /src/a.cc /src/my\\ dir/a.h \\\n  /src/$$x.h\n\n/src/a.h:\n"
+            ),
+            ["/src/a.cc", "/src/my dir/a.h", "/src/$x.h"],
+        )
+        self.assertEqual(parseDepfile(""), [])
+
+
+def _closure(source: str, includeDirs: List[str]) -> List[str]:
+    """What the compiler would record for source, system headers excluded."""
+    ret = [source]
+    todo = [source]
+    while todo:
+        with open(todo.pop()) as f:
+            spellings = re.findall(r'#include [<"]([^>"]+)[>"]', f.read())
+        for spelling in spellings:
+            for d in includeDirs:
+                path = os.path.join(d, spelling)
+                if os.path.exists(path) and path not in ret:
+                    ret.append(path)
+                    todo.append(path)
+                    break
+    return ret
+
+
+class TestRecordedDeps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        # Keep the caches out of the developer's home
+        env = {"HOME": self.td.name, "XDG_CACHE_HOME": f"{self.td.name}/cache"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        project = SyntheticProject(
+            libraries=4,
+            sources=3,
+            generatorEvery=0,
+            protoEvery=0,
+            configureEvery=0,
+            appEvery=2,
+        )
+        self.project = generateProject(project, self.td.name)
+        with open(self.project.ninjaFile) as f:
+            ninja = f.read()
+        self.deps: Dict[str, List[str]] = {}
+        for output, source, includes in re.findall(
+            r"^build (\S+\.o): CXX_COMPILER (\S+)\n(?:  .*\n)*?  INCLUDES = (.*)$",
+            ninja,
+            re.MULTILINE,
+        ):
+            self.deps[output] = _closure(source, re.findall(r"-I(\S+)", includes))
+        self.buildDir = os.path.dirname(self.project.ninjaFile)
+        self.depsFile = os.path.join(self.td.name, "deps.json")
+        with open(self.depsFile, "w") as f:
+            json.dump(self.deps, f)
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+        cppfileparser.cache.clear()
+
+    def _convert(self, *extra: str):
+        cppfileparser.cache.clear()
+        args = build_arg_parser().parse_args(
+            [self.project.ninjaFile, self.project.srcDir, *extra]
+        )
+        return convert(args)
+
+    def _touchOutputs(self) -> None:
+        for output in self.deps:
+            path = os.path.join(self.buildDir, output)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w"):
+                pass
+
+    def test_same_output_without_scanning(self) -> None:
+        self.assertGreater(len(self.deps), 4)
+        scanned = self._convert()
+        with mock.patch.object(includescanner, "_scanFile") as scan:
+            recorded = self._convert("--recorded-deps", self.depsFile)
+            scan.assert_not_called()
+        self.assertEqual(recorded, scanned)
+
+    def test_sources_without_record_are_scanned(self) -> None:
+        scanned = self._convert()
+        output = next(iter(self.deps))
+        del self.deps[output]
+        with open(self.depsFile, "w") as f:
+            json.dump(self.deps, f)
+        original = includescanner._scanFile
+        with mock.patch.object(
+            includescanner, "_scanFile", side_effect=original
+        ) as scan:
+            recorded = self._convert("--recorded-deps", self.depsFile)
+        self.assertEqual(recorded, scanned)
+        self.assertIn(
+            re.sub(r"^.*\.dir/", "", output)[: -len(".o")],
+            scan.call_args_list[0].args[0],
+        )
+
+    def test_ninja_deps_of_the_build_directory(self) -> None:
+        scanned = self._convert()
+        self._touchOutputs()
+        now = time.time_ns()
+        with open(os.path.join(self.buildDir, ".ninja_deps"), "wb") as f:
+            f.write(_ninjaDepsLog([(o, now, d) for o, d in self.deps.items()]))
+        with mock.patch.object(includescanner, "_scanFile") as scan:
+            recorded = self._convert()
+            scan.assert_not_called()
+        self.assertEqual(recorded, scanned)
+        original = includescanner._scanFile
+        with mock.patch.object(
+            includescanner, "_scanFile", side_effect=original
+        ) as scan:
+            self.assertEqual(self._convert("--recorded-deps", "none"), scanned)
+            scan.assert_called()
+
+    def test_depfiles(self) -> None:
+        scanned = self._convert()
+        self._touchOutputs()
+        for output, deps in self.deps.items():
+            with open(os.path.join(self.buildDir, f"{output}.d"), "w") as f:
+                f.write(f"{output}: \\\n  " + " \\\n  ".join(deps) + "\n")
+        with mock.patch.object(includescanner, "_scanFile") as scan:
+            recorded = self._convert()
+            scan.assert_not_called()
+        self.assertEqual(recorded, scanned)
+        # The source was modified after the build, it's scanned
+        output, deps = next(iter(self.deps.items()))
+        later = time.time_ns() + 10**9
+        os.utime(deps[0], ns=(later, later))
+        original = includescanner._scanFile
+        with mock.patch.object(
+            includescanner, "_scanFile", side_effect=original
+        ) as scan:
+            self.assertEqual(self._convert(), scanned)
+        self.assertEqual(scan.call_args_list[0].args[0], deps[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import signal
+import tempfile
+import unittest
+from unittest import mock
+
+import cppfileparser
+import parallelgen
+from bazel import BazelBuild, BazelTarget, ExportedFile
+from bench.synthetic import SyntheticProject, generateProject
+from configure_file import ConfigureFiles
+from parser import build_arg_parser, convert
+
+
+def _partial(copt: str, addPrefix: bool, items=()) -> parallelgen.PartialBuild:
+    bb = BazelBuild("")
+    lib = bb.registry.getObject(BazelTarget, "cc_library", "lib", ".")
+    lib.addSrc(ExportedFile(":lib.cc", "."))
+    lib.addCopt(copt)
+    lib.items = list(items)
+    binary = bb.registry.getObject(BazelTarget, "cc_binary", f"bin{copt}", ".")
+    binary.addDep(lib)
+    binary.addPrefixIfRequired = addPrefix
+    bb.bazelTargets.add(lib)
+    bb.bazelTargets.add(binary)
+    return parallelgen.flattenBuild(bb)
+
+
+class TestMergePartials(unittest.TestCase):
+    def test_union_by_label(self) -> None:
+        bb = BazelBuild("")
+        parallelgen.mergePartials(bb, [_partial("-O2", True), _partial("-g", True)])
+        self.assertEqual(
+            sorted(t.name for t in bb.bazelTargets), ["bin-O2", "bin-g", "lib"]
+        )
+        lib = bb.bazelTargets.get(".", "lib")
+        assert isinstance(lib, BazelTarget)
+        self.assertEqual(lib.copts, {"-O2", "-g"})
+        self.assertEqual([s.name for s in lib.srcs], [":lib.cc"])
+        # The dependencies are the merged target, not copies of it
+        for name in ["bin-O2", "bin-g"]:
+            binary = bb.bazelTargets.get(".", name)
+            assert isinstance(binary, BazelTarget)
+            self.assertIs(next(iter(binary.deps)), lib)
+        self.assertIs(bb.registry.getObject(BazelTarget, "cc_library", "lib", "."), lib)
+
+    def test_lists(self) -> None:
+        bb = BazelBuild("")
+        partials = [
+            _partial("-O2", True, ["a", ["x"], "b"]),
+            _partial("-g", True, ["b", "c", ["x"], ["y"]]),
+            _partial("-O3", True, ["c", "a", ["y"], "d"]),
+        ]
+        parallelgen.mergePartials(bb, partials)
+        lib = bb.bazelTargets.get(".", "lib")
+        assert isinstance(lib, BazelTarget)
+        self.assertEqual(lib.items, ["a", ["x"], "b", "c", ["y"], "d"])
+
+    def test_conflict(self) -> None:
+        bb = BazelBuild("")
+        with self.assertRaises(parallelgen.MergeConflict):
+            parallelgen.mergePartials(
+                bb, [_partial("-O2", True), _partial("-O2", False)]
+            )
+        self.assertEqual(len(bb.bazelTargets), 0)
+        self.assertEqual(len(bb.registry), 0)
+
+    def test_chunks(self) -> None:
+        self.assertEqual(parallelgen._chunks(7, 3), [(0, 3), (3, 5), (5, 7)])
+        self.assertEqual(parallelgen._chunks(2, 4), [(0, 1), (1, 2)])
+
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self) -> None:
+        self.configureFiles = ConfigureFiles()
+
+    def _generate(self, e, bb: BazelBuild) -> None:
+        if e == "killed":
+            os.kill(os.getpid(), signal.SIGKILL)
+        bb.bazelTargets.add(bb.registry.getObject(BazelTarget, "cc_library", e, "."))
+        self.configureFiles.recordMiss(f"gen/{e}.h", [f"{e}.h"])
+
+    def test_generate(self) -> None:
+        bb = BazelBuild("")
+        self.assertTrue(
+            parallelgen.genBazelInWorkers(
+                ["a", "b", "c"], bb, self._generate, 2, self.configureFiles
+            )
+        )
+        self.assertEqual(sorted(t.name for t in bb.bazelTargets), ["a", "b", "c"])
+        # Recorded in the workers
+        self.assertEqual(
+            sorted(self.configureFiles.misses), ["gen/a.h", "gen/b.h", "gen/c.h"]
+        )
+
+    def test_killed_worker(self) -> None:
+        bb = BazelBuild("")
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(
+                parallelgen.genBazelInWorkers(
+                    ["a", "killed"], bb, self._generate, 2, self.configureFiles
+                )
+            )
+        self.assertEqual(len(bb.bazelTargets), 0)
+        self.assertEqual(self.configureFiles.misses, {})
+
+
+class TestParallelGeneration(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        # Keep the caches out of the developer's home
+        env = {"HOME": self.td.name, "XDG_CACHE_HOME": f"{self.td.name}/cache"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        project = SyntheticProject(
+            libraries=8,
+            sources=3,
+            generatorEvery=3,
+            protoEvery=4,
+            configureEvery=5,
+            appEvery=2,
+        )
+        self.project = generateProject(project, self.td.name)
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+        cppfileparser.cache.clear()
+
+    def _convert(self, jobs: int):
+        cppfileparser.cache.clear()
+        args = build_arg_parser().parse_args(
+            [
+                self.project.ninjaFile,
+                self.project.srcDir,
+                "--configure_files_list",
+                self.project.configureFilesList,
+                "-j",
+                str(jobs),
+            ]
+        )
+        return convert(args)
+
+    def test_same_output_as_serial(self) -> None:
+        serial = self._convert(1)
+        merge = parallelgen.mergePartials
+        with mock.patch.object(
+            parallelgen, "mergePartials", side_effect=merge
+        ) as merged:
+            parallel = self._convert(3)
+        self.assertEqual(len(merged.call_args.args[1]), 3)
+        self.assertEqual(parallel, serial)
+
+    def test_conflict_falls_back_to_serial(self) -> None:
+        serial = self._convert(1)
+        with mock.patch.object(
+            parallelgen,
+            "mergePartials",
+            side_effect=parallelgen.MergeConflict("test"),
+        ):
+            self.assertEqual(self._convert(2), serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,10 @@ from types import SimpleNamespace
 from unittest import mock
 
 from parser import (
+    ConversionState,
     _build_post_treatment_command,
     _configure_vars_from_cli_paths,
+    cache_dir,
     install_configure_file_tool,
     parse_manually_generated,
     run_post_treatments,
@@ -23,6 +25,17 @@ class TestParserUtils(unittest.TestCase):
         with self.assertRaises(SystemExit):
             parse_manually_generated(['oops'])
 
+    def test_cache_dir(self):
+        self.assertEqual(cache_dir(SimpleNamespace(cache_dir="/tmp/c")), "/tmp/c")
+        self.assertIsNone(cache_dir(SimpleNamespace(cache_dir="none")))
+        with mock.patch("parser.defaultCacheDir", return_value="/xdg/ninja2bazel"):
+            self.assertEqual(cache_dir(SimpleNamespace(cache_dir=None)), "/xdg/ninja2bazel")
+
+    def test_no_imports_no_cache(self):
+        with mock.patch("parser.parseCCImports") as parse:
+            self.assertEqual(ConversionState().cc_imports([], "", "/nonexistent"), [])
+            parse.assert_not_called()
+
     def test_build_post_treatment_command_for_python_script(self):
         self.assertEqual(
             _build_post_treatment_command("script.py", "foo/BUILD.bazel"),
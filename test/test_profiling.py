@@ -0,0 +1,57 @@
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+
+from profiling import StackSampler, currentPhases, phase, runProfiled
+
+
+def _busy(n: int) -> int:
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+class TestProfiling(unittest.TestCase):
+    def test_phases_are_nested(self) -> None:
+        self.assertEqual(currentPhases(), ())
+        with phase("getBuildTargets"):
+            with phase("finalizeHeaders"):
+                self.assertEqual(currentPhases(), ("getBuildTargets", "finalizeHeaders"))
+            self.assertEqual(currentPhases(), ("getBuildTargets",))
+        self.assertEqual(currentPhases(), ())
+
+    def test_sampler_prefixes_stacks_with_phases(self) -> None:
+        sampler = StackSampler(threadId=threading.get_ident())
+        with phase("genBazelBuildFiles"):
+            sampler.sample()
+        self.assertEqual(len(sampler.samples), 1)
+        line = sampler.collapsed()[0]
+        self.assertTrue(line.startswith("phase:genBazelBuildFiles;"))
+        self.assertIn("test_sampler_prefixes_stacks_with_phases", line)
+        self.assertTrue(line.endswith(" 1"))
+
+    def test_run_profiled_cprofile(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            prefix = os.path.join(td, "prof")
+            self.assertEqual(runProfiled("cprofile", prefix, _busy, 10), 285)
+            stats = pstats.Stats(f"{prefix}.pstats")
+            self.assertTrue(any(k[2] == "_busy" for k in stats.stats))
+            self.assertTrue(os.path.exists(f"{prefix}.collapsed"))
+
+    def test_run_profiled_tracemalloc(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            prefix = os.path.join(td, "prof")
+            runProfiled("tracemalloc", prefix, _busy, 10)
+            self.assertTrue(os.path.exists(f"{prefix}.tracemalloc"))
+            self.assertTrue(os.path.exists(f"{prefix}.collapsed"))
+
+    def test_run_profiled_rejects_unknown_mode(self) -> None:
+        with self.assertRaises(ValueError):
+            runProfiled("perf", "unused", _busy, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
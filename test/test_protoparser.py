@@ -1,14 +1,17 @@
+import json
+import os
 import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
-from protoparser import cache as proto_cache, findProtoIncludes, seen as proto_seen
+import protoparser
+from protoparser import ProtoGraph, findProtoIncludes, protocIncludeDirs
 
 
 class TestProtoParser(unittest.TestCase):
     def tearDown(self) -> None:
-        proto_cache.clear()
-        proto_seen.clear()
+        protoparser.graph = ProtoGraph()
 
     def test_find_proto_includes_resolves_and_caches(self) -> None:
         with tempfile.TemporaryDirectory() as td:
@@ -24,3 +27,122 @@ class TestProtoParser(unittest.TestCase):
             self.assertIn(("google/api/annotations.proto", "@"), res1[str(root)])
             res2 = findProtoIncludes(str(root), [str(base)])
             self.assertIs(res1, res2)
+
+    def test_protoc_include_dirs(self) -> None:
+        command = (
+            "cd /b && /usr/bin/protoc -I /s/proto -I /s/common --cpp_out /b a.proto"
+            " && /usr/bin/protoc -I /s/common -I /s/other b.proto && touch -I /x"
+        )
+        self.assertEqual(
+            protocIncludeDirs(command), ("/s/proto", "/s/common", "/s/other")
+        )
+
+
+class TestProtoGraph(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        self.base = Path(self.td.name)
+        (self.base / "a").mkdir()
+        (self.base / "b").mkdir()
+        self.dirs = [str(self.base / "a"), str(self.base / "b")]
+        self.root = self.base / "a" / "root.proto"
+        self.root.write_text(
+            'import "left.proto";\nimport "right.proto";\n'
+            'import "google/protobuf/any.proto";\nimport "missing.proto";\n'
+        )
+        (self.base / "a" / "left.proto").write_text('import "common.proto";\n')
+        (self.base / "b" / "right.proto").write_text(
+            'import "common.proto";\nimport "root.proto";\n'
+        )
+        (self.base / "b" / "common.proto").write_text("message Common {}\n")
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def _path(self, name: str) -> str:
+        return str(self.base / name)
+
+    def test_closure(self) -> None:
+        graph = ProtoGraph()
+        closure = graph.findProtoIncludes(str(self.root), self.dirs)
+        a, b = self.dirs
+        self.assertEqual(
+            list(closure.items()),
+            [
+                (
+                    str(self.root),
+                    [
+                        (self._path("a/left.proto"), a),
+                        (self._path("b/right.proto"), b),
+                        ("google/protobuf/any.proto", "@"),
+                    ],
+                ),
+                (self._path("a/left.proto"), [(self._path("b/common.proto"), b)]),
+                (self._path("b/common.proto"), []),
+                (
+                    self._path("b/right.proto"),
+                    [(self._path("b/common.proto"), b), (str(self.root), a)],
+                ),
+            ],
+        )
+
+    def test_each_file_is_scanned_once(self) -> None:
+        graph = ProtoGraph()
+        original = protoparser.scanProtoImports
+        with mock.patch.object(
+            protoparser, "scanProtoImports", side_effect=original
+        ) as scan:
+            graph.findProtoIncludes(str(self.root), self.dirs)
+            graph.findProtoIncludes(self._path("b/right.proto"), self.dirs)
+            graph.findProtoIncludes(self._path("b/right.proto"), list(self.dirs))
+            graph.findProtoIncludes(self._path("b/right.proto"), self.dirs[::-1])
+        self.assertEqual(scan.call_count, 4)
+
+    def test_disk_cache(self) -> None:
+        cacheFile = os.path.join(self.td.name, "cache", "proto_imports.json")
+        graph = ProtoGraph(cacheFile)
+        expected = graph.findProtoIncludes(str(self.root), self.dirs)
+        graph.save()
+        with mock.patch.object(protoparser, "scanProtoImports") as scan:
+            closure = ProtoGraph(cacheFile).findProtoIncludes(str(self.root), self.dirs)
+            scan.assert_not_called()
+        self.assertEqual(closure, expected)
+
+    def test_disk_cache_pruned(self) -> None:
+        cacheFile = os.path.join(self.td.name, "cache", "proto_imports.json")
+        graph = ProtoGraph(cacheFile)
+        graph.findProtoIncludes(str(self.root), self.dirs)
+        graph.save()
+        with open(cacheFile) as f:
+            scanned = len(json.load(f)["imports"])
+        self.assertGreater(scanned, 1)
+        # Only the file scanned by this run is kept
+        graph = ProtoGraph(cacheFile)
+        graph.imports(self._path("b/right.proto"))
+        graph.save()
+        with open(cacheFile) as f:
+            self.assertEqual(len(json.load(f)["imports"]), 1)
+
+    def test_unwritable_cache(self) -> None:
+        notADir = os.path.join(self.td.name, "file")
+        with open(notADir, "w"):
+            pass
+        graph = ProtoGraph(os.path.join(notADir, "proto_imports.json"))
+        expected = graph.findProtoIncludes(str(self.root), self.dirs)
+        graph.save()
+        self.assertEqual(
+            ProtoGraph().findProtoIncludes(str(self.root), self.dirs), expected
+        )
+
+    def test_reset(self) -> None:
+        graph = ProtoGraph()
+        graph.findProtoIncludes(str(self.root), self.dirs)
+        common = self.base / "b" / "common.proto"
+        common.write_text('import "extra.proto";\n')
+        (self.base / "a" / "extra.proto").write_text("")
+        os.utime(common, ns=(0, common.stat().st_mtime_ns + 1_000_000_000))
+        graph.reset()
+        closure = graph.findProtoIncludes(str(self.root), self.dirs)
+        self.assertEqual(
+            closure[str(common)], [(self._path("a/extra.proto"), self.dirs[0])]
+        )
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import unittest
+from typing import List, Set, Tuple
+from unittest import mock
+
+import watch
+from bench.synthetic import SyntheticProject, generateProject
+from daemon import Daemon
+
+
+def _touch(path: str, content: str = "") -> None:
+    with open(path, "a") as f:
+        f.write(content)
+    # Some filesystems have a coarse mtime, the size change is enough for the stamp
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        self.tracked = os.path.join(self.td.name, "tracked")
+        self.untracked = os.path.join(self.td.name, "untracked")
+        os.mkdir(self.tracked)
+        os.mkdir(self.untracked)
+        self.header = os.path.join(self.tracked, "a.h")
+        self.other = os.path.join(self.untracked, "b.h")
+        _touch(self.header)
+        _touch(self.other)
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_polling(self) -> None:
+        with watch.PollingWatcher([self.header, self.tracked], interval=0.01) as w:
+            self.assertEqual(w.wait(timeout=0.05), set())
+            _touch(self.header, "#pragma once\n")
+            _touch(self.other, "#pragma once\n")
+            self.assertEqual(w.wait(timeout=1), {self.header})
+
+    def test_inotify(self) -> None:
+        try:
+            w = watch.InotifyWatcher([self.header, self.tracked, self.other])
+        except OSError as e:
+            self.skipTest(f"inotify is not available: {e}")
+        with w:
+            self.assertEqual(w.wait(timeout=0.05), set())
+            _touch(self.header, "#pragma once\n")
+            self.assertEqual(w.wait(timeout=1), {self.header})
+            # A new entry in a tracked directory is reported
+            added = os.path.join(self.tracked, "new.h")
+            _touch(added)
+            self.assertEqual(w.wait(timeout=1), {added})
+            # Not in an untracked one
+            _touch(os.path.join(self.untracked, "new.h"))
+            self.assertEqual(w.wait(timeout=0.2), set())
+
+
+class _ScriptedWatcher:
+    """Apply a change when waited on and report it."""
+
+    def __init__(self, changes: List[Tuple[str, str]], watched: List[Set[str]]):
+        self.changes = changes
+        self.watched = watched
+
+    def __call__(self, paths: List[str]) -> "_ScriptedWatcher":
+        self.watched.append(set(paths))
+        return self
+
+    def wait(self, timeout=None) -> Set[str]:
+        path, content = self.changes.pop(0)
+        _touch(path, content)
+        return {path}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.td = tempfile.TemporaryDirectory()
+        # Keep the caches out of the developer's home
+        env = {"HOME": self.td.name, "XDG_CACHE_HOME": f"{self.td.name}/cache"}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        project = SyntheticProject(
+            libraries=3,
+            sources=2,
+            generatorEvery=0,
+            protoEvery=0,
+            configureEvery=0,
+            appEvery=2,
+        )
+        self.project = generateProject(project, self.td.name)
+        self.argv = [self.project.ninjaFile, self.project.srcDir]
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_only_impacted_build_files_are_rewritten(self) -> None:
+        header = f"{self.project.srcDir}/mod0/include/mod0/h0.h"
+        with open(f"{self.project.srcDir}/mod0/include/mod0/extra.h", "w") as f:
+            f.write("#pragma once\n")
+        daemon = Daemon()
+        watched: List[Set[str]] = []
+        written: List[List[str]] = []
+        handle = daemon.handle
+
+        def recordingHandle(request):
+            reply = handle(request)
+            written.append(reply["written"])
+            return reply
+
+        daemon.handle = recordingHandle  # type: ignore[method-assign]
+        watch.watch(
+            self.argv,
+            self.td.name,
+            daemon,
+            _ScriptedWatcher(
+                [
+                    (header, '#include "mod0/extra.h"\n'),
+                    (header, "// No new include\n"),
+                ],
+                watched,
+            ),
+            rounds=3,
+        )
+        self.assertIn(header, watched[0])
+        self.assertIn(os.path.realpath(self.project.ninjaFile), watched[0])
+        buildFile = os.path.join(self.project.srcDir, "BUILD.bazel")
+        self.assertEqual([os.path.normpath(p) for p in written[0]], [buildFile])
+        self.assertEqual([os.path.normpath(p) for p in written[1]], [buildFile])
+        with open(buildFile) as f:
+            self.assertIn("extra.h", f.read())
+        # The header was rescanned but the BUILD file didn't change
+        self.assertEqual(written[2], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
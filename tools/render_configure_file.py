@@ -88,33 +88,63 @@ def render_template(template: str, definitions: dict[str, str]) -> str:
     return DOLLAR_PLACEHOLDER_RE.sub(replace_dollar, rendered)
 
 
-def generate_file(
-    template_path: Path,
-    output_path: Path,
-    values_paths: list[Path],
-    variables: dict[str, str],
-) -> None:
+def load_definitions(values_paths: list[Path], variables: dict[str, str]) -> dict[str, str]:
     definitions: dict[str, str] = {}
     for values_path in values_paths:
         definitions.update(parse_cmake_definitions(values_path.read_text()))
     definitions.update(variables)
+    return definitions
+
+
+def _write_rendered(template_path: Path, output_path: Path, definitions: dict[str, str]) -> None:
     rendered = render_template(template_path.read_text(), definitions)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(rendered)
 
 
+def generate_file(
+    template_path: Path,
+    output_path: Path,
+    values_paths: list[Path],
+    variables: dict[str, str],
+) -> None:
+    generate_files([(template_path, output_path)], values_paths, variables)
+
+
+def generate_files(
+    renders: list[tuple[Path, Path]],
+    values_paths: list[Path],
+    variables: dict[str, str],
+) -> None:
+    # The value files are parsed once and shared by all the templates of the batch
+    definitions = load_definitions(values_paths, variables)
+    for template_path, output_path in renders:
+        _write_rendered(template_path, output_path, definitions)
+
+
 def main() -> int:
-    parser = argparse.ArgumentParser(description="Render a CMake configure_file template")
-    parser.add_argument("template")
-    parser.add_argument("output")
-    parser.add_argument("values", nargs="*")
+    parser = argparse.ArgumentParser(description="Render CMake configure_file templates")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="PATH",
+        help="TEMPLATE OUTPUT VALUES..., or only VALUES... when --render is used",
+    )
+    parser.add_argument(
+        "--render",
+        action="append",
+        nargs=2,
+        default=[],
+        metavar=("TEMPLATE", "OUTPUT"),
+        help="Render TEMPLATE into OUTPUT, can be repeated to render several templates at once",
+    )
     parser.add_argument(
         "--var",
         action="append",
         default=[],
         help="Template variable in the form key=value",
     )
-    args = parser.parse_args()
+    args = parser.parse_intermixed_args()
 
     variables = {}
     for variable in args.var:
@@ -122,12 +152,15 @@ def main() -> int:
             parser.error(f"--var must be in the form key=value: {variable}")
         key, value = variable.split("=", 1)
         variables[key] = value
-    generate_file(
-        Path(args.template),
-        Path(args.output),
-        [Path(v) for v in args.values],
-        variables,
-    )
+
+    renders = [(Path(template), Path(output)) for template, output in args.render]
+    values = args.paths
+    if not renders:
+        if len(args.paths) < 2:
+            parser.error("TEMPLATE and OUTPUT are required when --render is not used")
+        renders = [(Path(args.paths[0]), Path(args.paths[1]))]
+        values = args.paths[2:]
+    generate_files(renders, [Path(v) for v in values], variables)
     return 0
 
 
@@ -11,7 +11,9 @@ class VisitorContext:
         self.producer = None
 
     def setup_subcontext(self) -> "VisitorContext":
-        newCtx = VisitorContext(**self.__dict__)
+        # producer is not a field, it can't go through the constructor
+        newCtx = VisitorContext(self.parentIsPhony)
+        newCtx.producer = self.producer
         return newCtx
 
     def cleanup(self) -> None:
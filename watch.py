@@ -0,0 +1,209 @@
+import ctypes
+import logging
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from daemon import Daemon
+from includescanner import Stamp, statStamp
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+# Events on an entry of a directory, they matter for a tracked directory even if the entry
+# itself is not tracked (ie. a header added next to the scanned ones)
+_ENTRY_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# wd, mask, cookie, len followed by len bytes of name
+_EVENT = struct.Struct("iIII")
+
+# Editors save in several steps, the events arriving within this delay are merged
+SETTLE_DELAY = 0.1
+
+
+class PollingWatcher:
+    """Report the paths whose mtime or size changed, by stat()-ing all of them."""
+
+    def __init__(self, paths: Iterable[str], interval: float = 1.0):
+        self.interval = interval
+        self._stamps: Dict[str, Stamp] = {p: statStamp(p) for p in paths}
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait for changes, return the changed paths (empty after timeout seconds)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, stamp in self._stamps.items():
+                current = statStamp(path)
+                if current != stamp:
+                    changed.add(path)
+                    self._stamps[path] = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available")
+    return libc
+
+
+class InotifyWatcher:
+    """Report the changed paths using inotify, the directories of the paths are watched
+    so that files replaced by a rename (like most editors do) are still seen."""
+
+    def __init__(self, paths: Iterable[str]):
+        self._libc = _libc()
+        self._paths = set(paths)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._dirs: Dict[int, str] = {}
+        directories = {
+            p if os.path.isdir(p) else os.path.dirname(p) for p in self._paths
+        }
+        for directory in sorted(directories):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), _WATCH_MASK
+            )
+            if wd < 0:
+                # Most likely a directory that doesn't exist (yet)
+                logging.debug(
+                    "Can't watch %s: %s", directory, os.strerror(ctypes.get_errno())
+                )
+                continue
+            self._dirs[wd] = directory
+
+    def _relevant(self, directory: str, name: str, mask: int) -> Optional[str]:
+        path = os.path.join(directory, name) if name else directory
+        if path in self._paths:
+            return path
+        if mask & _ENTRY_MASK and directory in self._paths:
+            return path
+        return None
+
+    def _read(self) -> Set[str]:
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, everything might have changed
+                changed.update(self._paths)
+            elif wd in self._dirs:
+                path = self._relevant(self._dirs[wd], name, mask)
+                if path is not None:
+                    changed.add(path)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait for changes, return the changed paths (empty after timeout seconds)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: Set[str] = set()
+        while not changed:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return changed
+            if not select.select([self._fd], [], [], remaining)[0]:
+                continue
+            changed.update(self._read())
+        while select.select([self._fd], [], [], SETTLE_DELAY)[0]:
+            changed.update(self._read())
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def makeWatcher(paths: Iterable[str]):
+    """An inotify watcher if the platform has it, a polling one otherwise."""
+    paths = list(paths)
+    try:
+        return InotifyWatcher(paths)
+    except OSError as e:
+        logging.info("Falling back to polling the files: %s", e)
+        return PollingWatcher(paths)
+
+
+def watch(
+    argv: List[str],
+    cwd: str,
+    daemon: Optional[Daemon] = None,
+    watcherFactory=makeWatcher,
+    rounds: Optional[int] = None,
+) -> None:
+    """Convert argv, then convert again each time one of the files it depends on changes.
+
+    Only the modified files are rescanned and only the BUILD files whose content changed
+    are rewritten. Stops after rounds conversions if set.
+    """
+    daemon = daemon or Daemon()
+    done = 0
+    while True:
+        reply = daemon.handle({"argv": argv, "cwd": cwd, "write": True})
+        done += 1
+        if reply["ok"]:
+            print(
+                f"Rewrote {len(reply['written'])} BUILD files in {reply['seconds']:.2f}s"
+            )
+        else:
+            logging.error("The conversion failed: %s", reply["error"])
+        if rounds is not None and done >= rounds:
+            return
+
+        with watcherFactory(daemon.watchedPaths(argv, cwd)) as watcher:
+            # Modified between the conversion and the start of the watch
+            changed = set(daemon.changedPaths(argv, cwd)) if reply["ok"] else set()
+            while not changed:
+                changed = watcher.wait()
+        logging.info("%d files changed, converting again", len(changed))
+        logging.debug("Changed: %s", sorted(changed))